@@ -0,0 +1,92 @@
+"""JWT authentication without a user query per request.
+
+``JWTAuthentication`` decodes and verifies the token and then loads the user
+from the database on every request. ``CachedJWTAuthentication`` keeps both:
+
+* Verified access tokens are kept in a small per-process LRU keyed by the
+  raw token, so a client repeating the same token skips the signature check
+  and claim parsing. Entries are only served until the token's own ``exp``.
+  Nothing in them can be revoked; the user behind each is checked below.
+* With ``SHARED_CACHE``, users are kept in the cache for
+  ``AUTH_USER_CACHE_TTL`` seconds under a per-user version, which
+  ``invalidate_user`` bumps whenever the user is saved or deleted (see
+  ``accounts.signals``), so deactivating a user or changing their password
+  takes effect on their next request. Changes made with
+  ``QuerySet.update()`` skip the signal and show after the TTL. A
+  per-process cache would only see the bumps of its own worker, so users
+  are then loaded on every request.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+USER_KEY = 'auth:user:{}:{}'
+USER_VERSION_KEY = 'auth:version:user:{}'
+
+_tokens = OrderedDict()
+_tokens_lock = threading.Lock()
+
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def invalidate_user(user_id):
+    bump_version(USER_VERSION_KEY.format(user_id))
+
+
+def clear_tokens():
+    with _tokens_lock:
+        _tokens.clear()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_validated_token(self, raw_token):
+        with _tokens_lock:
+            entry = _tokens.get(raw_token)
+            if entry is not None:
+                _tokens.move_to_end(raw_token)
+        if entry is not None and entry[1] > time.time():
+            return entry[0]
+
+        token = super().get_validated_token(raw_token)
+        expires = token.get('exp')
+        if expires is not None:
+            with _tokens_lock:
+                _tokens[raw_token] = (token, expires)
+                _tokens.move_to_end(raw_token)
+                while len(_tokens) > settings.AUTH_TOKEN_CACHE_SIZE:
+                    _tokens.popitem(last=False)
+        return token
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None or not settings.SHARED_CACHE:
+            return super().get_user(validated_token)
+
+        version = cache.get(USER_VERSION_KEY.format(user_id), 0)
+        key = USER_KEY.format(user_id, version)
+        user = cache.get(key)
+        if user is None:
+            # Raises for missing and inactive users, which are never cached.
+            user = super().get_user(validated_token)
+            cache.set(key, user, settings.AUTH_USER_CACHE_TTL)
+            return user
+
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+            api_settings.REVOKE_TOKEN_CLAIM
+        ) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed(
+                "The user's password has been changed.", code='password_changed'
+            )
+        return user
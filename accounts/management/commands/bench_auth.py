@@ -0,0 +1,78 @@
+import json
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts import authentication
+from accounts.authentication import CachedJWTAuthentication
+
+User = get_user_model()
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the per-request cost of authenticating a bearer token with '
+        'JWTAuthentication and with CachedJWTAuthentication.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=5000)
+        parser.add_argument('--warmup', type=int, default=100)
+
+    # One process, so the per-process default cache is as good as a shared one.
+    @override_settings(SHARED_CACHE=True)
+    def handle(self, *args, **options):
+        results = {}
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(
+                    email='bench-auth@example.com', display_name='Bench', username='bench-auth',
+                    is_active=True,
+                )
+                request = APIRequestFactory().get(
+                    '/api/files/', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}'
+                )
+                for name, backend in (('jwt', JWTAuthentication()), ('cached', CachedJWTAuthentication())):
+                    results[name] = self.measure(backend, request, user, options)
+                raise Rollback
+        except Rollback:
+            pass
+        results['speedup'] = round(results['jwt']['mean_us'] / results['cached']['mean_us'], 2)
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def measure(self, backend, request, user, options):
+        cache.clear()
+        authentication.clear_tokens()
+        for _ in range(options['warmup']):
+            self.authenticate(backend, request, user)
+        latencies, queries = [], []
+        for _ in range(options['iterations']):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                self.authenticate(backend, request, user)
+                latencies.append((time.perf_counter() - started) * 1_000_000)
+            queries.append(len(captured))
+        latencies.sort()
+        return {
+            'p50_us': round(latencies[len(latencies) // 2], 1),
+            'p99_us': round(latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)], 1),
+            'mean_us': round(statistics.fmean(latencies), 1),
+            'queries_per_request': round(statistics.fmean(queries), 2),
+        }
+
+    def authenticate(self, backend, request, user):
+        authenticated, _ = backend.authenticate(request)
+        assert authenticated.pk == user.pk
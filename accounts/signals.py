@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import authentication
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_changed(sender, instance, **kwargs):
+    user_id = instance.pk
+    authentication.invalidate_user(user_id)
+    # Again once committed, in case a request cached the old row in between.
+    transaction.on_commit(lambda: authentication.invalidate_user(user_id))
@@ -1,3 +1,29 @@
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
 
-# Create your tests here.
+from .authentication import CachedJWTAuthentication
+from .models import User
+
+
+@override_settings(SHARED_CACHE=True)
+class CachedJWTAuthenticationTests(TestCase):
+    """Repeat requests skip the user query until the user is saved."""
+
+    def test_cached_user_is_dropped_on_save(self):
+        user = User.objects.create_user('owner@example.com', 'Owner', 'owner', is_active=True)
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        backend = CachedJWTAuthentication()
+        self.assertEqual(backend.authenticate(request)[0], user)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(backend.authenticate(request)[0], user)
+        self.assertEqual(len(queries), 0)
+
+        user.is_active = False
+        user.save()
+        with self.assertRaises(AuthenticationFailed):
+            backend.authenticate(request)
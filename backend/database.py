@@ -0,0 +1,58 @@
+"""Database settings built from the environment.
+
+``DATABASE_URL`` picks the engine (SQLite by default, PostgreSQL with a
+``postgres://`` URL) and ``DATABASE_REPLICA_URLS`` adds read replicas, which
+``backend.routers`` sends safe requests to. ``configure`` adds what every
+connection needs on top of the URL:
+
+* SQLite runs in WAL mode so readers never wait for the writer, with
+  ``synchronous``, ``busy_timeout`` and ``mmap_size`` pragmas run on every
+  new connection, and ``BEGIN IMMEDIATE`` transactions: a transaction that
+  reads first and writes later then queues for the write lock up front
+  instead of failing with "database is locked" when it tries to upgrade.
+* Connections are kept open for ``DB_CONN_MAX_AGE`` seconds and checked
+  before reuse, or taken from psycopg's pool with ``DB_POOL`` on PostgreSQL.
+
+This module is imported by the settings, so it must not import Django's
+database layer.
+"""
+
+
+def sqlite_options(journal_mode='wal', synchronous='normal', busy_timeout=5000,
+                   mmap_size=0, transaction_mode='IMMEDIATE'):
+    pragmas = [
+        f'PRAGMA journal_mode={journal_mode}',
+        f'PRAGMA synchronous={synchronous}',
+        f'PRAGMA busy_timeout={int(busy_timeout)}',
+        f'PRAGMA mmap_size={int(mmap_size)}',
+    ]
+    return {
+        'init_command': ';'.join(pragmas),
+        'transaction_mode': transaction_mode or None,
+    }
+
+
+def configure(config, conn_max_age=0, pool=False, sqlite=None):
+    """Return ``config`` (one ``DATABASES`` entry) with connection handling applied."""
+    config = {**config, 'OPTIONS': dict(config.get('OPTIONS') or {})}
+    config['CONN_HEALTH_CHECKS'] = True
+    config['CONN_MAX_AGE'] = conn_max_age
+    if config['ENGINE'] == 'django.db.backends.sqlite3':
+        config['OPTIONS'].update(sqlite or sqlite_options())
+    elif config['ENGINE'] == 'django.db.backends.postgresql' and pool:
+        # Pooled connections go back to the pool after each request instead.
+        config['OPTIONS']['pool'] = True
+        config['CONN_MAX_AGE'] = 0
+    return config
+
+
+def replicas(configs, **kwargs):
+    """``DATABASES`` entries named ``replica_<n>`` for each replica config."""
+    return {
+        f'replica_{index}': {
+            **configure(config, **kwargs),
+            # Tests run against the primary's database.
+            'TEST': {'MIRROR': 'default'},
+        }
+        for index, config in enumerate(configs)
+    }
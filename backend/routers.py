@@ -0,0 +1,112 @@
+"""Read replica routing with read-your-writes.
+
+Reads go to a random replica only while ``ReplicaMiddleware`` serves a safe
+request (GET, HEAD, OPTIONS) for a client that has not written recently.
+Everything else reads from the primary: unsafe requests, requests inside a
+transaction, the rest of a request after its first write, management
+commands and background jobs, which read and write in the same breath.
+
+A client that writes has its reads pinned to the primary for
+``DATABASE_REPLICA_PIN_SECONDS``, longer than the replicas are expected to
+lag, so it always sees its own changes. The pin is a short-lived cookie and,
+for an authenticated user, a cache entry keyed on the user, since API clients
+sending bearer tokens do not keep cookies. The user is only known once the
+view has authenticated the request, so the pin is checked on the first read
+after that; the reads authentication itself makes may still hit a replica.
+Other workers only see the cache entry with ``SHARED_CACHE``; without it,
+authenticated requests always read from the primary. Without replicas
+configured every query goes to ``default``.
+"""
+import random
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.functional import LazyObject
+
+PIN_COOKIE = 'db_primary'
+PIN_KEY = 'db:primary:user:{}'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_state = threading.local()
+
+
+def reading_from_replicas():
+    return getattr(_state, 'replicas', False)
+
+
+def authenticated_user(request):
+    """The request's user once DRF has authenticated it, else None."""
+    # Before that, it is Django's lazy session user; resolving it would read.
+    user = request.__dict__.get('user')
+    if user is None or isinstance(user, LazyObject) or not user.is_authenticated:
+        return None
+    return user
+
+
+def user_pinned(user):
+    # A per-process pin would not be seen by the worker serving the next request.
+    return not settings.SHARED_CACHE or cache.get(PIN_KEY.format(user.pk)) is not None
+
+
+def pin_user(user):
+    if settings.SHARED_CACHE:
+        cache.set(PIN_KEY.format(user.pk), True, settings.DATABASE_REPLICA_PIN_SECONDS)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not reading_from_replicas() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if not _state.user_checked:
+            user = authenticated_user(_state.request)
+            if user is not None:
+                _state.user_checked = True
+                if user_pinned(user):
+                    _state.replicas = False
+                    return DEFAULT_DB_ALIAS
+        return random.choice(_state.aliases)
+
+    def db_for_write(self, model, **hints):
+        if reading_from_replicas():
+            # Whatever the request reads next must include this write.
+            _state.replicas = False
+            _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        aliases = settings.DATABASE_REPLICAS
+        _state.aliases = aliases
+        _state.replicas = bool(aliases) and (
+            request.method in SAFE_METHODS and PIN_COOKIE not in request.COOKIES
+        )
+        _state.wrote = _state.user_checked = False
+        _state.request = request
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = _state.wrote
+            _state.replicas = _state.wrote = False
+            _state.request = None
+        if aliases and (wrote or request.method not in SAFE_METHODS):
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.DATABASE_REPLICA_PIN_SECONDS,
+                httponly=True, samesite='Lax'
+            )
+            user = authenticated_user(request)
+            if user is not None:
+                pin_user(user)
+        return response
@@ -3,5 +3,6 @@ from django.urls import path, include
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/', include('accounts.urls'))
+    path('api/', include('accounts.urls')),
+    path('api/', include('storage.urls')),
 ]
@@ -0,0 +1,228 @@
+"""Buffered, asynchronous activity logging.
+
+Views call ``record(request, activity_type, ...)`` instead of creating
+``ActivityLog`` rows inline. The client IP and user agent are picked up
+from ``request.activity_data`` (set by ``ActivityLogMiddleware``). Events
+go into an in-process queue, and a background thread writes them with
+``bulk_create`` once ``ACTIVITY_LOG_BATCH_SIZE`` events are waiting or
+``ACTIVITY_LOG_FLUSH_INTERVAL`` seconds have passed. Whatever is still
+queued is flushed at interpreter exit.
+
+When the queue is full, ``ACTIVITY_LOG_OVERFLOW`` decides what happens:
+
+``drop_newest``
+    reject the new event;
+``drop_oldest``
+    evict the oldest queued event to make room;
+``block``
+    wait up to ``ACTIVITY_LOG_BLOCK_TIMEOUT`` seconds for room, then drop.
+
+``ACTIVITY_LOG_MODE = "sync"`` bypasses the queue and writes each event
+directly, which is what tests and management commands usually want.
+
+Every write also bumps the matching ``ActivityRollup`` counters in the same
+transaction, so reports never have to scan raw events.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ActivityLog, ActivityRollup
+
+logger = logging.getLogger(__name__)
+
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+BLOCK = 'block'
+
+
+class ActivitySink:
+    def __init__(self, max_queue=10000, batch_size=500, flush_interval=1.0,
+                 overflow=DROP_OLDEST, block_timeout=0.05):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.events = deque()
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+        self.counters = {'queued': 0, 'flushed': 0, 'dropped': 0, 'failed': 0}
+        self.thread = None
+        self.pid = None
+        self.closed = False
+
+    def enqueue(self, event):
+        with self.lock:
+            self.ensure_thread()
+            if len(self.events) >= self.max_queue:
+                if self.overflow == DROP_OLDEST:
+                    self.events.popleft()
+                    self.counters['dropped'] += 1
+                elif self.overflow == BLOCK:
+                    self.not_full.wait_for(
+                        lambda: len(self.events) < self.max_queue, self.block_timeout
+                    )
+                if len(self.events) >= self.max_queue:
+                    self.counters['dropped'] += 1
+                    return False
+            self.events.append(event)
+            self.counters['queued'] += 1
+            if len(self.events) >= self.batch_size:
+                self.not_empty.notify()
+        return True
+
+    def ensure_thread(self):
+        # Threads do not survive a fork, so pre-forking servers need a new one per worker.
+        if self.thread is None or self.pid != os.getpid() or not self.thread.is_alive():
+            self.pid = os.getpid()
+            self.closed = False
+            self.thread = threading.Thread(
+                target=self.run, name='activity-sink', daemon=True
+            )
+            self.thread.start()
+
+    def take_batch(self):
+        with self.lock:
+            batch = [self.events.popleft() for _ in range(min(self.batch_size, len(self.events)))]
+            self.not_full.notify_all()
+        return batch
+
+    def run(self):
+        while not self.closed:
+            with self.lock:
+                deadline = time.monotonic() + self.flush_interval
+                self.not_empty.wait_for(
+                    lambda: self.closed or len(self.events) >= self.batch_size,
+                    max(deadline - time.monotonic(), 0)
+                )
+            self.flush()
+
+    def flush(self):
+        """Write out everything queued so far, one batch at a time."""
+        while True:
+            batch = self.take_batch()
+            if not batch:
+                return
+            self.write(batch)
+
+    def write(self, batch):
+        close_old_connections()
+        try:
+            write_events(batch)
+        except Exception:
+            logger.exception('Dropping %d activity events that could not be written', len(batch))
+            with self.lock:
+                self.counters['failed'] += len(batch)
+        else:
+            with self.lock:
+                self.counters['flushed'] += len(batch)
+        finally:
+            close_old_connections()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.not_empty.notify_all()
+        if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+            self.thread.join(timeout=5)
+        self.flush()
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, 'pending': len(self.events)}
+
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+def get_sink():
+    global _sink
+    with _sink_lock:
+        if _sink is None:
+            _sink = ActivitySink(
+                max_queue=settings.ACTIVITY_LOG_QUEUE_SIZE,
+                batch_size=settings.ACTIVITY_LOG_BATCH_SIZE,
+                flush_interval=settings.ACTIVITY_LOG_FLUSH_INTERVAL,
+                overflow=settings.ACTIVITY_LOG_OVERFLOW,
+                block_timeout=settings.ACTIVITY_LOG_BLOCK_TIMEOUT,
+            )
+            atexit.register(_sink.close)
+    return _sink
+
+
+def record(request, activity_type, file=None, folder=None, details=None, user=None):
+    activity_data = getattr(request, 'activity_data', None) or {}
+    if user is None and request.user.is_authenticated:
+        user = request.user
+    event = {
+        'user_id': user.pk if user else None,
+        'file_id': file.pk if file else None,
+        'folder_id': folder.pk if folder else None,
+        'activity_type': activity_type,
+        'ip_address': activity_data.get('ip_address'),
+        'user_agent': activity_data.get('user_agent'),
+        'details': details or {},
+        'created_at': timezone.now(),
+    }
+    if settings.ACTIVITY_LOG_MODE == 'sync':
+        write_events([event])
+        return True
+    return get_sink().enqueue(event)
+
+
+def write_events(events):
+    """Insert raw events and fold them into the daily rollups, atomically."""
+    with transaction.atomic():
+        ActivityLog.objects.bulk_create([ActivityLog(**event) for event in events])
+        add_to_rollups(events)
+
+
+def rollup_key(event):
+    return (
+        timezone.localdate(event.get('created_at') or timezone.now()),
+        event['activity_type'],
+        event.get('user_id') or 0,
+        event.get('file_id') or 0,
+        event.get('folder_id') or 0,
+    )
+
+
+UPSERT_SQL = (
+    'INSERT INTO {table} (day, activity_type, user_id, file_id, folder_id, count) '
+    'VALUES (%s, %s, %s, %s, %s, %s) '
+    'ON CONFLICT (day, activity_type, user_id, file_id, folder_id) '
+    'DO UPDATE SET count = {table}.count + excluded.count'
+)
+
+
+def add_to_rollups(events):
+    counts = Counter(rollup_key(event) for event in events)
+    if connection.vendor in ('sqlite', 'postgresql'):
+        table = connection.ops.quote_name(ActivityRollup._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                UPSERT_SQL.format(table=table),
+                [
+                    (connection.ops.adapt_datefield_value(day), *rest, count)
+                    for (day, *rest), count in counts.items()
+                ]
+            )
+        return
+
+    fields = ('day', 'activity_type', 'user_id', 'file_id', 'folder_id')
+    for key, count in counts.items():
+        lookup = dict(zip(fields, key))
+        updated = ActivityRollup.objects.filter(**lookup).update(count=F('count') + count)
+        if not updated:
+            ActivityRollup.objects.create(count=count, **lookup)
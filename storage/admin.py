@@ -1,9 +1,12 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.db.models import Count, Q
+from django.db.models.expressions import RawSQL
 from django.utils.html import format_html
 from django.urls import reverse
+from . import search, trash
 from .models import (
-    ShareLink, ActivityLog, FileShare, FolderShare,
-    Folder, File
+    ShareLink, ActivityLog, ActivityRollup, FileShare, FolderShare,
+    Folder, File, StorageUsage
 )
 
 @admin.register(ShareLink)
@@ -44,6 +47,18 @@ class ActivityLogAdmin(admin.ModelAdmin):
         return "-"
     resource_name.short_description = 'Resource'
 
+@admin.register(ActivityRollup)
+class ActivityRollupAdmin(admin.ModelAdmin):
+    list_display = ('day', 'activity_type', 'user_id', 'file_id', 'folder_id', 'count')
+    list_filter = ('activity_type', 'day')
+    date_hierarchy = 'day'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 @admin.register(FileShare)
 class FileShareAdmin(admin.ModelAdmin):
     list_display = ('file', 'user', 'permission', 'created_at', 'expires_at', 'is_active')
@@ -58,32 +73,99 @@ class FolderShareAdmin(admin.ModelAdmin):
     search_fields = ('folder__name', 'user__username')
     raw_id_fields = ('folder', 'user')
 
+def indexed_search(model_admin, request, queryset, search_term, kind):
+    """Match names through the search index instead of LIKE scans over joins."""
+    matches = search.matching_ids(kind, search_term)
+    if matches is None:
+        return admin.ModelAdmin.get_search_results(model_admin, request, queryset, search_term)
+    sql, params = matches
+    return queryset.filter(
+        Q(pk__in=RawSQL(sql, params)) | Q(owner__username=search_term.strip())
+    ), False
+
+class TrashedFilter(admin.SimpleListFilter):
+    title = 'in trash'
+    parameter_name = 'trashed'
+
+    def lookups(self, request, model_admin):
+        return (('yes', 'Yes'), ('no', 'No'))
+
+    def queryset(self, request, queryset):
+        if self.value() in ('yes', 'no'):
+            return queryset.filter(trashed_at__isnull=self.value() == 'no')
+        return queryset
+
+class TrashAdminMixin:
+    """List trashed rows, which the default manager leaves out, and restore them."""
+    actions = ['restore_selected']
+
+    def get_queryset(self, request):
+        queryset = self.model.all_objects.get_queryset()
+        ordering = self.get_ordering(request)
+        return queryset.order_by(*ordering) if ordering else queryset
+
+    @admin.action(description='Restore selected items from the trash')
+    def restore_selected(self, request, queryset):
+        restored = 0
+        for obj in queryset.filter(trashed_at__isnull=False):
+            try:
+                self.restore(obj)
+            except trash.RestoreConflict as e:
+                self.message_user(request, f'{obj.name}: {e.detail}', messages.WARNING)
+            else:
+                restored += 1
+        self.message_user(request, f'Restored {restored} item(s) from the trash.')
+
 class FileInline(admin.TabularInline):
     model = File
     extra = 0
-    fields = ('name', 'size', 'mime_type', 'created_at')
-    readonly_fields = ('created_at',)
+    fields = ('name', 'size', 'mime_type', 'created_at', 'trashed_at')
+    readonly_fields = ('created_at', 'trashed_at')
     show_change_link = True
 
+    def get_queryset(self, request):
+        return File.all_objects.all()
+
 @admin.register(Folder)
-class FolderAdmin(admin.ModelAdmin):
-    list_display = ('name', 'owner', 'parent', 'created_at', 'file_count')
-    list_filter = ('created_at', 'owner')
-    search_fields = ('name', 'owner__username', 'description')
+class FolderAdmin(TrashAdminMixin, admin.ModelAdmin):
+    list_display = ('name', 'owner', 'parent', 'created_at', 'file_count', 'trashed_at')
+    list_filter = (TrashedFilter, 'created_at', 'owner')
+    search_fields = ('name', 'description', '=owner__username')
     raw_id_fields = ('parent', 'owner')
+    readonly_fields = ('trashed_at',)
     inlines = [FileInline]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(_file_count=Count('files', distinct=True))
+
+    def restore(self, folder):
+        trash.restore_folder(folder)
+
+    def get_search_results(self, request, queryset, search_term):
+        return indexed_search(self, request, queryset, search_term, 'folder')
     
     def file_count(self, obj):
-        return obj.file_set.count()
+        return obj._file_count
     file_count.short_description = 'Files'
+    file_count.admin_order_field = '_file_count'
 
 @admin.register(File)
-class FileAdmin(admin.ModelAdmin):
+class FileAdmin(TrashAdminMixin, admin.ModelAdmin):
     list_display = ('name', 'folder', 'owner', 'size_display', 'mime_type', 
-                   'created_at', 'share_count')
-    list_filter = ('mime_type', 'created_at')
-    search_fields = ('name', 'owner__username', 'folder__name')
+                   'created_at', 'share_count', 'trashed_at')
+    list_filter = (TrashedFilter, 'mime_type', 'created_at')
+    search_fields = ('name', '=owner__username')
     raw_id_fields = ('folder', 'owner')
+    readonly_fields = ('trashed_at',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(_share_count=Count('shared_users', distinct=True))
+
+    def restore(self, file):
+        trash.restore_file(file)
+
+    def get_search_results(self, request, queryset, search_term):
+        return indexed_search(self, request, queryset, search_term, 'file')
     
     def size_display(self, obj):
         """Convert size to human-readable format"""
@@ -95,5 +177,13 @@ class FileAdmin(admin.ModelAdmin):
     size_display.short_description = 'Size'
     
     def share_count(self, obj):
-        return obj.shared_users.count()
-    share_count.short_description = 'Shares'
\ No newline at end of file
+        return obj._share_count
+    share_count.short_description = 'Shares'
+    share_count.admin_order_field = '_share_count'
+
+@admin.register(StorageUsage)
+class StorageUsageAdmin(admin.ModelAdmin):
+    list_display = ('user', 'bytes_used', 'file_count', 'quota', 'updated_at')
+    search_fields = ('user__username', 'user__email')
+    raw_id_fields = ('user',)
+    readonly_fields = ('bytes_used', 'file_count', 'updated_at')
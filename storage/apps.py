@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class StorageConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'storage'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        from . import checks, search, sharing, signals, subtrees  # noqa: F401
+        post_migrate.connect(search.install, sender=self)
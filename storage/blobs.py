@@ -0,0 +1,184 @@
+"""Content-addressed blob store.
+
+Every distinct file body is stored once under ``blobs/ab/cd/<sha256>`` and
+shared by all ``File`` rows that hold the same bytes. The digest is computed
+while the upload streams (``HashingUploadHandler`` for multipart uploads,
+``BlobWriter`` for chunked sessions), so no file is ever read twice.
+``Blob.ref_count`` is maintained by the signals in ``storage.signals`` and
+``gc_blobs`` reclaims blobs nobody references any more.
+
+Writers ``claim`` a blob's row (touching ``updated_at``) before they rely on
+its body, and ``collect`` deletes a body inside the transaction that deletes
+its row. A writer racing the collector therefore either keeps the row alive
+or waits for the delete and then stores the body again.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import thumbnails
+from .models import Blob
+
+COPY_BUFFER_SIZE = 64 * 1024
+
+
+def blob_name(sha256):
+    return f'blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}'
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """Hash multipart file fields as they stream through the upload handlers.
+
+    It must come first in ``FILE_UPLOAD_HANDLERS``; it passes every chunk on
+    unchanged and lets the next handler build the uploaded file object.
+    """
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        digests = getattr(self.request, 'upload_digests', {})
+        digests[self.field_name] = self.digest.hexdigest()
+        self.request.upload_digests = digests
+        return None
+
+
+def upload_digest(request, field_name):
+    return getattr(request, 'upload_digests', {}).get(field_name)
+
+
+class BlobWriter:
+    """Write a body to a temporary file, hashing it on the way to disk."""
+
+    def __init__(self, storage=default_storage):
+        self.storage = storage
+        tmp_dir = storage.path('blobs/tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        self.out = os.fdopen(fd, 'wb')
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.digest.update(data)
+        self.size += len(data)
+        self.out.write(data)
+
+    def commit(self):
+        self.out.close()
+        return publish(self.tmp_path, self.digest.hexdigest(), self.size, self.storage)
+
+    def abort(self):
+        self.out.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+
+
+def publish(tmp_path, sha256, size, storage=default_storage):
+    """Move a fully written body into place, or drop it if already stored."""
+    name = blob_name(sha256)
+    blob = claim(sha256, size, name)
+    target = storage.path(name)
+    if os.path.exists(target):
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Identical content under an identical name, so a concurrent
+        # writer replacing the same target is harmless.
+        os.replace(tmp_path, target)
+    return blob
+
+
+def claim(sha256, size, name):
+    """Return the touched row for ``sha256``, creating it if needed."""
+    while True:
+        blob = Blob.objects.filter(sha256=sha256).first()
+        if blob is not None:
+            if touch(blob):
+                return blob
+            # Collected in the meantime.
+            continue
+        try:
+            with transaction.atomic():
+                return Blob.objects.create(sha256=sha256, size=size, file=name)
+        except IntegrityError:
+            pass
+
+
+def touch(blob):
+    """Keep a blob that is about to gain a reference away from the collector.
+
+    Returns False if the blob has been collected.
+    """
+    return bool(Blob.objects.filter(pk=blob.pk).update(updated_at=timezone.now()))
+
+
+def existing(sha256, size, owner=None):
+    """Return the stored blob for this digest, if its body is still on disk.
+
+    With ``owner``, only a blob one of their files already holds: knowing a
+    digest must not be enough to get someone else's content.
+    """
+    blobs = Blob.objects.filter(sha256=sha256, size=size)
+    if owner is not None:
+        blobs = blobs.filter(files__owner=owner)
+    blob = blobs.first()
+    if blob is None or not touch(blob) or not blob.file.storage.exists(blob.file.name):
+        return None
+    return blob
+
+
+def ingest_upload(uploaded, sha256=None):
+    """Store an uploaded file, skipping the copy when its digest is known."""
+    if sha256:
+        blob = existing(sha256, uploaded.size)
+        if blob is not None:
+            return blob
+    with BlobWriter() as writer:
+        for chunk in uploaded.chunks(COPY_BUFFER_SIZE):
+            writer.write(chunk)
+        return writer.commit()
+
+
+def attach(instance, blob):
+    """Point a ``File`` at a blob's body."""
+    instance.blob = blob
+    instance.file.name = blob.file.name
+    instance.size = blob.size
+    return instance
+
+
+def delete_body(blob):
+    blob.file.storage.delete(blob.file.name)
+    thumbnails.delete(blob.file.storage, blob.pk)
+
+
+def collect(blob, cutoff):
+    """Delete ``blob`` if nothing references it and it has been idle since ``cutoff``."""
+    with transaction.atomic():
+        # Re-check under the delete: a new reference may have appeared.
+        removed, _ = Blob.objects.filter(
+            pk=blob.pk, ref_count__lte=0, updated_at__lt=cutoff
+        ).exclude(files__isnull=False).delete()
+        if removed:
+            # Before the row lock is released, so a concurrent ``claim``
+            # waits and then stores the body again.
+            delete_body(blob)
+    return bool(removed)
@@ -0,0 +1,27 @@
+"""System checks for settings that quietly switch features off."""
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.caches)
+def shared_cache(app_configs, **kwargs):
+    if settings.SHARED_CACHE:
+        return []
+    disabled = [
+        'cached permission checks',
+        'cached share links',
+        'cached token users',
+    ]
+    if settings.DATABASE_REPLICAS:
+        disabled.append('replica reads for signed-in users')
+    if settings.SIGNED_DOWNLOAD_MODE != 'nginx':
+        disabled.append('signed download URLs')
+    return [Warning(
+        f"SHARED_CACHE is off, which disables {', '.join(disabled)}.",
+        hint=(
+            'Point CACHE_URL at a cache every worker shares (e.g. redis://...), '
+            'or set SHARED_CACHE=true if a single process serves every request. '
+            'Add storage.W001 to SILENCED_SYSTEM_CHECKS to run without them.'
+        ),
+        id='storage.W001',
+    )]
@@ -0,0 +1,81 @@
+"""Conditional GET for listings and metadata.
+
+Validators are computed from aggregate state before anything is serialized:
+a listing's ETag hashes the query string, the caller's permission versions
+and the ``count`` and ``max(updated_at)`` of the filtered queryset (plus the
+same for nested relations that will be rendered). A matching
+``If-None-Match`` returns 304 after those one or two aggregate queries,
+without loading or serializing a row. Listings carry no Last-Modified: a
+deletion changes the count but not the newest ``updated_at``. Single objects
+get both validators.
+
+Sharing a file or folder, or changing one of its share links, touches its
+``updated_at`` (see ``storage.signals``) so that nested share data is covered
+by the same aggregate.
+"""
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from . import permissions
+
+
+def make_etag(*parts):
+    return quote_etag(hashlib.md5(repr(parts).encode('utf-8'), usedforsecurity=False).hexdigest())
+
+
+def aggregate(queryset):
+    """``(count, max(updated_at))`` of ``queryset`` in one query."""
+    state = queryset.order_by().aggregate(count=Count('pk'), last_modified=Max('updated_at'))
+    return state['count'], state['last_modified']
+
+
+def request_key(request):
+    # The same URL renders differently per caller, their access and the format.
+    return (
+        request.get_full_path(),
+        request.headers.get('Accept', ''),
+        permissions.get_resolver(request).prefix,
+    )
+
+
+def listing_etag(request, *querysets):
+    """ETag of a response rendering ``querysets``."""
+    return make_etag(*request_key(request), *[aggregate(queryset) for queryset in querysets])
+
+
+def object_etag(request, obj, *querysets):
+    return make_etag(
+        *request_key(request), obj.pk, obj.updated_at,
+        *[aggregate(queryset) for queryset in querysets]
+    )
+
+
+def not_modified(request, etag, last_modified=None):
+    """A 304 response if the client's copy is current, else None."""
+    response = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=int(last_modified.timestamp()) if last_modified else None,
+    )
+    if response is not None:
+        return set_headers(response, etag, last_modified)
+    return None
+
+
+def set_headers(response, etag, last_modified=None, public=False):
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    response['Cache-Control'] = 'public, no-cache' if public else 'private, no-cache'
+    if not public:
+        response['Vary'] = 'Authorization'
+    return response
+
+
+def touch(model, pks):
+    """Bump ``updated_at`` without running save() or its signals."""
+    model.objects.filter(pk__in=pks).update(updated_at=timezone.now())
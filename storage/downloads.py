@@ -0,0 +1,175 @@
+"""Range-aware file downloads.
+
+``serve_file`` answers a GET for a ``File`` in one of three modes, picked by
+``STORAGE_DOWNLOAD_MODE``:
+
+``stream``
+    Django streams the bytes itself, honouring ``Range``/``If-Range`` so that
+    video seeking and resumed downloads work.
+``x-accel-redirect``
+    Only headers are returned and nginx serves the file from an ``internal``
+    location mapped to ``MEDIA_ROOT`` (``STORAGE_ACCEL_REDIRECT_PREFIX``).
+``x-sendfile``
+    Same idea for Apache/lighttpd: the absolute path goes in ``X-Sendfile``.
+
+In the offload modes the web server handles ranges, so workers never touch
+file data. It cannot be told per response not to, so downloads served with
+``allow_ranges=False`` are always streamed by Django.
+"""
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import (
+    content_disposition_header, http_date, parse_http_date_safe, quote_etag
+)
+
+STREAM = 'stream'
+X_ACCEL_REDIRECT = 'x-accel-redirect'
+X_SENDFILE = 'x-sendfile'
+MODES = (STREAM, X_ACCEL_REDIRECT, X_SENDFILE)
+
+STREAM_BLOCK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeFileWrapper:
+    """Iterate over ``length`` bytes of ``filelike`` starting at ``offset``."""
+
+    def __init__(self, filelike, offset=0, length=None, block_size=STREAM_BLOCK_SIZE):
+        self.filelike = filelike
+        self.filelike.seek(offset)
+        self.remaining = length
+        self.block_size = block_size
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.remaining is None:
+            data = self.filelike.read(self.block_size)
+        elif self.remaining > 0:
+            data = self.filelike.read(min(self.remaining, self.block_size))
+            self.remaining -= len(data)
+        else:
+            data = b''
+        if not data:
+            raise StopIteration
+        return data
+
+    def close(self):
+        self.filelike.close()
+
+
+def get_etag(file):
+    if file.blob_id:
+        # Blob keys are content hashes, which makes a strong validator.
+        return quote_etag(file.blob_id)
+    return quote_etag(f'{file.pk}-{file.size}-{int(file.updated_at.timestamp())}')
+
+
+def parse_range(header, size):
+    """Return ``(start, end)`` inclusive for a single byte range.
+
+    ``None`` means the header should be ignored and the whole file sent
+    (absent, malformed or multi-range requests); ``ValueError`` means the
+    range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes.
+        length = int(last)
+        # An empty file has no last bytes to send.
+        if length == 0 or size == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def if_range_matches(request, etag, last_modified):
+    """A stale ``If-Range`` validator downgrades the request to a full GET."""
+    validator = request.headers.get('If-Range')
+    if not validator:
+        return True
+    if validator.startswith(('"', 'W/')):
+        return validator == etag
+    since = parse_http_date_safe(validator)
+    return since is not None and int(last_modified) <= since
+
+
+def range_start(request, file):
+    """First byte ``serve_file`` would send for ``request``: 0 unless it serves a range."""
+    try:
+        byte_range = parse_range(request.headers.get('Range'), file.size)
+    except ValueError:
+        return 0
+    if byte_range is None or not if_range_matches(request, get_etag(file), file.updated_at.timestamp()):
+        return 0
+    return byte_range[0]
+
+
+def set_common_headers(response, file, etag, as_attachment):
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(file.updated_at.timestamp())
+    response['Content-Disposition'] = content_disposition_header(as_attachment, file.name)
+    return response
+
+
+def offload_response(file, mode):
+    response = HttpResponse(content_type=file.mime_type or 'application/octet-stream')
+    if mode == X_ACCEL_REDIRECT:
+        prefix = settings.STORAGE_ACCEL_REDIRECT_PREFIX.rstrip('/')
+        response['X-Accel-Redirect'] = quote(f'{prefix}/{file.file.name}')
+    else:
+        response['X-Sendfile'] = file.file.path
+    return response
+
+
+def serve_file(request, file, as_attachment=True, allow_ranges=True):
+    mode = settings.STORAGE_DOWNLOAD_MODE
+    etag = get_etag(file)
+
+    if mode != STREAM and allow_ranges:
+        return set_common_headers(offload_response(file, mode), file, etag, as_attachment)
+
+    size = file.size
+    try:
+        byte_range = parse_range(request.headers.get('Range'), size) if allow_ranges else None
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    last_modified = file.updated_at.timestamp()
+    if byte_range is None or not if_range_matches(request, etag, last_modified):
+        response = FileResponse(
+            file.file.open('rb'),
+            content_type=file.mime_type or 'application/octet-stream'
+        )
+        set_common_headers(response, file, etag, as_attachment)
+        if not allow_ranges:
+            response['Accept-Ranges'] = 'none'
+        return response
+
+    start, end = byte_range
+    length = end - start + 1
+    response = StreamingHttpResponse(
+        RangeFileWrapper(file.file.open('rb'), offset=start, length=length),
+        status=206,
+        content_type=file.mime_type or 'application/octet-stream'
+    )
+    response['Content-Length'] = str(length)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return set_common_headers(response, file, etag, as_attachment)
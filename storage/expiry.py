@@ -0,0 +1,99 @@
+"""Deactivating expired shares and share links.
+
+Permission lookups and ``ShareLink.is_valid`` already ignore anything past
+its ``expires_at``, but the rows stay active and keep getting scanned.
+``sweep`` flips them to inactive in batches found through the
+``(is_active, expires_at)`` indexes, writing per batch one ``UPDATE``, one
+bulk ``UNSHARE`` activity insert and one bulk change journal insert, then
+drops the affected cached permissions and links, and revokes signed
+downloads of the affected items, once the batch commits.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from . import activity, conditional, journal, links, permissions, signed
+from .models import ActivityType, File, FileShare, Folder, FolderShare, ShareLink
+
+
+def expired(model, now):
+    return model.objects.filter(is_active=True, expires_at__lte=now).order_by('expires_at')
+
+
+def sweep_shares(field, now, batch_size):
+    """Deactivate expired ``FileShare`` or ``FolderShare`` rows; return how many."""
+    share_model, target_model = {
+        'file': (FileShare, File),
+        'folder': (FolderShare, Folder),
+    }[field]
+    path_field = 'file__folder__path' if field == 'file' else 'folder__path'
+    swept = 0
+    while True:
+        batch = list(expired(share_model, now).values_list(
+            'pk', f'{field}_id', f'{field}__owner_id', path_field, 'user_id'
+        )[:batch_size])
+        if not batch:
+            return swept
+        with transaction.atomic():
+            share_model.objects.filter(pk__in=[row[0] for row in batch]).update(is_active=False)
+            activity.write_events([
+                {
+                    'user_id': None,
+                    'activity_type': ActivityType.UNSHARE,
+                    'details': {'revoked_user_id': user_id, 'reason': 'expired'},
+                    'created_at': now,
+                    f'{field}_id': item_id,
+                }
+                for _, item_id, _, _, user_id in batch
+            ])
+            journal.record([
+                journal.share_change(field, item_id, owner_id, path or '', user_id)
+                for _, item_id, owner_id, path, user_id in batch
+            ])
+            conditional.touch(target_model, {row[1] for row in batch})
+            # update() skips the signals that normally invalidate cached permissions.
+            for user_id in {row[4] for row in batch}:
+                transaction.on_commit(lambda user_id=user_id: permissions.invalidate_user(user_id))
+            revoked = {f'{field}s': {row[1] for row in batch}}
+            transaction.on_commit(lambda revoked=revoked: signed.revoke(**revoked))
+        swept += len(batch)
+
+
+def sweep_links(now, batch_size):
+    """Deactivate expired share links; return how many."""
+    swept = 0
+    while True:
+        batch = list(expired(ShareLink, now).values_list(
+            'pk', 'uuid', 'file_id', 'folder_id', 'created_by_id'
+        )[:batch_size])
+        if not batch:
+            return swept
+        with transaction.atomic():
+            ShareLink.objects.filter(pk__in=[row[0] for row in batch]).update(is_active=False)
+            activity.write_events([
+                {
+                    'user_id': created_by_id,
+                    'activity_type': ActivityType.UNSHARE,
+                    'details': {'share_link_id': pk, 'reason': 'expired'},
+                    'created_at': now,
+                    'file_id': file_id,
+                    'folder_id': folder_id,
+                }
+                for pk, _, file_id, folder_id, created_by_id in batch
+            ])
+            conditional.touch(File, {row[2] for row in batch if row[2]})
+            conditional.touch(Folder, {row[3] for row in batch if row[3]})
+            uuids = [row[1] for row in batch]
+            transaction.on_commit(lambda uuids=uuids: links.invalidate(*uuids))
+            revoked = {'files': {row[2] for row in batch}, 'folders': {row[3] for row in batch}}
+            transaction.on_commit(lambda revoked=revoked: signed.revoke(**revoked))
+        swept += len(batch)
+
+
+def sweep(batch_size=500, now=None):
+    """Deactivate everything that expired by ``now``; return counts per kind."""
+    now = now or timezone.now()
+    return {
+        'file_shares': sweep_shares('file', now, batch_size),
+        'folder_shares': sweep_shares('folder', now, batch_size),
+        'links': sweep_links(now, batch_size),
+    }
@@ -0,0 +1,89 @@
+"""Sparse fieldsets for read requests.
+
+``?fields=id,name,files.name`` limits the response to the listed fields;
+dotted names reach into nested serializers. ``?expand=files,files.owner``
+lists the nested serializers to render; once ``expand`` is given, nested
+serializers that are not listed are left out entirely. Without either
+parameter responses are unchanged.
+
+Viewsets feed the same ``FieldSelection`` to the serializer's
+``setup_eager_loading`` so that only rendered relations are prefetched.
+"""
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+from . import instrumentation
+
+
+def parse_tree(value):
+    """``"a,b.c,b.d"`` -> ``{'a': {}, 'b': {'c': {}, 'd': {}}}``."""
+    tree = {}
+    for item in value.split(','):
+        node = tree
+        for part in item.strip().split('.'):
+            if part:
+                node = node.setdefault(part, {})
+    return tree
+
+
+class FieldSelection:
+    def __init__(self, fields=None, expand=None):
+        self.fields = fields
+        self.expand = expand
+
+    @classmethod
+    def from_request(cls, request):
+        if request is None or request.method not in SAFE_METHODS:
+            return cls()
+        fields = request.query_params.get('fields')
+        expand = request.query_params.get('expand')
+        return cls(
+            parse_tree(fields) if fields is not None else None,
+            parse_tree(expand) if expand is not None else None,
+        )
+
+    def includes(self, name, nested=False):
+        if self.fields is not None and name not in self.fields:
+            return False
+        if nested and self.expand is not None and name not in self.expand:
+            return False
+        return True
+
+    def child(self, name):
+        fields = (self.fields.get(name) or None) if self.fields is not None else None
+        expand = self.expand.get(name, {}) if self.expand is not None else None
+        return FieldSelection(fields, expand)
+
+
+class SparseFieldsMixin:
+    """Drop fields the request did not ask for before they are bound."""
+
+    selection = None
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selection = self.get_selection()
+        for name, field in list(fields.items()):
+            child = field.child if isinstance(field, serializers.ListSerializer) else field
+            nested = isinstance(child, serializers.BaseSerializer)
+            if not selection.includes(name, nested):
+                del fields[name]
+            elif isinstance(child, SparseFieldsMixin):
+                child.selection = selection.child(name)
+        return fields
+
+    def to_representation(self, instance):
+        with instrumentation.timed('serialize'):
+            return super().to_representation(instance)
+
+    def get_selection(self):
+        if self.selection is None:
+            parent = self.parent
+            if isinstance(parent, serializers.ListSerializer):
+                parent = parent.parent
+            # Only the top-level serializer reads the query string.
+            if parent is None:
+                self.selection = FieldSelection.from_request(self.context.get('request'))
+            else:
+                self.selection = FieldSelection()
+        return self.selection
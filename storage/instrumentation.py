@@ -0,0 +1,213 @@
+"""Per-request profiling.
+
+With ``INSTRUMENTATION_ENABLED`` set,
+``storage.middleware.InstrumentationMiddleware`` records
+for every request its view, status, wall time, number of database queries
+and time spent in them, repeated statements (the usual sign of an N+1),
+time spent serializing and rendering, and response size. Samples go into a
+ring buffer of the last ``INSTRUMENTATION_BUFFER_SIZE`` requests held by
+this process; ``/api/metrics/`` summarizes them per endpoint as percentiles
+in the Prometheus text format.
+
+A fraction ``INSTRUMENTATION_PROFILE_SAMPLE_RATE`` of requests also runs
+under cProfile, and the profile is written to ``INSTRUMENTATION_PROFILE_DIR``
+when the request took longer than ``INSTRUMENTATION_SLOW_REQUEST_MS``.
+
+Disabled, the middleware removes itself at startup and ``timed`` costs one
+attribute lookup.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import ExitStack, contextmanager, nullcontext
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+# (metric, sample key, help)
+METRICS = [
+    ('request_duration_seconds', 'duration', 'Wall time of the request.'),
+    ('db_queries', 'queries', 'Database queries per request.'),
+    ('db_duplicate_queries', 'duplicates', 'Queries repeating an earlier statement of the same request.'),
+    ('db_time_seconds', 'db_time', 'Time spent in database queries.'),
+    ('serialize_seconds', 'serialize', 'Time spent in top-level serializers.'),
+    ('render_seconds', 'render', 'Time spent rendering the response body.'),
+    ('response_bytes', 'size', 'Size of the response body.'),
+]
+
+_local = threading.local()
+_samples = None
+_lock = threading.Lock()
+
+
+def get_samples():
+    global _samples
+    if _samples is None:
+        _samples = deque(maxlen=settings.INSTRUMENTATION_BUFFER_SIZE)
+    return _samples
+
+
+class Recording:
+    """What one request spent its time on."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = Counter()
+        self.phases = defaultdict(float)
+        self.depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Installed with connection.execute_wrapper().
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+            self.statements[sql] += 1
+
+
+class Phase:
+    def __init__(self, recording, name):
+        self.recording = recording
+        self.name = name
+
+    def __enter__(self):
+        self.recording.depth += 1
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.recording.depth -= 1
+        # Nested phases are already inside the outer one's time.
+        if not self.recording.depth:
+            self.recording.phases[self.name] += time.perf_counter() - self.start
+
+
+def current():
+    return getattr(_local, 'recording', None)
+
+
+@contextmanager
+def recording():
+    """Record the queries and phases of the code in the block."""
+    _local.recording = Recording()
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(_local.recording))
+            yield _local.recording
+    finally:
+        _local.recording = None
+
+
+def timed(name):
+    """Add the time spent in the block to phase ``name`` of the current request."""
+    recording = current()
+    if recording is None:
+        return nullcontext()
+    return Phase(recording, name)
+
+
+def endpoint(request):
+    match = request.resolver_match
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.route
+
+
+def make_sample(request, response, recording, duration):
+    duplicates = recording.queries - len(recording.statements)
+    if duplicates:
+        sql, count = recording.statements.most_common(1)[0]
+        if count >= settings.INSTRUMENTATION_DUPLICATE_WARNING:
+            logger.warning('%s %s ran the same query %d times: %s',
+                           request.method, request.path, count, sql[:200])
+    if response.streaming:
+        size = int(response.get('Content-Length') or 0)
+    else:
+        size = len(response.content)
+    return {
+        'at': timezone.now(),
+        'method': request.method,
+        'endpoint': endpoint(request),
+        'status': response.status_code,
+        'duration': duration,
+        'queries': recording.queries,
+        'duplicates': duplicates,
+        'db_time': recording.db_time,
+        'serialize': recording.phases['serialize'],
+        'render': recording.phases['render'],
+        'size': size,
+    }
+
+
+def record(sample):
+    with _lock:
+        get_samples().append(sample)
+
+
+def snapshot():
+    with _lock:
+        return list(get_samples())
+
+
+def quantile(values, q):
+    """Nearest-rank quantile of sorted ``values``."""
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def labels(**values):
+    return ','.join(f'{key}="{value}"' for key, value in values.items())
+
+
+def render_metrics(samples, prefix='bhandar'):
+    groups = defaultdict(list)
+    for sample in samples:
+        groups[(sample['method'], sample['endpoint'])].append(sample)
+
+    lines = []
+    for metric, key, help_text in METRICS:
+        name = f'{prefix}_{metric}'
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} summary')
+        for (method, view), group in sorted(groups.items()):
+            values = sorted(sample[key] for sample in group)
+            base = labels(method=method, endpoint=view)
+            for q in QUANTILES:
+                lines.append(f'{name}{{{base},quantile="{q}"}} {quantile(values, q):.6g}')
+            lines.append(f'{name}_sum{{{base}}} {sum(values):.6g}')
+            lines.append(f'{name}_count{{{base}}} {len(values)}')
+
+    name = f'{prefix}_responses'
+    lines.append(f'# HELP {name} Buffered requests by response status.')
+    lines.append(f'# TYPE {name} gauge')
+    statuses = Counter((sample['method'], sample['endpoint'], sample['status']) for sample in samples)
+    for (method, view, status), count in sorted(statuses.items()):
+        lines.append(f'{name}{{{labels(method=method, endpoint=view, status=status)}}} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def should_profile():
+    rate = settings.INSTRUMENTATION_PROFILE_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+def dump_profile(profiler, sample):
+    """Write a slow request's profile to ``INSTRUMENTATION_PROFILE_DIR``; return the path."""
+    directory = settings.INSTRUMENTATION_PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, '{}-{}-{}-{}ms.prof'.format(
+        sample['at'].strftime('%Y%m%dT%H%M%S%f'), sample['method'],
+        sample['endpoint'].replace('/', '_').replace(':', '_'), int(sample['duration'] * 1000)
+    ))
+    profiler.dump_stats(path)
+    return path
@@ -0,0 +1,138 @@
+"""Background jobs.
+
+Long-running work is recorded as a ``Job`` row so that clients can poll its
+progress. ``submit`` stores the job and, once the surrounding transaction
+commits, hands it to the backend selected by ``JOB_BACKEND``:
+
+``thread``
+    a small in-process thread pool (the default);
+``inline``
+    run immediately in the calling thread, which is handy for tests and
+    management commands;
+``database``
+    leave the job queued for the ``run_jobs`` worker command.
+
+Handlers are registered with ``@handler('kind')`` and receive the job plus
+a ``report(progress, state=None, total=None)`` callback. ``state`` is saved
+on the job as a checkpoint: a job whose worker died (its heartbeat is older
+than ``JOB_LEASE_SECONDS``) is queued again by ``requeue_stale`` and its
+handler picks up from ``job.state``, so handlers must make each step safe to
+repeat.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job, JobStatus
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+_executor = None
+
+
+def handler(kind):
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.JOB_THREADS,
+            thread_name_prefix='storage-job'
+        )
+    return _executor
+
+
+def submit(kind, user, payload, total=0):
+    job = Job.objects.create(kind=kind, created_by=user, payload=payload, total=total)
+    if settings.JOB_BACKEND == 'inline':
+        transaction.on_commit(lambda: run(job.pk))
+    elif settings.JOB_BACKEND == 'thread':
+        transaction.on_commit(lambda: get_executor().submit(run_in_thread, job.pk))
+    return job
+
+
+def run_in_thread(job_id):
+    close_old_connections()
+    try:
+        run(job_id)
+    finally:
+        close_old_connections()
+
+
+def claim(worker):
+    """Take the oldest pending job for ``worker`` and return its id, or None."""
+    while True:
+        job_id = Job.objects.filter(status=JobStatus.PENDING).order_by(
+            'created_at', 'id'
+        ).values_list('pk', flat=True).first()
+        if job_id is None:
+            return None
+        # Conditional, so two workers never run the same job.
+        if Job.objects.filter(pk=job_id, status=JobStatus.PENDING).update(
+            status=JobStatus.RUNNING, worker=worker, heartbeat_at=timezone.now()
+        ):
+            return job_id
+
+
+def requeue_stale():
+    """Queue running jobs whose worker stopped sending heartbeats again."""
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_LEASE_SECONDS)
+    stale = Job.objects.filter(status=JobStatus.RUNNING, heartbeat_at__lt=cutoff)
+    failed = stale.filter(attempts__gte=settings.JOB_MAX_ATTEMPTS).update(
+        status=JobStatus.FAILED,
+        error='Worker stopped responding too many times.',
+        finished_at=timezone.now(),
+        updated_at=timezone.now()
+    )
+    requeued = stale.update(status=JobStatus.PENDING, worker='', updated_at=timezone.now())
+    return requeued, failed
+
+
+def run(job_id):
+    Job.objects.filter(pk=job_id).update(
+        status=JobStatus.RUNNING,
+        attempts=F('attempts') + 1,
+        heartbeat_at=timezone.now(),
+        updated_at=timezone.now()
+    )
+    Job.objects.filter(pk=job_id, started_at__isnull=True).update(started_at=timezone.now())
+    job = Job.objects.get(pk=job_id)
+
+    def report(progress, state=None, total=None):
+        changes = {'progress': progress, 'heartbeat_at': timezone.now(), 'updated_at': timezone.now()}
+        if state is not None:
+            job.state = changes['state'] = state
+        if total is not None:
+            job.total = changes['total'] = total
+        Job.objects.filter(pk=job.pk).update(**changes)
+
+    try:
+        result = HANDLERS[job.kind](job, report)
+    except Exception as e:
+        logger.exception('Job %s (%s) failed', job.uuid, job.kind)
+        Job.objects.filter(pk=job.pk).update(
+            status=JobStatus.FAILED,
+            error=str(e),
+            finished_at=timezone.now(),
+            updated_at=timezone.now()
+        )
+        return
+    Job.objects.filter(pk=job.pk).update(
+        status=JobStatus.SUCCEEDED,
+        result=result,
+        progress=job.total,
+        finished_at=timezone.now(),
+        updated_at=timezone.now()
+    )
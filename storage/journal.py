@@ -0,0 +1,245 @@
+"""Change journal for sync clients.
+
+Every create, update, move and delete of a ``File`` or ``Folder``, and every
+share granted or revoked, appends a ``Change`` in the same transaction as the
+write (from ``storage.signals`` and ``sharing.share_many``). Ids only grow,
+so a client keeps the id it has caught up to as its cursor and asks for what
+came after it.
+
+Entries carry the owner, the share recipient and the folder path the object
+sat in before and after the change. That is enough to decide who may see an
+entry without joining back to objects that may no longer exist.
+
+``compact_changes`` drops entries superseded by a later one for the same
+object and everything older than ``CHANGES_RETENTION_DAYS``, recording how far
+it pruned in ``ChangePrune``. A cursor below that mark cannot be replayed and
+gets ``ResyncRequired``.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, Max, OuterRef, Q
+from django.utils import timezone
+
+from .models import Change, ChangeAction, ChangePrune, File, FileShare, Folder
+from .permissions import active_shares, shared_folder_q
+
+# Wakes long-polls served by this process; other processes are seen by polling.
+_changed = threading.Condition()
+
+
+class ResyncRequired(Exception):
+    """The cursor points at entries that have been compacted away."""
+
+
+def folder_path(folder_id):
+    if folder_id is None:
+        return ''
+    return Folder.all_objects.filter(pk=folder_id).values_list('path', flat=True).first() or ''
+
+
+def file_path(file):
+    if file.folder_id is not None and File.folder.is_cached(file):
+        return file.folder.path
+    return folder_path(file.folder_id)
+
+
+def file_change(file, action, path, previous_path=None, owner_id=None):
+    return Change(
+        kind='file',
+        object_id=file.pk,
+        action=action,
+        owner_id=owner_id or file.owner_id,
+        path=path,
+        previous_path=path if previous_path is None else previous_path,
+        data={
+            'name': file.name,
+            'folder': file.folder_id,
+            'size': file.size,
+            'mime_type': file.mime_type,
+            'sha256': file.blob_id,
+        },
+    )
+
+
+def folder_change(folder, action, path, previous_path=None, owner_id=None):
+    return Change(
+        kind='folder',
+        object_id=folder.pk,
+        action=action,
+        owner_id=owner_id or folder.owner_id,
+        path=path,
+        previous_path=path if previous_path is None else previous_path,
+        data={'name': folder.name, 'parent': folder.parent_id},
+    )
+
+
+def share_change(kind, object_id, owner_id, path, user_id, permission=None, expires_at=None):
+    return Change(
+        kind=kind,
+        object_id=object_id,
+        action=ChangeAction.SHARE if permission else ChangeAction.UNSHARE,
+        owner_id=owner_id,
+        user_id=user_id,
+        path=path,
+        previous_path=path,
+        data={
+            'permission': permission,
+            # Bulk share jobs pass the expiry through as an ISO string.
+            'expires_at': expires_at.isoformat() if hasattr(expires_at, 'isoformat') else expires_at,
+        } if permission else {},
+    )
+
+
+def share_change_for(share, active=True):
+    if isinstance(share, FileShare):
+        kind, target, path = 'file', share.file, file_path(share.file)
+    else:
+        kind, target, path = 'folder', share.folder, share.folder.path
+    if not active or not share.is_active:
+        return share_change(kind, target.pk, target.owner_id, path, share.user_id)
+    return share_change(
+        kind, target.pk, target.owner_id, path, share.user_id, share.permission, share.expires_at
+    )
+
+
+def notify():
+    with _changed:
+        _changed.notify_all()
+
+
+def record(changes):
+    if changes:
+        Change.objects.bulk_create(changes)
+        transaction.on_commit(notify)
+
+
+def pruned_through():
+    return ChangePrune.objects.aggregate(through=Max('through_id'))['through'] or 0
+
+
+def ceiling():
+    """The highest id it is safe to move a cursor past.
+
+    Ids are handed out before commit, so on databases with concurrent writers
+    a lower id can become visible after a higher one; ``CHANGES_SETTLE_SECONDS``
+    holds back entries until any such straggler has committed.
+    """
+    changes = Change.objects.all()
+    if settings.CHANGES_SETTLE_SECONDS:
+        cutoff = timezone.now() - timedelta(seconds=settings.CHANGES_SETTLE_SECONDS)
+        changes = changes.filter(created_at__lte=cutoff)
+    return changes.aggregate(latest=Max('id'))['latest'] or 0
+
+
+def visible_to(user):
+    """Entries ``user`` may see: their own, shares to them and anything in what is shared with them."""
+    direct = active_shares(FileShare, user).values('file_id')
+    content = Q(user_id=0) & (
+        Q(kind='file', object_id__in=direct) |
+        shared_folder_q(user, 'path') |
+        shared_folder_q(user, 'previous_path')
+    )
+    return Q(owner_id=user.pk) | Q(user_id=user.pk) | content
+
+
+def pending(user, cursor, upper):
+    return Change.objects.filter(id__gt=cursor, id__lte=upper).filter(visible_to(user))
+
+
+def serialize(change):
+    return {
+        'seq': change.id,
+        'kind': change.kind,
+        'id': change.object_id,
+        'action': change.action,
+        'user': change.user_id or None,
+        'at': change.created_at,
+        **change.data,
+    }
+
+
+def collapse(changes):
+    """Keep only the last entry per object (and share recipient) in a batch."""
+    latest = {}
+    for change in changes:
+        key = (change.kind, change.object_id, change.user_id)
+        first = latest.pop(key, None)
+        if first is not None and first.action == ChangeAction.CREATE:
+            if change.action == ChangeAction.DELETE:
+                continue
+            change.action = ChangeAction.CREATE
+        latest[key] = change
+    return sorted(latest.values(), key=lambda change: change.id)
+
+
+def changes_since(user, cursor, limit):
+    """Return ``(next_cursor, has_more, changes)`` for ``user`` after ``cursor``."""
+    if cursor < pruned_through():
+        raise ResyncRequired()
+    upper = ceiling()
+    changes = list(pending(user, cursor, upper).order_by('id')[:limit + 1])
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    # Entries the user cannot see still move the cursor along.
+    next_cursor = changes[-1].id if has_more else max(cursor, upper)
+    return next_cursor, has_more, [serialize(change) for change in collapse(changes)]
+
+
+def wait_for_changes(user, cursor, timeout):
+    """Block until ``user`` has changes after ``cursor`` or ``timeout`` seconds pass."""
+    deadline = time.monotonic() + timeout
+    while not pending(user, cursor, ceiling()).exists():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        with _changed:
+            _changed.wait(min(remaining, settings.CHANGES_POLL_INTERVAL))
+    return True
+
+
+def compact(retention=None, batch_size=1000):
+    """Drop superseded and expired entries; return ``(superseded, expired)`` counts."""
+    retention = settings.CHANGES_RETENTION_DAYS if retention is None else retention
+    upper = ceiling()
+
+    # An entry may go once a later entry for the same object, owner and
+    # recipient exists that anyone who saw it will also see: it must not be
+    # a move, and the later entry must start from the path it ended at.
+    newer = Change.objects.filter(
+        kind=OuterRef('kind'),
+        object_id=OuterRef('object_id'),
+        owner_id=OuterRef('owner_id'),
+        user_id=OuterRef('user_id'),
+        previous_path=OuterRef('path'),
+        id__gt=OuterRef('id'),
+        id__lte=upper,
+    )
+    superseded = 0
+    while True:
+        ids = list(
+            Change.objects.filter(id__lte=upper, path=F('previous_path'))
+            .filter(Exists(newer)).values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        superseded += Change.objects.filter(id__in=ids).delete()[0]
+
+    expired = 0
+    through = Change.objects.filter(
+        created_at__lt=timezone.now() - timedelta(days=retention), id__lte=upper
+    ).aggregate(through=Max('id'))['through']
+    if through and through > pruned_through():
+        # Raise the mark first so no client reads a half-pruned range.
+        ChangePrune.objects.create(through_id=through)
+        while True:
+            ids = list(
+                Change.objects.filter(id__lte=through).values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            expired += Change.objects.filter(id__in=ids).delete()[0]
+    return superseded, expired
@@ -0,0 +1,98 @@
+"""Public share link lookup and download accounting.
+
+With ``SHARED_CACHE``, resolved links are cached by ``uuid`` for
+``SHARE_LINK_CACHE_TTL`` seconds so that hot public links are served without
+touching the database. The cached
+``download_count`` may lag behind, which is fine for display: the limit itself
+is enforced by ``claim_download``, a single conditional ``UPDATE`` that only
+increments while the link is still valid, so concurrent downloads can never
+push the count past ``max_downloads``.
+
+Ranged requests (seeking, resuming) only skip ``claim_download`` when they
+continue a download that was claimed: the claiming response carries a
+``Download-Claim`` token, valid for ``SHARE_LINK_CLAIM_TTL`` seconds, which
+the client passes back as ``?claim=``. A continuation must start past the
+first byte; one that would send the file from the start is a new download
+like any other request.
+
+Keys embed the global permission version, so folder moves and ownership
+changes retire every cached link at once; saving or deleting a link, or the
+file or folder it points at, drops that link's entry directly.
+"""
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import F, Q
+from django.http import Http404
+from django.utils import timezone
+
+from . import permissions
+from .models import ShareLink
+
+MISSING = 'missing'
+CLAIM_SALT = 'storage.share-link-claim'
+
+
+def cache_key(uuid):
+    version = cache.get(permissions.GLOBAL_VERSION_KEY, 0)
+    return f'sharelink:{version}:{uuid}'
+
+
+def get_link(uuid):
+    """Return the link for ``uuid`` with its target and creator loaded, or raise ``Http404``."""
+    key = cache_key(uuid) if settings.SHARED_CACHE else None
+    link = cache.get(key) if key else None
+    if link is None:
+        link = (
+            ShareLink.objects.select_related('file', 'folder', 'created_by')
+            .filter(uuid=uuid).first()
+        ) or MISSING
+        if key:
+            cache.set(key, link, settings.SHARE_LINK_CACHE_TTL)
+    if link == MISSING:
+        raise Http404('No share link matches the given query.')
+    return link
+
+
+def invalidate(*uuids):
+    cache.delete_many([cache_key(uuid) for uuid in uuids])
+
+
+def invalidate_targets(**target):
+    """Drop cached links pointing at ``file=...`` or ``folder=...``."""
+    invalidate(*ShareLink.objects.filter(**target).values_list('uuid', flat=True))
+
+
+def valid_q(now=None):
+    """``ShareLink.is_valid`` expressed as a query filter."""
+    now = now or timezone.now()
+    return (
+        Q(is_active=True) &
+        (Q(expires_at__isnull=True) | Q(expires_at__gte=now)) &
+        (Q(max_downloads__isnull=True) | Q(max_downloads=0) |
+         Q(download_count__lt=F('max_downloads')))
+    )
+
+
+def claim_download(link):
+    """Atomically count one download against ``link``; False once it is used up."""
+    claimed = ShareLink.objects.filter(valid_q(), pk=link.pk).update(
+        download_count=F('download_count') + 1
+    )
+    if not claimed:
+        # The cached copy still thinks the link is usable.
+        invalidate(link.uuid)
+    return bool(claimed)
+
+
+def claim_token(link, file):
+    """A token letting ranged requests continue the download of ``file`` just claimed."""
+    return signing.dumps({'l': str(link.uuid), 'f': file.pk}, salt=CLAIM_SALT)
+
+
+def continues_claim(token, link, file):
+    try:
+        payload = signing.loads(token, salt=CLAIM_SALT, max_age=settings.SHARE_LINK_CLAIM_TTL)
+    except signing.BadSignature:
+        return False
+    return payload == {'l': str(link.uuid), 'f': file.pk}
@@ -0,0 +1,59 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from storage import thumbnails
+from storage.models import File
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Render missing thumbnails for existing image files and avatars.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.THUMBNAIL_WORKERS)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Re-render thumbnails that already exist.'
+        )
+        parser.add_argument('--skip-avatars', action='store_true')
+
+    def handle(self, *args, **options):
+        files = File.objects.filter(mime_type__in=thumbnails.IMAGE_TYPES)
+        written = self.render_all(files, thumbnails.render_file, options)
+        if not options['skip_avatars']:
+            users = User.objects.exclude(avatar='').exclude(avatar__isnull=True)
+            written += self.render_all(users, thumbnails.render_avatar, options)
+        self.stdout.write(self.style.SUCCESS(f'Rendered {written} thumbnails.'))
+
+    def render_all(self, queryset, render, options):
+        def work(pk):
+            try:
+                return render(pk, force=options['force'])
+            except Exception as e:
+                self.stderr.write(f'{render.__name__}({pk}) failed: {e}')
+                return 0
+            finally:
+                if executor:
+                    close_old_connections()
+
+        written = 0
+        last_pk = 0
+        executor = ThreadPoolExecutor(max_workers=options['workers']) if options['workers'] > 1 else None
+        while True:
+            batch = list(
+                queryset.filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', flat=True)[:options['batch_size']]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1]
+            written += sum(executor.map(work, batch) if executor else map(work, batch))
+        if executor:
+            executor.shutdown()
+        return written
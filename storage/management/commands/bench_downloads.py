@@ -0,0 +1,69 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+from django.utils import timezone
+
+from storage import downloads
+from storage.models import File
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure how many downloads a single worker can hand out per second '
+        'in each STORAGE_DOWNLOAD_MODE.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=int, default=64, help='Size of the test file.')
+        parser.add_argument('--requests', type=int, default=50, help='Requests per mode.')
+        parser.add_argument('--range', default='', help='Optional Range header, e.g. "bytes=0-1048575".')
+
+    def handle(self, *args, **options):
+        root = tempfile.mkdtemp(prefix='bench-downloads-')
+        try:
+            results = self.run(root, options)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def run(self, root, options):
+        size = options['size_mb'] * 1024 * 1024
+        with open(os.path.join(root, 'bench.bin'), 'wb') as out:
+            block = os.urandom(1024 * 1024)
+            for _ in range(options['size_mb']):
+                out.write(block)
+
+        # An unsaved row is enough: serve_file only reads attributes.
+        file = File(id=1, name='bench.bin', size=size, mime_type='application/octet-stream',
+                    updated_at=timezone.now())
+        file.file.storage = FileSystemStorage(location=root)
+        file.file.name = 'bench.bin'
+
+        factory = RequestFactory()
+        headers = {'Range': options['range']} if options['range'] else {}
+        results = {}
+        for mode in downloads.MODES:
+            with override_settings(STORAGE_DOWNLOAD_MODE=mode, MEDIA_ROOT=root):
+                transferred = 0
+                started = time.perf_counter()
+                for _ in range(options['requests']):
+                    response = downloads.serve_file(factory.get('/', headers=headers), file)
+                    if response.streaming:
+                        for chunk in response.streaming_content:
+                            transferred += len(chunk)
+                    response.close()
+                elapsed = time.perf_counter() - started
+            results[mode] = {
+                'requests': options['requests'],
+                'seconds': round(elapsed, 4),
+                'requests_per_second': round(options['requests'] / elapsed, 1),
+                'bytes_through_worker': transferred,
+                'worker_mb_per_second': round(transferred / elapsed / 1024 / 1024, 1),
+            }
+        return results
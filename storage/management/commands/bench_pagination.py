@@ -0,0 +1,114 @@
+import json
+import statistics
+import time
+from base64 import b64encode
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from storage.models import File
+from storage.views import FileViewSet
+
+User = get_user_model()
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare keyset pagination with OFFSET pagination at increasing depths '
+        'over a large generated file listing.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--depths', default='0,1000,10000,100000,500000,999000')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument(
+            '--keep', action='store_true',
+            help='Keep the generated rows instead of rolling them back.'
+        )
+
+    def handle(self, *args, **options):
+        results = {}
+        try:
+            with transaction.atomic():
+                user = self.populate(options['rows'])
+                results = self.measure(user, options)
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            pass
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def populate(self, rows):
+        user, _ = User.objects.get_or_create(
+            username='bench-pagination',
+            defaults={'email': 'bench-pagination@example.com', 'display_name': 'Bench'}
+        )
+        now = timezone.now()
+        updated_at = File._meta.get_field('updated_at')
+        # Let the generated timestamps through instead of auto_now's.
+        updated_at.auto_now = False
+        try:
+            batch = []
+            for i in range(rows):
+                batch.append(File(
+                    name=f'bench-{i}', owner=user, file=f'bench/{i}', size=i,
+                    mime_type='application/octet-stream',
+                    # Every 10 rows share a timestamp so ties are exercised.
+                    updated_at=now - timedelta(seconds=i // 10),
+                ))
+                if len(batch) == 10_000:
+                    File.objects.bulk_create(batch)
+                    batch = []
+            File.objects.bulk_create(batch)
+        finally:
+            updated_at.auto_now = True
+        return user
+
+    def timed(self, func, repeat):
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            samples.append((time.perf_counter() - started) * 1000)
+        return round(statistics.median(samples), 2)
+
+    def measure(self, user, options):
+        page_size = options['page_size']
+        ordered = File.objects.filter(owner=user).order_by('-updated_at', '-id')
+        view = FileViewSet.as_view({'get': 'list'})
+        factory = APIRequestFactory()
+        results = {}
+        for depth in [int(d) for d in options['depths'].split(',')]:
+            if depth >= options['rows']:
+                continue
+            params = {'page_size': page_size, 'fields': 'id,name,size'}
+            if depth:
+                updated_at, pk = ordered.values_list('updated_at', 'id')[depth - 1]
+                cursor = {'v': updated_at.isoformat(), 'k': pk, 'r': False}
+                params['cursor'] = b64encode(json.dumps(cursor).encode()).decode()
+
+            def keyset():
+                request = factory.get('/api/files/', params)
+                force_authenticate(request, user)
+                response = view(request)
+                assert response.status_code == 200, response.data
+                response.render()
+
+            def offset():
+                list(ordered.values('id', 'name', 'size')[depth:depth + page_size])
+
+            results[depth] = {
+                'keyset_api_ms': self.timed(keyset, options['repeat']),
+                'offset_query_ms': self.timed(offset, options['repeat']),
+            }
+        return results
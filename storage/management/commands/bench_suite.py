@@ -0,0 +1,281 @@
+import json
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from storage import blobs
+from storage.models import File, Folder, ShareLink
+
+User = get_user_model()
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the main API paths in-process against a dataset made by '
+        'generate_dataset and report throughput, p50/p99 latency and query '
+        'counts per scenario as JSON. Writes are rolled back, so runs are '
+        'repeatable; pass an earlier run to --compare to see the change.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='load', help='Prefix the dataset was generated with.')
+        parser.add_argument('--iterations', type=int, default=200, help='Requests per scenario.')
+        parser.add_argument('--warmup', type=int, default=10, help='Untimed requests per scenario.')
+        parser.add_argument(
+            '--scenarios', default='',
+            help='Comma separated scenarios to run (default: all).'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Also write the JSON report to this file.')
+        parser.add_argument('--compare', help='JSON report of an earlier run to compare against.')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.users = list(User.objects.filter(username__startswith=f"{options['prefix']}-").order_by('pk'))
+        if len(self.users) < 2:
+            raise CommandError(
+                f"Found no dataset with prefix {options['prefix']!r}; run generate_dataset first."
+            )
+
+        scenarios = {
+            'list_files': self.list_files,
+            'list_folders': self.list_folders,
+            'folder_detail': self.folder_detail,
+            'permission_check': self.permission_check,
+            'bulk_share': self.bulk_share,
+            'upload': self.upload,
+            'download': self.download,
+            'public_link': self.public_link,
+            'public_link_download': self.public_link_download,
+        }
+        selected = [name for name in options['scenarios'].split(',') if name] or list(scenarios)
+        unknown = set(selected) - set(scenarios)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}.")
+
+        media_root = tempfile.mkdtemp(prefix='bench-suite-')
+        try:
+            # Uploads and the download fixture write files; the activity log
+            # is written inline so its cost is part of the measurement.
+            with override_settings(MEDIA_ROOT=media_root, ACTIVITY_LOG_MODE='sync', JOB_BACKEND='database'):
+                results = {name: self.run(scenarios[name], options) for name in selected}
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        report = {
+            'commit': self.commit(),
+            'database': connection.vendor,
+            'created_at': timezone.now().isoformat(),
+            'dataset': {
+                'prefix': options['prefix'],
+                'users': len(self.users),
+                'folders': Folder.objects.filter(owner__in=self.users).count(),
+                'files': File.objects.filter(owner__in=self.users).count(),
+            },
+            'iterations': options['iterations'],
+            'scenarios': results,
+        }
+        if options['compare']:
+            with open(options['compare']) as baseline:
+                report['comparison'] = self.compare(json.load(baseline), report)
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as out:
+                out.write(output + '\n')
+        self.stdout.write(output)
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def run(self, scenario, options):
+        """Time ``scenario``, whose setup returns the request to repeat, inside a rolled back transaction."""
+        cache.clear()
+        latencies, queries = [], []
+        try:
+            with transaction.atomic():
+                request = scenario()
+                for _ in range(options['warmup']):
+                    self.call(request)
+                started = time.perf_counter()
+                for _ in range(options['iterations']):
+                    with CaptureQueriesContext(connection) as captured:
+                        begun = time.perf_counter()
+                        self.call(request)
+                        latencies.append((time.perf_counter() - begun) * 1000)
+                    queries.append(len(captured))
+                elapsed = time.perf_counter() - started
+                raise Rollback
+        except Rollback:
+            pass
+
+        latencies.sort()
+        return {
+            'requests_per_second': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(latencies[len(latencies) // 2], 3),
+            'p99_ms': round(latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)], 3),
+            'mean_ms': round(statistics.fmean(latencies), 3),
+            'queries_per_request': round(statistics.fmean(queries), 2),
+            'max_queries': max(queries),
+        }
+
+    def call(self, request):
+        method, client, path, data, expected = request()
+        kwargs = {}
+        if method == 'post':
+            uploads = any(isinstance(value, SimpleUploadedFile) for value in data.values())
+            kwargs['format'] = 'multipart' if uploads else 'json'
+        # Writes run in a savepoint that is rolled back straight away.
+        sid = transaction.savepoint()
+        try:
+            response = getattr(client, method)(path, data, **kwargs)
+            if response.status_code != expected:
+                raise CommandError(
+                    f'{method.upper()} {path} returned {response.status_code}, expected {expected}: {response.content[:200]!r}'
+                )
+            if response.streaming:
+                # The test client closes the response once it is drained,
+                # without letting request_finished close our connection; an
+                # explicit close() would drop the transaction being timed.
+                for _ in response.streaming_content:
+                    pass
+        finally:
+            transaction.savepoint_rollback(sid)
+
+    def client(self, user=None):
+        """A client for ``user`` that sends a real bearer token, so authentication is measured too."""
+        client = APIClient()
+        if user is not None:
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        return client
+
+    def busiest_user(self):
+        return max(self.users, key=lambda user: File.objects.filter(owner=user).count())
+
+    # Scenarios: each sets up and returns a callable producing
+    # (method, client, path, data, expected status) for one request.
+
+    def list_files(self):
+        client = self.client(self.busiest_user())
+        return lambda: ('get', client, '/api/files/', {'page_size': 50}, 200)
+
+    def list_folders(self):
+        client = self.client(self.busiest_user())
+        return lambda: ('get', client, '/api/folders/', {'page_size': 50}, 200)
+
+    def folder_detail(self):
+        user = self.busiest_user()
+        client = self.client(user)
+        folders = list(Folder.objects.filter(owner=user).values_list('pk', flat=True))
+        return lambda: ('get', client, f'/api/folders/{self.rng.choice(folders)}/', None, 200)
+
+    def permission_check(self):
+        # Someone else's items: answers come from shares and folder ancestry.
+        user = self.users[0]
+        client = self.client(user)
+        files = list(File.objects.exclude(owner=user).filter(
+            owner__in=self.users
+        ).values_list('pk', flat=True)[:5000])
+        folders = list(Folder.objects.exclude(owner=user).filter(
+            owner__in=self.users
+        ).values_list('pk', flat=True)[:5000])
+
+        def request():
+            query = {
+                'files': ','.join(str(pk) for pk in self.rng.sample(files, min(50, len(files)))),
+                'folders': ','.join(str(pk) for pk in self.rng.sample(folders, min(20, len(folders)))),
+            }
+            return 'get', client, '/api/permissions/', query, 200
+        return request
+
+    def bulk_share(self):
+        user = self.busiest_user()
+        client = self.client(user)
+        files = list(File.objects.filter(owner=user).values_list('pk', flat=True))
+        emails = [other.email for other in self.users if other.pk != user.pk]
+
+        def request():
+            data = {
+                'items': self.rng.sample(files, min(20, len(files))),
+                'user_emails': self.rng.sample(emails, min(3, len(emails))),
+                'permission': 'VIEW',
+            }
+            return 'post', client, '/api/files/bulk_share/', data, 200
+        return request
+
+    def upload(self):
+        # Into the shallowest folder of the first dataset user that has one;
+        # uploads need a folder, so make one (rolled back) if nobody does.
+        folder = Folder.objects.filter(owner__in=self.users).order_by('owner', 'depth', 'pk').first()
+        if folder is None:
+            folder = Folder.objects.create(name='bench-uploads', owner=self.users[0])
+        client = self.client(folder.owner)
+        body = bytes(self.rng.getrandbits(8) for _ in range(64 * 1024))
+
+        def request():
+            upload = SimpleUploadedFile(f'bench-{self.rng.random()}.bin', body, 'application/octet-stream')
+            data = {'file': upload, 'name': upload.name, 'folder': folder.pk}
+            return 'post', client, '/api/files/', data, 201
+        return request
+
+    def fixture_file(self, owner):
+        """A file whose body exists under the temporary MEDIA_ROOT."""
+        data = bytes(self.rng.getrandbits(8) for _ in range(256 * 1024))
+        blob = blobs.ingest_upload(SimpleUploadedFile('bench.bin', data))
+        file = File(name='bench-download.bin', owner=owner, mime_type='application/octet-stream')
+        blobs.attach(file, blob).save()
+        return file
+
+    def download(self):
+        user = self.users[0]
+        file = self.fixture_file(user)
+        client = self.client(user)
+        return lambda: ('get', client, f'/api/files/{file.pk}/download/', None, 200)
+
+    def public_link(self):
+        link = ShareLink.objects.create(file=self.fixture_file(self.users[0]), created_by=self.users[0])
+        client = self.client()
+        return lambda: ('get', client, f'/api/share/{link.uuid}/', None, 200)
+
+    def public_link_download(self):
+        link = ShareLink.objects.create(file=self.fixture_file(self.users[0]), created_by=self.users[0])
+        client = self.client()
+        return lambda: ('get', client, f'/api/share/{link.uuid}/download/', None, 200)
+
+    def compare(self, baseline, report):
+        """Per-scenario ratios against ``baseline``: above 1 is slower or more queries."""
+        comparison = {}
+        for name, current in report['scenarios'].items():
+            previous = baseline.get('scenarios', {}).get(name)
+            if not previous:
+                continue
+            comparison[name] = {
+                key: round(current[key] / previous[key], 3) if previous[key] else None
+                for key in ('p50_ms', 'p99_ms', 'queries_per_request')
+            }
+        comparison['baseline_commit'] = baseline.get('commit')
+        return comparison
@@ -0,0 +1,39 @@
+import os
+import shutil
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from storage import uploads
+from storage.models import UploadSession, UploadStatus
+
+
+class Command(BaseCommand):
+    help = 'Remove abandoned upload sessions and their chunk files.'
+
+    def handle(self, *args, **options):
+        expired = UploadSession.objects.filter(
+            status=UploadStatus.ACTIVE,
+            expires_at__lt=timezone.now()
+        )
+        for session in expired.iterator():
+            uploads.discard(session)
+        count = expired.update(status=UploadStatus.ABORTED)
+
+        # Chunk directories whose session is gone or no longer accepting chunks.
+        root = uploads.uploads_root()
+        active = {
+            str(value) for value in UploadSession.objects.filter(
+                status=UploadStatus.ACTIVE
+            ).values_list('uuid', flat=True)
+        }
+        orphans = 0
+        if os.path.isdir(root):
+            for name in os.listdir(root):
+                if name not in active:
+                    shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+                    orphans += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Expired {count} upload sessions, removed {orphans} chunk directories.'
+        ))
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from storage import journal
+
+
+class Command(BaseCommand):
+    help = (
+        'Compact the sync change journal: drop entries superseded by a later '
+        'change to the same object and entries older than the retention period. '
+        'Clients with a cursor from before the retention period must resync.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.CHANGES_RETENTION_DAYS,
+            help='Keep this many days of changes.'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        superseded, expired = journal.compact(options['days'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Removed {superseded} superseded and {expired} expired changes.'
+        ))
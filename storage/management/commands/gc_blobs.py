@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from storage import blobs
+from storage.models import Blob, File
+
+
+class Command(BaseCommand):
+    help = 'Delete blobs that are no longer referenced by any file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--recount', action='store_true',
+            help='Recompute every ref_count from the File table before collecting.'
+        )
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            self.recount()
+
+        cutoff = timezone.now() - settings.BLOB_GC_GRACE_PERIOD
+        candidates = Blob.objects.filter(ref_count__lte=0, updated_at__lt=cutoff)
+        deleted = 0
+        last_pk = ''
+        while True:
+            batch = list(
+                candidates.filter(pk__gt=last_pk).order_by('pk')[:options['batch_size']]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            for blob in batch:
+                if options['dry_run']:
+                    deleted += 1
+                    continue
+                if blobs.collect(blob, cutoff):
+                    deleted += 1
+
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {deleted} unreferenced blobs.'))
+
+    def recount(self):
+        counts = File.all_objects.filter(blob=OuterRef('pk')).order_by().values('blob').annotate(
+            total=Count('pk')
+        ).values('total')
+        updated = Blob.objects.update(ref_count=Coalesce(Subquery(counts), 0))
+        self.stdout.write(f'Recounted references for {updated} blobs.')
@@ -0,0 +1,213 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from storage.models import (
+    ActivityLog, ActivityType, File, FileShare, Folder, FolderShare, SharePermission, ShareLink
+)
+
+User = get_user_model()
+
+# (mime type, extension, smallest size, largest size, weight)
+MIME_TYPES = [
+    ('text/plain', 'txt', 100, 200_000, 20),
+    ('application/pdf', 'pdf', 20_000, 20_000_000, 20),
+    ('image/jpeg', 'jpg', 50_000, 8_000_000, 30),
+    ('image/png', 'png', 5_000, 4_000_000, 10),
+    ('video/mp4', 'mp4', 2_000_000, 2_000_000_000, 5),
+    ('application/zip', 'zip', 10_000, 500_000_000, 5),
+    ('application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'docx', 10_000, 5_000_000, 10),
+]
+
+# (activity type, weight)
+ACTIVITY_TYPES = [
+    (ActivityType.VIEW, 40),
+    (ActivityType.DOWNLOAD, 30),
+    (ActivityType.UPLOAD, 15),
+    (ActivityType.MODIFY, 8),
+    (ActivityType.SHARE, 5),
+    (ActivityType.UNSHARE, 2),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a synthetic dataset for load tests and benchmarks: users '
+        'with deep folder trees, files, a share graph, share links and '
+        'activity history. The same --seed and sizes always produce the same '
+        'shape. Rows are bulk inserted; usage counters, the search index and '
+        'activity rollups are rebuilt at the end.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='load', help='Prefix of generated usernames.')
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--depth', type=int, default=4, help='Folder levels per user.')
+        parser.add_argument('--fan-out', type=int, default=3, help='Subfolders per folder.')
+        parser.add_argument('--files-per-folder', type=int, default=20)
+        parser.add_argument(
+            '--shares-per-user', type=int, default=10,
+            help='Files and folders each user shares with one to three other users.'
+        )
+        parser.add_argument(
+            '--link-ratio', type=float, default=0.01,
+            help='Fraction of files that get a public share link.'
+        )
+        parser.add_argument('--activity-per-user', type=int, default=200)
+        parser.add_argument('--activity-days', type=int, default=90)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument(
+            '--delete', action='store_true',
+            help='Delete the users with this prefix and everything they own instead.'
+        )
+
+    def handle(self, *args, **options):
+        existing = User.objects.filter(username__startswith=f"{options['prefix']}-")
+        if options['delete']:
+            count = existing.count()
+            existing.delete()
+            self.stdout.write(self.style.SUCCESS(f'Deleted {count} users and their data.'))
+            return
+        if existing.exists():
+            raise CommandError(
+                f"Users named {options['prefix']}-* already exist; pick another --prefix or pass --delete."
+            )
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+
+        users = self.create_users(options)
+        totals = dict.fromkeys(['folders', 'files', 'shares', 'links', 'events'], 0)
+        # One user at a time, so memory stays flat however many files there are.
+        for user in users:
+            folders = self.create_folders(user, options)
+            files = self.create_files(user, folders, options)
+            others = [other for other in users if other.pk != user.pk]
+            totals['folders'] += len(folders)
+            totals['files'] += len(files)
+            totals['shares'] += self.create_shares(folders + files, others, options)
+            totals['links'] += self.create_links(files, options)
+            totals['events'] += self.create_activity(user, files, options)
+        self.stdout.write(
+            'Created {} users, {folders} folders, {files} files, {shares} shares, '
+            '{links} share links and {events} activity events.'.format(len(users), **totals)
+        )
+
+        # bulk_create skips the signals that keep these up to date.
+        call_command('reconcile_usage', stdout=self.stdout)
+        call_command('rebuild_search_index', stdout=self.stdout)
+        call_command('rebuild_activity_rollups', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS('Dataset ready.'))
+
+    def weighted(self, choices):
+        return self.rng.choices(choices, weights=[choice[-1] for choice in choices])[0]
+
+    def create_users(self, options):
+        prefix = options['prefix']
+        users = []
+        for i in range(options['users']):
+            user = User(
+                email=f'{prefix}-{i}@example.com', username=f'{prefix}-{i}',
+                display_name=f'Load User {i}', is_active=True
+            )
+            user.set_unusable_password()
+            users.append(user)
+        User.objects.bulk_create(users, batch_size=self.batch_size)
+        # Not every backend returns primary keys from bulk_create.
+        return list(User.objects.filter(username__startswith=f'{prefix}-').order_by('pk'))
+
+    def create_folders(self, user, options):
+        """Build the tree level by level, filling in paths once primary keys exist."""
+        created = []
+        parents = [None]
+        for depth in range(options['depth']):
+            level = [
+                Folder(name=f'folder-{depth}-{i}', parent=parent, owner=user)
+                for parent in parents
+                for i in range(options['fan_out'])
+            ]
+            Folder.objects.bulk_create(level, batch_size=self.batch_size)
+            for folder in level:
+                folder.path, folder.depth = folder.build_path()
+            Folder.objects.bulk_update(level, ['path', 'depth'], batch_size=self.batch_size)
+            created += level
+            parents = level
+        return created
+
+    def create_files(self, user, folders, options):
+        files = []
+        for folder in [None] + folders:
+            for i in range(options['files_per_folder']):
+                mime_type, extension, smallest, largest, _ = self.weighted(MIME_TYPES)
+                name = f'file-{i}.{extension}'
+                files.append(File(
+                    name=name, folder=folder, owner=user, mime_type=mime_type,
+                    # Log-uniform, so small files dominate like they do in practice.
+                    size=int(smallest * (largest / smallest) ** self.rng.random()),
+                    file=f'generated/{user.pk}/{folder.pk if folder else 0}/{name}',
+                ))
+        File.objects.bulk_create(files, batch_size=self.batch_size)
+        return files
+
+    def create_shares(self, items, others, options):
+        if not items or not others:
+            return 0
+        permissions = [
+            (SharePermission.VIEW, 70), (SharePermission.EDIT, 25), (SharePermission.ADMIN, 5)
+        ]
+        file_shares, folder_shares = [], []
+        for item in self.rng.sample(items, min(options['shares_per_user'], len(items))):
+            for recipient in self.rng.sample(others, min(self.rng.randint(1, 3), len(others))):
+                expires_at = None
+                if self.rng.random() < 0.1:
+                    # Half of the expiring shares have already expired.
+                    expires_at = self.now + timedelta(days=self.rng.randint(-30, 30))
+                fields = {
+                    'user': recipient,
+                    'permission': self.weighted(permissions)[0],
+                    'expires_at': expires_at,
+                }
+                if isinstance(item, Folder):
+                    folder_shares.append(FolderShare(folder=item, **fields))
+                else:
+                    file_shares.append(FileShare(file=item, **fields))
+        FileShare.objects.bulk_create(file_shares, batch_size=self.batch_size)
+        FolderShare.objects.bulk_create(folder_shares, batch_size=self.batch_size)
+        return len(file_shares) + len(folder_shares)
+
+    def create_links(self, files, options):
+        links = [
+            ShareLink(
+                file=file, created_by_id=file.owner_id,
+                max_downloads=self.rng.choice([None, None, None, 10, 100]),
+            )
+            for file in files
+            if self.rng.random() < options['link_ratio']
+        ]
+        ShareLink.objects.bulk_create(links, batch_size=self.batch_size)
+        return len(links)
+
+    def create_activity(self, user, files, options):
+        if not files:
+            return 0
+        events = [
+            ActivityLog(
+                user=user,
+                file=self.rng.choice(files),
+                activity_type=self.weighted(ACTIVITY_TYPES)[0],
+                ip_address=f'10.0.{self.rng.randint(0, 255)}.{self.rng.randint(1, 254)}',
+                user_agent='generate_dataset',
+                created_at=self.now - timedelta(
+                    seconds=self.rng.randint(0, options['activity_days'] * 86400)
+                ),
+            )
+            for _ in range(options['activity_per_user'])
+        ]
+        ActivityLog.objects.bulk_create(events, batch_size=self.batch_size)
+        return len(events)
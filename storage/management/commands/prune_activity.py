@@ -0,0 +1,79 @@
+import gzip
+import json
+import os
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from storage.models import ActivityLog
+
+FIELDS = (
+    'id', 'user_id', 'file_id', 'folder_id', 'activity_type',
+    'ip_address', 'user_agent', 'details', 'created_at',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete activity log rows from days older than the retention period, '
+        'optionally archiving them first to monthly gzip-compressed JSON Lines '
+        'files. Whole days are pruned, so rollups can still be rebuilt for '
+        'every day that has raw rows. Daily rollups are kept.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.ACTIVITY_LOG_RETENTION_DAYS,
+            help='Keep this many days of raw events.'
+        )
+        parser.add_argument(
+            '--archive-dir',
+            help='Append pruned rows to <dir>/activity-YYYY-MM.jsonl.gz before deleting.'
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        day = timezone.localdate() - timedelta(days=options['days'])
+        cutoff = timezone.make_aware(datetime.combine(day, time.min))
+        expired = ActivityLog.objects.filter(created_at__lt=cutoff).order_by('pk')
+
+        if options['dry_run']:
+            self.stdout.write(f'Would prune {expired.count()} activity rows older than {cutoff:%Y-%m-%d}.')
+            return
+
+        if options['archive_dir']:
+            os.makedirs(options['archive_dir'], exist_ok=True)
+
+        pruned = 0
+        last_pk = 0
+        while True:
+            batch = list(expired.filter(pk__gt=last_pk).values(*FIELDS)[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1]['id']
+            if options['archive_dir']:
+                self.archive(options['archive_dir'], batch)
+            with transaction.atomic():
+                ActivityLog.objects.filter(pk__in=[row['id'] for row in batch]).delete()
+            pruned += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Pruned {pruned} activity rows older than {cutoff:%Y-%m-%d}.'
+        ))
+
+    def archive(self, directory, rows):
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(row['created_at'].strftime('%Y-%m'), []).append(row)
+        for month, month_rows in by_month.items():
+            path = os.path.join(directory, f'activity-{month}.jsonl.gz')
+            # Appending adds a new gzip member; readers see one continuous stream.
+            with gzip.open(path, 'at', encoding='utf-8') as out:
+                for row in month_rows:
+                    out.write(json.dumps(row, cls=DjangoJSONEncoder))
+                    out.write('\n')
@@ -0,0 +1,64 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from storage import subtrees
+from storage.models import File, Folder
+
+
+class Command(BaseCommand):
+    help = (
+        'Permanently delete files and folders that have been in the trash for '
+        'longer than the retention period, in batches, and reclaim the blobs '
+        'they leave unreferenced.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.TRASH_RETENTION_DAYS,
+            help='Purge items trashed more than this many days ago.'
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--pause', type=float, default=0.5,
+            help='Seconds to sleep between batches, to leave room for other writers.'
+        )
+        parser.add_argument(
+            '--max-batches', type=int, default=0,
+            help='Stop after this many batches (0 purges everything due).'
+        )
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        # A folder's contents never left the trash after it, so anything in
+        # an expired folder is expired too.
+        files = File.all_objects.filter(trashed_at__lt=cutoff)
+        folders = Folder.all_objects.filter(trashed_at__lt=cutoff)
+
+        if options['dry_run']:
+            self.stdout.write(
+                f'Would purge {files.count()} files and {folders.count()} folders '
+                f'trashed before {cutoff:%Y-%m-%d}.'
+            )
+            return
+
+        purged = {'files': 0, 'folders': 0}
+        released = set()
+        batches = 0
+        for kind, count, blob_ids in subtrees.delete_batches(files, folders, options['batch_size']):
+            purged[kind] += count
+            released |= blob_ids
+            batches += 1
+            if options['max_batches'] and batches >= options['max_batches']:
+                break
+            time.sleep(options['pause'])
+
+        reclaimed = subtrees.reclaim(released)
+        self.stdout.write(self.style.SUCCESS(
+            f'Purged {purged["files"]} files and {purged["folders"]} folders; '
+            f'reclaimed {reclaimed} blobs.'
+        ))
@@ -0,0 +1,84 @@
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from storage.models import ActivityLog, ActivityRollup
+
+
+def start_of(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute daily activity rollups from the raw activity log. Days '
+        'whose raw rows were already pruned, wholly or in part, are left untouched.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='First day to rebuild (YYYY-MM-DD).')
+
+    def handle(self, *args, **options):
+        events = ActivityLog.objects.all()
+        rollups = ActivityRollup.objects.all()
+        if options['since']:
+            try:
+                since = datetime.strptime(options['since'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--since must be a date in YYYY-MM-DD format.')
+            events = events.filter(
+                created_at__gte=timezone.make_aware(datetime.combine(since, time.min))
+            )
+            rollups = rollups.filter(day__gte=since)
+
+        first = events.order_by('created_at').values_list('created_at', flat=True).first()
+        if first is None:
+            self.stdout.write('No raw activity to roll up.')
+            return
+        day = timezone.localdate(first)
+        if self.partly_pruned(day):
+            # Pruned before prune_activity kept to whole days.
+            day += timedelta(days=1)
+        events = events.filter(created_at__gte=start_of(day))
+        rollups = rollups.filter(day__gte=day)
+
+        totals = (
+            events.annotate(day=TruncDate('created_at'))
+            .values(
+                'day', 'activity_type',
+                user_key=Coalesce('user_id', Value(0)),
+                file_key=Coalesce('file_id', Value(0)),
+                folder_key=Coalesce('folder_id', Value(0)),
+            )
+            .annotate(total=Count('pk'))
+            .order_by()
+        )
+        with transaction.atomic():
+            rollups.delete()
+            created = ActivityRollup.objects.bulk_create(
+                (
+                    ActivityRollup(
+                        day=row['day'],
+                        activity_type=row['activity_type'],
+                        user_id=row['user_key'],
+                        file_id=row['file_key'],
+                        folder_id=row['folder_key'],
+                        count=row['total'],
+                    )
+                    for row in totals.iterator()
+                ),
+                batch_size=1000,
+            )
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(created)} rollup rows.'))
+
+    def partly_pruned(self, day):
+        """True if ``day``'s rollups count more events than its raw rows hold."""
+        rolled_up = ActivityRollup.objects.filter(day=day).aggregate(total=Sum('count'))['total'] or 0
+        raw = ActivityLog.objects.filter(
+            created_at__gte=start_of(day), created_at__lt=start_of(day + timedelta(days=1))
+        ).count()
+        return rolled_up > raw
@@ -0,0 +1,38 @@
+from django.db import transaction
+from django.core.management.base import BaseCommand
+
+from storage.models import Folder
+
+
+class Command(BaseCommand):
+    help = 'Recompute Folder.path and Folder.depth for every folder, level by level.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        total = 0
+        depth = 0
+        with transaction.atomic():
+            level = list(Folder.all_objects.filter(parent__isnull=True).only('id'))
+            for folder in level:
+                folder.path, folder.depth = f'/{folder.pk}/', 0
+            while level:
+                Folder.all_objects.bulk_update(level, ['path', 'depth'], batch_size=batch_size)
+                total += len(level)
+                paths = {folder.pk: folder.path for folder in level}
+                parent_ids = list(paths)
+                depth += 1
+                level = []
+                for start in range(0, len(parent_ids), batch_size):
+                    for child in Folder.all_objects.filter(
+                        parent_id__in=parent_ids[start:start + batch_size]
+                    ).only('id', 'parent_id'):
+                        child.path = f'{paths[child.parent_id]}{child.pk}/'
+                        child.depth = depth
+                        level.append(child)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt paths for {total} folders across {depth} levels.'
+        ))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from storage import search
+from storage.models import File, Folder
+
+
+class Command(BaseCommand):
+    help = 'Drop and rebuild the full-text search index for files and folders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        indexed = 0
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                backend.drop(cursor)
+                backend.install(cursor)
+                for queryset, to_row in (
+                    (File.all_objects.only('id', 'name', 'mime_type'), search.file_row),
+                    (Folder.all_objects.only('id', 'name', 'description'), search.folder_row),
+                ):
+                    rows = []
+                    for obj in queryset.iterator(chunk_size=options['batch_size']):
+                        rows.append(to_row(obj))
+                        if len(rows) == options['batch_size']:
+                            backend.write(cursor, rows)
+                            indexed += len(rows)
+                            rows = []
+                    backend.write(cursor, rows)
+                    indexed += len(rows)
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} files and folders.'))
@@ -0,0 +1,75 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from storage import usage
+from storage.models import File, StorageUsage, StorageUsageByType
+
+
+class Command(BaseCommand):
+    help = 'Recompute per-user storage usage counters from the File table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        totals = defaultdict(lambda: [0, 0])
+        by_type = defaultdict(lambda: [0, 0])
+        rows = (
+            File.all_objects.values('owner_id', 'mime_type')
+            .annotate(bytes_used=Sum('size'), file_count=Count('pk'))
+            .order_by()
+        )
+        for row in rows.iterator():
+            for counters, key in (
+                (totals, row['owner_id']),
+                (by_type, (row['owner_id'], usage.mime_class(row['mime_type']))),
+            ):
+                counters[key][0] += row['bytes_used'] or 0
+                counters[key][1] += row['file_count']
+
+        recorded = {
+            row['user_id']: [row['bytes_used'], row['file_count']]
+            for row in StorageUsage.objects.values('user_id', 'bytes_used', 'file_count')
+        }
+        recorded_by_type = {
+            (row['user_id'], row['mime_class']): [row['bytes_used'], row['file_count']]
+            for row in StorageUsageByType.objects.values(
+                'user_id', 'mime_class', 'bytes_used', 'file_count'
+            )
+        }
+
+        drifted = {
+            user_id for user_id in totals.keys() | recorded.keys()
+            if totals.get(user_id, [0, 0]) != recorded.get(user_id, [0, 0])
+        } | {
+            user_id for user_id, mime_class in by_type.keys() | recorded_by_type.keys()
+            if by_type.get((user_id, mime_class), [0, 0]) != recorded_by_type.get((user_id, mime_class), [0, 0])
+        }
+
+        for user_id in sorted(drifted):
+            expected = totals.get(user_id, [0, 0])
+            self.stdout.write(
+                f'User {user_id}: recorded {recorded.get(user_id, [0, 0])}, actual {expected}'
+            )
+            if options['dry_run']:
+                continue
+            with transaction.atomic():
+                StorageUsage.objects.update_or_create(
+                    user_id=user_id,
+                    defaults={'bytes_used': expected[0], 'file_count': expected[1]}
+                )
+                StorageUsageByType.objects.filter(user_id=user_id).delete()
+                StorageUsageByType.objects.bulk_create([
+                    StorageUsageByType(
+                        user_id=owner_id, mime_class=mime_class,
+                        bytes_used=counters[0], file_count=counters[1]
+                    )
+                    for (owner_id, mime_class), counters in by_type.items()
+                    if owner_id == user_id
+                ])
+
+        verb = 'Found' if options['dry_run'] else 'Repaired'
+        self.stdout.write(self.style.SUCCESS(f'{verb} drift for {len(drifted)} users.'))
@@ -0,0 +1,51 @@
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from storage import jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Run queued background jobs (JOB_BACKEND = "database"). Jobs left '
+        'running by a worker that died are queued again and resume from '
+        'their last checkpoint.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once the queue is empty instead of waiting for more jobs.'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=2.0,
+            help='Seconds to wait between polls of an empty queue.'
+        )
+        parser.add_argument(
+            '--max-jobs', type=int, default=0,
+            help='Exit after this many jobs (0 runs forever); lets a supervisor recycle the process.'
+        )
+
+    def handle(self, *args, **options):
+        worker = f'{socket.gethostname()}:{os.getpid()}'
+        done = 0
+        while not options['max_jobs'] or done < options['max_jobs']:
+            close_old_connections()
+            requeued, failed = jobs.requeue_stale()
+            if requeued or failed:
+                self.stdout.write(f'Requeued {requeued} and failed {failed} stale jobs.')
+
+            job_id = jobs.claim(worker)
+            if job_id is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+            self.stdout.write(f'Running job {job_id}.')
+            jobs.run(job_id)
+            done += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Ran {done} jobs.'))
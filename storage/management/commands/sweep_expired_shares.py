@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from storage import expiry
+
+
+class Command(BaseCommand):
+    help = (
+        'Deactivate file shares, folder shares and share links past their '
+        'expiry date, logging an UNSHARE for each and dropping cached '
+        'permissions and links. Run it from cron, or with --loop as a daemon.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep sweeping every --interval seconds instead of exiting.'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=settings.SHARE_EXPIRY_SWEEP_INTERVAL,
+            help='Seconds to wait between sweeps with --loop.'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            swept = expiry.sweep(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Deactivated {swept['file_shares']} file shares, "
+                f"{swept['folder_shares']} folder shares and {swept['links']} share links."
+            ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
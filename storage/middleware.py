@@ -1,4 +1,11 @@
+import cProfile
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
 from django.utils.deprecation import MiddlewareMixin
+
+from . import instrumentation
 from .models import ActivityLog
 
 
@@ -13,4 +20,44 @@ class ActivityLogMiddleware(MiddlewareMixin):
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
         if x_forwarded_for:
             return x_forwarded_for.split(',')[0]
-        return request.META.get('REMMOTE_ADDR')
\ No newline at end of file
+        return request.META.get('REMOTE_ADDR')
+
+
+class InstrumentationMiddleware:
+    """Profile requests into ``storage.instrumentation`` when it is enabled."""
+
+    def __init__(self, get_response):
+        if not settings.INSTRUMENTATION_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profiler = cProfile.Profile() if instrumentation.should_profile() else None
+        start = time.perf_counter()
+        with instrumentation.recording() as recording:
+            if profiler:
+                profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler:
+                    profiler.disable()
+        duration = time.perf_counter() - start
+
+        sample = instrumentation.make_sample(request, response, recording, duration)
+        instrumentation.record(sample)
+        if profiler and duration * 1000 >= settings.INSTRUMENTATION_SLOW_REQUEST_MS:
+            instrumentation.dump_profile(profiler, sample)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns, still inside get_response.
+        recording = instrumentation.current()
+        if recording is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                recording.phases['render'] += time.perf_counter() - start
+
+            response.add_post_render_callback(rendered)
+        return response
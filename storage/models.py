@@ -1,5 +1,8 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, Sum, Value
+from django.db.models.functions import Concat, Substr
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import check_password
 from django.utils import timezone
 import uuid
 
@@ -20,10 +23,32 @@ class ActivityType(models.TextChoices):
     VIEW = 'VIEW', 'File Viewed'
 
 
+class JobStatus(models.TextChoices):
+    PENDING = 'PENDING', 'Pending'
+    RUNNING = 'RUNNING', 'Running'
+    SUCCEEDED = 'SUCCEEDED', 'Succeeded'
+    FAILED = 'FAILED', 'Failed'
+
+
+class UploadStatus(models.TextChoices):
+    ACTIVE = 'ACTIVE', 'Active'
+    COMMITTED = 'COMMITTED', 'Committed'
+    ABORTED = 'ABORTED', 'Aborted'
+
+
+class ChangeAction(models.TextChoices):
+    CREATE = 'CREATE', 'Created'
+    UPDATE = 'UPDATE', 'Updated'
+    MOVE = 'MOVE', 'Moved or Renamed'
+    DELETE = 'DELETE', 'Deleted'
+    SHARE = 'SHARE', 'Shared'
+    UNSHARE = 'UNSHARE', 'Unshared'
+
+
 class ShareLink(models.Model):
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
-    file = models.ForeignKey('File', null=True, blank=True, on_delete=models.CASCADE)
-    folder = models.ForeignKey('Folder', null=True, blank=True, on_delete=models.CASCADE)
+    file = models.ForeignKey('File', null=True, blank=True, on_delete=models.CASCADE, related_name='share_links')
+    folder = models.ForeignKey('Folder', null=True, blank=True, on_delete=models.CASCADE, related_name='share_links')
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField(null=True, blank=True)
@@ -32,15 +57,25 @@ class ShareLink(models.Model):
     download_count = models.IntegerField(default=0)
     is_active = models.BooleanField(default=True)
 
-    def is_valid(self):
+    def is_valid(self, check_downloads=True):
         if not self.is_active:
             return False
         if self.expires_at and self.expires_at < timezone.now():
             return False
-        if self.max_downloads and self.download_count >=self.max_downloads:
+        if check_downloads and self.max_downloads and self.download_count >=self.max_downloads:
             return False
         return True
 
+    def check_password(self, raw_password):
+        if not self.password:
+            return True
+        return check_password(raw_password, self.password)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_active', 'expires_at']),
+        ]
+
 
 class ActivityLog(models.Model):
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null = True)
@@ -50,7 +85,43 @@ class ActivityLog(models.Model):
     ip_address = models.GenericIPAddressField(null=True)
     user_agent = models.TextField(null=True)
     details = models.JSONField(default = dict)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: buffered events keep the time they happened, not the time they were flushed.
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(fields=['activity_type', 'created_at']),
+            models.Index(fields=['file', 'created_at', 'id']),
+            models.Index(fields=['user', 'created_at', 'id']),
+        ]
+
+
+class ActivityRollup(models.Model):
+    """Daily event counts per activity type, user, file and folder.
+
+    Dimensions are plain ids (0 when absent) rather than foreign keys so
+    that totals survive the deletion of the rows they describe and so that
+    the unique key never contains NULLs.
+    """
+    day = models.DateField()
+    activity_type = models.CharField(max_length=10, choices=ActivityType.choices)
+    user_id = models.BigIntegerField(default=0)
+    file_id = models.BigIntegerField(default=0)
+    folder_id = models.BigIntegerField(default=0)
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'activity_type', 'user_id', 'file_id', 'folder_id'],
+                name='activity_rollup_unique_key',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['file_id', 'day']),
+            models.Index(fields=['user_id', 'day']),
+        ]
 
 
 class BaseSharingModel(models.Model):
@@ -73,6 +144,9 @@ class FileShare(BaseSharingModel):
 
     class Meta:
         unique_together = ('file', 'user')
+        indexes = [
+            models.Index(fields=['is_active', 'expires_at']),
+        ]
 
 
 class FolderShare(BaseSharingModel):
@@ -81,6 +155,16 @@ class FolderShare(BaseSharingModel):
 
     class Meta:
         unique_together = ('folder', 'user')
+        indexes = [
+            models.Index(fields=['is_active', 'expires_at']),
+        ]
+
+
+class LiveManager(models.Manager):
+    """Leaves out rows in the trash; ``all_objects`` still sees them."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(trashed_at__isnull=True)
 
 
 class Folder(models.Model):
@@ -88,32 +172,259 @@ class Folder(models.Model):
     description = models.TextField(blank=True)
     parent = models.ForeignKey('self', null = True, blank = True, on_delete=models.CASCADE)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='owned_folders')
+    # Materialized path of primary keys from the root down to and including
+    # this folder, e.g. "/3/17/42/". Maintained by save(); never set by hand.
+    path = models.CharField(max_length=1024, db_index=True, editable=False, default='')
+    depth = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Set while the folder is in the trash; see storage.trash.
+    trashed_at = models.DateTimeField(null=True, blank=True, editable=False)
     shared_users = models.ManyToManyField(
         User,
         through='FolderShare',
         related_name='shared_folders'
     )
 
+    objects = LiveManager()
+    all_objects = models.Manager()
+
     class Meta:
-        unique_together = ('name','parent', 'owner')
+        constraints = [
+            # Trashed folders give up their name.
+            models.UniqueConstraint(
+                fields=['name', 'parent', 'owner'],
+                condition=models.Q(trashed_at__isnull=True),
+                name='unique_live_folder_name',
+            ),
+        ]
+        indexes = [
+            # Keyset pagination on (updated_at, id).
+            models.Index(fields=['updated_at', 'id']),
+            models.Index(fields=['trashed_at']),
+        ]
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        with transaction.atomic():
+            if self._state.adding:
+                super().save(*args, **kwargs)
+                self.path, self.depth = self.build_path()
+                Folder.all_objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+                return
+
+            if update_fields is not None and 'parent' not in update_fields:
+                super().save(*args, **kwargs)
+                return
+
+            previous_parent_id, previous_path, previous_depth = Folder.all_objects.filter(
+                pk=self.pk
+            ).values_list('parent_id', 'path', 'depth').get()
+            super().save(*args, **kwargs)
+            if previous_parent_id != self.parent_id:
+                self.move_subtree(previous_path, previous_depth)
+
+    def build_path(self):
+        if self.parent_id is None:
+            return f'/{self.pk}/', 0
+        return f'{self.parent.path}{self.pk}/', self.parent.depth + 1
+
+    def move_subtree(self, previous_path, previous_depth):
+        """Rewrite the path of this folder and all its descendants in one UPDATE."""
+        path, depth = self.build_path()
+        if path.startswith(previous_path) and path != previous_path:
+            raise ValueError('A folder cannot be moved into its own subtree.')
+        Folder.all_objects.filter(path__startswith=previous_path).update(
+            path=Concat(
+                Value(path),
+                Substr('path', len(previous_path) + 1),
+                output_field=models.CharField()
+            ),
+            depth=F('depth') + (depth - previous_depth),
+        )
+        self.path, self.depth = path, depth
+
+    def ancestor_ids(self):
+        return [int(pk) for pk in self.path.strip('/').split('/')[:-1] if pk]
+
+    def ancestors(self):
+        return Folder.objects.filter(pk__in=self.ancestor_ids()).order_by('depth')
+
+    def descendants(self, include_self=False):
+        folders = Folder.objects.filter(path__startswith=self.path)
+        if not include_self:
+            folders = folders.exclude(pk=self.pk)
+        return folders
+
+    def subtree_stats(self):
+        return File.objects.filter(folder__path__startswith=self.path).aggregate(
+            file_count=Count('pk'),
+            total_size=Sum('size', default=0),
+        )
+
+
+class Blob(models.Model):
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    size = models.BigIntegerField()
+    file = models.FileField(upload_to='blobs', max_length=255)
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ref_count', 'updated_at']),
+        ]
 
 
 class File(models.Model):
     name = models.CharField(max_length=255)
-    folder = models.ForeignKey(Folder, null=True, blank=True, on_delete=models.CASCADE)
+    folder = models.ForeignKey(Folder, null=True, blank=True, on_delete=models.CASCADE, related_name='files')
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='owned_files')
-    file = models.FileField(upload_to='files/%Y/%m/%d')
+    file = models.FileField(upload_to='files/%Y/%m/%d', max_length=255)
+    blob = models.ForeignKey(Blob, null=True, blank=True, on_delete=models.PROTECT, related_name='files')
     size = models.BigIntegerField()
     mime_type = models.CharField(max_length=100)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Set while the file is in the trash; see storage.trash.
+    trashed_at = models.DateTimeField(null=True, blank=True, editable=False)
     shared_users = models.ManyToManyField(
         User,
         through='FileShare',
         related_name='shared_files'
     )
 
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'folder', 'owner'],
+                condition=models.Q(trashed_at__isnull=True),
+                name='unique_live_file_name',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['updated_at', 'id']),
+            models.Index(fields=['trashed_at']),
+        ]
+
+
+class UploadSession(models.Model):
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    folder = models.ForeignKey(Folder, null=True, blank=True, on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    chunk_size = models.IntegerField()
+    mime_type = models.CharField(max_length=100, blank=True)
+    status = models.CharField(
+        max_length=10,
+        choices=UploadStatus.choices,
+        default=UploadStatus.ACTIVE,
+    )
+    file = models.ForeignKey(File, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    expires_at = models.DateTimeField()
+
+    @property
+    def total_chunks(self):
+        return -(-self.size // self.chunk_size)
+
+    def chunk_length(self, index):
+        if index < self.total_chunks - 1:
+            return self.chunk_size
+        return self.size - self.chunk_size * (self.total_chunks - 1)
+
+    def is_expired(self):
+        return self.expires_at < timezone.now()
+
+
+class Job(models.Model):
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    kind = models.CharField(max_length=50)
+    status = models.CharField(
+        max_length=10,
+        choices=JobStatus.choices,
+        default=JobStatus.PENDING,
+    )
+    created_by = models.ForeignKey(User, null=True, on_delete=models.SET_NULL, related_name='jobs')
+    payload = models.JSONField(default=dict)
+    progress = models.BigIntegerField(default=0)
+    total = models.BigIntegerField(default=0)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    # Checkpoint a handler resumes from when the job is run again.
+    state = models.JSONField(default=dict)
+    attempts = models.PositiveIntegerField(default=0)
+    # Set while a worker holds the job; a stale heartbeat means it died.
+    worker = models.CharField(max_length=100, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
     class Meta:
-        unique_together = ('name','folder', 'owner')
\ No newline at end of file
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['created_by', 'created_at', 'id']),
+        ]
+
+
+class StorageUsage(models.Model):
+    """Running totals of what a user stores, kept current by ``storage.usage``."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='storage_usage')
+    bytes_used = models.BigIntegerField(default=0)
+    file_count = models.BigIntegerField(default=0)
+    # Bytes the user may store; null falls back to STORAGE_DEFAULT_QUOTA.
+    quota = models.BigIntegerField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class StorageUsageByType(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='storage_usage_by_type')
+    mime_class = models.CharField(max_length=20)
+    bytes_used = models.BigIntegerField(default=0)
+    file_count = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'mime_class')
+
+
+class Change(models.Model):
+    """One entry of the sync change journal; see ``storage.journal``.
+
+    Like ``ActivityRollup``, the object, owner and share recipient are plain
+    ids (0 when absent) so entries outlive the rows they describe.
+    """
+    id = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=10)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ChangeAction.choices)
+    owner_id = models.BigIntegerField(default=0)
+    # The user a share was granted to or revoked from.
+    user_id = models.BigIntegerField(default=0)
+    # Materialized folder path the object sits in after and before the
+    # change, used to show the entry to users of shared folders.
+    path = models.CharField(max_length=1024, blank=True)
+    previous_path = models.CharField(max_length=1024, blank=True)
+    data = models.JSONField(default=dict)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(fields=['owner_id', 'id']),
+            models.Index(fields=['user_id', 'id']),
+            models.Index(fields=['kind', 'object_id', 'id']),
+        ]
+
+
+class ChangePrune(models.Model):
+    """Low-water mark of the change journal: entries up to ``through_id`` are gone."""
+    through_id = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,241 @@
+"""Effective permissions on files and folders.
+
+A user's permission on an object is the strongest of:
+
+* ``OWNER`` if they own it,
+* a direct, active, unexpired ``FileShare``/``FolderShare``,
+* an active, unexpired ``FolderShare`` on any ancestor folder.
+
+``PermissionResolver`` answers this for whole batches of objects in a
+constant number of queries (folder paths make ancestors a string split) and
+memoizes answers for the rest of the request. With ``SHARED_CACHE``
+answers are also kept in the Django cache under keys that embed a global
+version and a per-user version. Share changes bump the user's version;
+moves bump the global one; so stale entries are never read and simply age
+out. A per-process cache would keep serving revoked shares from every
+worker but the one that bumped the version, so it is only used per request.
+"""
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import File, FileShare, Folder, FolderShare, SharePermission
+
+OWNER = 'OWNER'
+RANK = {
+    None: 0,
+    SharePermission.VIEW: 1,
+    SharePermission.EDIT: 2,
+    SharePermission.ADMIN: 3,
+    OWNER: 4,
+}
+
+GLOBAL_VERSION_KEY = 'perm:version'
+USER_VERSION_KEY = 'perm:version:user:{}'
+
+
+def strongest(permissions):
+    return max(permissions, key=RANK.__getitem__, default=None)
+
+
+def at_least(permission, required):
+    return RANK[permission] >= RANK[required]
+
+
+def path_ids(path):
+    return [int(pk) for pk in path.strip('/').split('/') if pk]
+
+
+def active_shares(model, user):
+    now = timezone.now()
+    return model.objects.filter(user=user, is_active=True).filter(
+        Q(expires_at__isnull=True) | Q(expires_at__gt=now)
+    )
+
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def invalidate_user(user_id):
+    bump_version(USER_VERSION_KEY.format(user_id))
+
+
+def invalidate_all():
+    bump_version(GLOBAL_VERSION_KEY)
+
+
+class PermissionResolver:
+    def __init__(self, user):
+        self.user = user
+        self.memo = {}
+        self._prefix = None
+
+    @property
+    def prefix(self):
+        if self._prefix is None:
+            user_key = USER_VERSION_KEY.format(self.user.pk)
+            versions = cache.get_many([GLOBAL_VERSION_KEY, user_key])
+            self._prefix = 'perm:{}:{}:{}'.format(
+                versions.get(GLOBAL_VERSION_KEY, 0),
+                versions.get(user_key, 0),
+                self.user.pk,
+            )
+        return self._prefix
+
+    def permission(self, obj):
+        if isinstance(obj, Folder):
+            return self.folders([obj])[obj.pk]
+        return self.files([obj])[obj.pk]
+
+    def has(self, obj, required):
+        return at_least(self.permission(obj), required)
+
+    def files(self, files):
+        return self._resolve('file', files, self._resolve_files)
+
+    def folders(self, folders):
+        return self._resolve('folder', folders, self._resolve_folders)
+
+    def _resolve(self, kind, objects, compute):
+        if not self.user.is_authenticated:
+            return {obj.pk: None for obj in objects}
+
+        result = {}
+        pending = []
+        for obj in objects:
+            if (kind, obj.pk) in self.memo:
+                result[obj.pk] = self.memo[kind, obj.pk]
+            else:
+                pending.append(obj)
+
+        if pending and not settings.SHARED_CACHE:
+            result.update(compute(pending)[0])
+        elif pending:
+            keys = {f'{self.prefix}:{kind}:{obj.pk}': obj for obj in pending}
+            cached = cache.get_many(keys)
+            missing = [obj for key, obj in keys.items() if key not in cached]
+            for key, value in cached.items():
+                result[keys[key].pk] = value or None
+
+            if missing:
+                computed, timeout = compute(missing)
+                cache.set_many(
+                    {f'{self.prefix}:{kind}:{pk}': value or '' for pk, value in computed.items()},
+                    timeout,
+                )
+                result.update(computed)
+
+        for obj in pending:
+            self.memo[kind, obj.pk] = result[obj.pk]
+        return result
+
+    def _timeout(self, shares):
+        """Cache no longer than the first contributing share stays valid."""
+        timeout = settings.PERMISSION_CACHE_TTL
+        now = timezone.now()
+        for share in shares:
+            if share['expires_at']:
+                timeout = min(timeout, max(int((share['expires_at'] - now).total_seconds()), 1))
+        return timeout
+
+    def _folder_shares(self, folder_ids):
+        if not folder_ids:
+            return {}, []
+        shares = list(
+            active_shares(FolderShare, self.user)
+            .filter(folder_id__in=folder_ids)
+            .values('folder_id', 'permission', 'expires_at')
+        )
+        return {share['folder_id']: share['permission'] for share in shares}, shares
+
+    def _resolve_folders(self, folders):
+        shared = [folder for folder in folders if folder.owner_id != self.user.pk]
+        ancestors = {pk for folder in shared for pk in path_ids(folder.path)}
+        by_folder, shares = self._folder_shares(ancestors)
+
+        result = {folder.pk: OWNER for folder in folders}
+        for folder in shared:
+            result[folder.pk] = strongest(
+                by_folder[pk] for pk in path_ids(folder.path) if pk in by_folder
+            )
+        return result, self._timeout(shares)
+
+    def _resolve_files(self, files):
+        shared = [file for file in files if file.owner_id != self.user.pk]
+
+        direct = list(
+            active_shares(FileShare, self.user)
+            .filter(file_id__in=[file.pk for file in shared])
+            .values('file_id', 'permission', 'expires_at')
+        ) if shared else []
+        by_file = {share['file_id']: share['permission'] for share in direct}
+
+        paths = {}
+        unknown = set()
+        for file in shared:
+            if file.folder_id is None:
+                continue
+            if File.folder.is_cached(file):
+                paths[file.folder_id] = file.folder.path
+            else:
+                unknown.add(file.folder_id)
+        if unknown:
+            paths.update(Folder.all_objects.filter(pk__in=unknown).values_list('id', 'path'))
+
+        ancestors = {pk for path in paths.values() for pk in path_ids(path)}
+        by_folder, inherited = self._folder_shares(ancestors)
+
+        result = {file.pk: OWNER for file in files}
+        for file in shared:
+            candidates = [by_file.get(file.pk)]
+            if file.folder_id in paths:
+                candidates += [
+                    by_folder[pk] for pk in path_ids(paths[file.folder_id]) if pk in by_folder
+                ]
+            result[file.pk] = strongest(candidates)
+        return result, self._timeout(direct + inherited)
+
+
+def get_resolver(request, user=None):
+    """Return the resolver memoized on this request for ``user``."""
+    user = user or request.user
+    resolvers = request.__dict__.setdefault('_permission_resolvers', {})
+    if user.pk not in resolvers:
+        resolvers[user.pk] = PermissionResolver(user)
+    return resolvers[user.pk]
+
+
+def shared_folder_q(user, field='path'):
+    """Match folders at or below any folder shared with ``user``."""
+    roots = active_shares(FolderShare, user).values_list('folder__path', flat=True)
+    return reduce(or_, (Q(**{f'{field}__startswith': path}) for path in roots), Q(pk__in=[]))
+
+
+def accessible_folders(user):
+    return Folder.objects.filter(Q(owner=user) | shared_folder_q(user))
+
+
+def accessible_files(user):
+    direct = active_shares(FileShare, user).values('file_id')
+    return File.objects.filter(
+        Q(owner=user) |
+        Q(pk__in=direct) |
+        shared_folder_q(user, 'folder__path')
+    )
+
+
+def link_covers(link, obj):
+    """Whether a share link grants access to ``obj``."""
+    if link.file_id is not None:
+        return isinstance(obj, File) and obj.pk == link.file_id
+    if isinstance(obj, Folder):
+        return obj.path.startswith(link.folder.path)
+    return obj.folder_id is not None and obj.folder.path.startswith(link.folder.path)
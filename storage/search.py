@@ -0,0 +1,279 @@
+"""Full-text search over file and folder names.
+
+One index row per ``File`` and ``Folder`` holds its name, description and
+MIME type. The signals in ``storage.signals`` keep rows in step with writes
+(in the same transaction), ``rebuild_search_index`` recreates everything,
+and the table itself is created after ``migrate``.
+
+The storage engine is picked by ``SEARCH_BACKEND`` (``"auto"`` follows the
+database vendor):
+
+``sqlite``
+    an FTS5 virtual table ranked with ``bm25``. Query words match as
+    prefixes; words of four or more letters are also expanded with close
+    spellings found in the index vocabulary (``fts5vocab``), which gives
+    typo tolerance without scanning rows. Only a bounded set of candidate
+    terms, picked by prefix and length in SQL, is scored in Python.
+``postgresql``
+    a table with a weighted, generated ``tsvector`` (GIN indexed) ranked
+    with ``ts_rank``, plus ``pg_trgm`` similarity on names for typos.
+``basic``
+    a plain table matched with ``LIKE``, for anything else.
+
+``search`` ranks, permission-filters and paginates entirely in SQL and only
+loads the rows of the requested page. It reads from whichever database the
+router picks for ``File``, so searches go to a replica when one serves the
+request; index writes always go to the primary.
+"""
+import difflib
+import re
+
+from django.conf import settings
+from django.db import connection, connections, router
+
+from .models import File
+from .permissions import accessible_files, accessible_folders
+
+TABLE = 'storage_search'
+VOCAB_TABLE = 'storage_search_vocab'
+KINDS = ('file', 'folder')
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+# Vocabulary terms considered per prefix probe when correcting a word.
+SUGGESTION_CANDIDATES = 100
+
+
+def tokens(query):
+    return TOKEN_RE.findall(query.lower())[:10]
+
+
+def prefix_range(prefix):
+    """Bounds ``[low, high)`` of the strings starting with ``prefix``."""
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def row_id(kind, pk):
+    # Deterministic rowids turn updates and deletes into rowid lookups.
+    return pk * 2 + KINDS.index(kind)
+
+
+class SqliteBackend:
+    def install(self, cursor):
+        cursor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5('
+            'name, description, mime_type, kind UNINDEXED, object_id UNINDEXED, '
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {VOCAB_TABLE} USING fts5vocab({TABLE}, 'row')"
+        )
+
+    def drop(self, cursor):
+        cursor.execute(f'DROP TABLE IF EXISTS {VOCAB_TABLE}')
+        cursor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+    def write(self, cursor, rows):
+        cursor.executemany(
+            f'DELETE FROM {TABLE} WHERE rowid = %s',
+            [(row_id(kind, pk),) for kind, pk, *_ in rows]
+        )
+        cursor.executemany(
+            f'INSERT INTO {TABLE} (rowid, name, description, mime_type, kind, object_id) '
+            'VALUES (%s, %s, %s, %s, %s, %s)',
+            [
+                (row_id(kind, pk), name, description, mime_type, kind, pk)
+                for kind, pk, name, description, mime_type in rows
+            ]
+        )
+
+    def delete(self, cursor, kind, pks):
+        cursor.executemany(
+            f'DELETE FROM {TABLE} WHERE rowid = %s', [(row_id(kind, pk),) for pk in pks]
+        )
+
+    def similar_terms(self, cursor, word):
+        if len(word) < 4:
+            return []
+        # Typos rarely hit the first letter: probe terms starting with the
+        # first two letters, and with the first and third for a slip in the
+        # second. fts5vocab turns the term bounds into a range scan.
+        selects, params = [], []
+        for prefix in {word[:2], word[0] + word[2]}:
+            selects.append(
+                f'SELECT term FROM (SELECT term FROM {VOCAB_TABLE} '
+                'WHERE term >= %s AND term < %s AND length(term) BETWEEN %s AND %s '
+                'ORDER BY doc DESC LIMIT %s)'
+            )
+            params += [*prefix_range(prefix), len(word) - 2, len(word) + 2, SUGGESTION_CANDIDATES]
+        cursor.execute(' UNION '.join(selects), params)
+        terms = [term for term, in cursor.fetchall()]
+        return difflib.get_close_matches(word, terms, n=3, cutoff=0.75)
+
+    def match(self, cursor, words):
+        clauses = []
+        for word in words:
+            options = [f'"{word}"*'] + [f'"{term}"' for term in self.similar_terms(cursor, word)]
+            clauses.append('(' + ' OR '.join(options) + ')')
+        return (
+            f'{TABLE} MATCH %s', [' AND '.join(clauses)],
+            f'-bm25({TABLE}, 10.0, 3.0, 1.0)', [],
+        )
+
+
+class PostgresBackend:
+    def install(self, cursor):
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS {TABLE} ('
+            'kind varchar(10) NOT NULL, object_id bigint NOT NULL, '
+            'name text NOT NULL, description text NOT NULL, mime_type text NOT NULL, '
+            "document tsvector GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('simple', name), 'A') || "
+            "setweight(to_tsvector('simple', description), 'B') || "
+            "setweight(to_tsvector('simple', replace(mime_type, '/', ' ')), 'C')) STORED, "
+            'PRIMARY KEY (kind, object_id))'
+        )
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {TABLE}_document ON {TABLE} USING gin (document)')
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS {TABLE}_name_trgm ON {TABLE} USING gin (lower(name) gin_trgm_ops)'
+        )
+
+    def drop(self, cursor):
+        cursor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+    def write(self, cursor, rows):
+        cursor.executemany(
+            f'INSERT INTO {TABLE} (kind, object_id, name, description, mime_type) '
+            'VALUES (%s, %s, %s, %s, %s) ON CONFLICT (kind, object_id) DO UPDATE SET '
+            'name = excluded.name, description = excluded.description, mime_type = excluded.mime_type',
+            rows
+        )
+
+    def delete(self, cursor, kind, pks):
+        cursor.execute(f'DELETE FROM {TABLE} WHERE kind = %s AND object_id = ANY(%s)', [kind, list(pks)])
+
+    def match(self, cursor, words):
+        tsquery = ' & '.join(f"'{word}':*" for word in words)
+        text = ' '.join(words)
+        return (
+            "(document @@ to_tsquery('simple', %s) OR lower(name) %% %s)", [tsquery, text],
+            "ts_rank(document, to_tsquery('simple', %s)) + similarity(lower(name), %s)", [tsquery, text],
+        )
+
+
+class BasicBackend:
+    def install(self, cursor):
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS {TABLE} ('
+            'kind varchar(10) NOT NULL, object_id bigint NOT NULL, '
+            'name varchar(255) NOT NULL, description text NOT NULL, mime_type varchar(100) NOT NULL, '
+            'PRIMARY KEY (kind, object_id))'
+        )
+
+    def drop(self, cursor):
+        cursor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+    def write(self, cursor, rows):
+        for kind, pk, *_ in rows:
+            self.delete(cursor, kind, [pk])
+        cursor.executemany(
+            f'INSERT INTO {TABLE} (kind, object_id, name, description, mime_type) '
+            'VALUES (%s, %s, %s, %s, %s)', rows
+        )
+
+    def delete(self, cursor, kind, pks):
+        cursor.executemany(
+            f'DELETE FROM {TABLE} WHERE kind = %s AND object_id = %s', [(kind, pk) for pk in pks]
+        )
+
+    def match(self, cursor, words):
+        where = ' AND '.join(['(LOWER(name) LIKE %s OR LOWER(description) LIKE %s)'] * len(words))
+        params = [f'%{word}%' for word in words for _ in range(2)]
+        return where, params, '0', []
+
+
+BACKENDS = {
+    'sqlite': SqliteBackend,
+    'postgresql': PostgresBackend,
+    'basic': BasicBackend,
+}
+
+
+def get_backend():
+    name = settings.SEARCH_BACKEND
+    if name == 'auto':
+        name = connection.vendor if connection.vendor in BACKENDS else 'basic'
+    return BACKENDS[name]()
+
+
+def install(**kwargs):
+    """``post_migrate`` receiver creating the index table."""
+    if kwargs.get('using', 'default') != 'default':
+        return
+    with connection.cursor() as cursor:
+        get_backend().install(cursor)
+
+
+def file_row(file):
+    return ('file', file.pk, file.name, '', file.mime_type or '')
+
+
+def folder_row(folder):
+    return ('folder', folder.pk, folder.name, folder.description or '', '')
+
+
+def index(rows):
+    if rows:
+        with connection.cursor() as cursor:
+            get_backend().write(cursor, rows)
+
+
+def remove(kind, pks):
+    if pks:
+        with connection.cursor() as cursor:
+            get_backend().delete(cursor, kind, pks)
+
+
+def read_connection():
+    return connections[router.db_for_read(File)]
+
+
+def search(user, query, kinds=KINDS, limit=20, offset=0):
+    """Return ``(total, [(kind, object_id, score), ...])`` for ``user``."""
+    words = tokens(query)
+    if not words:
+        return 0, []
+
+    accessible = {
+        'file': accessible_files(user),
+        'folder': accessible_folders(user),
+    }
+    scopes, scope_params = [], []
+    for kind in kinds:
+        sql, params = accessible[kind].values('pk').query.sql_with_params()
+        scopes.append(f"(kind = %s AND object_id IN ({sql}))")
+        scope_params += [kind, *params]
+
+    with read_connection().cursor() as cursor:
+        backend = get_backend()
+        match, match_params, score, score_params = backend.match(cursor, words)
+        where = f'{match} AND ({" OR ".join(scopes)})'
+        params = match_params + scope_params
+
+        cursor.execute(f'SELECT COUNT(*) FROM {TABLE} WHERE {where}', params)
+        total = cursor.fetchone()[0]
+        cursor.execute(
+            f'SELECT kind, object_id, {score} AS score FROM {TABLE} WHERE {where} '
+            'ORDER BY score DESC, kind, object_id LIMIT %s OFFSET %s',
+            score_params + params + [limit, offset]
+        )
+        return total, [(kind, int(pk), score) for kind, pk, score in cursor.fetchall()]
+
+
+def matching_ids(kind, query):
+    """SQL and params selecting ids of ``kind`` matching ``query``, or None if it has no words."""
+    words = tokens(query)
+    if not words:
+        return None
+    with read_connection().cursor() as cursor:
+        match, params, _, _ = get_backend().match(cursor, words)
+    return f'SELECT object_id FROM {TABLE} WHERE {match} AND kind = %s', (*params, kind)
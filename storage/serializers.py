@@ -1,5 +1,8 @@
 from rest_framework import serializers
-from django.contrib.auth.models import User
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db.models import Prefetch
 from django.utils import timezone
 from .models import (
     File, 
@@ -7,10 +10,17 @@ from .models import (
     FileShare, 
     FolderShare, 
     ShareLink, 
-    ActivityLog
+    ActivityLog,
+    Job,
+    UploadSession,
+    SharePermission,
 )
+from . import permissions, sharing, uploads, usage
+from .fieldsets import FieldSelection, SparseFieldsMixin
 
-class UserSerializer(serializers.ModelSerializer):
+User = get_user_model()
+
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for User model with minimal fields for security."""
     class Meta:
         model = User
@@ -30,7 +40,7 @@ class ActivityLogSerializer(serializers.ModelSerializer):
         read_only_fields = ['ip_address', 'user']
 
 
-class ShareLinkSerializer(serializers.ModelSerializer):
+class ShareLinkSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for generating and managing share links."""
     url = serializers.SerializerMethodField()
     created_by = UserSerializer(read_only=True)
@@ -70,8 +80,40 @@ class ShareLinkSerializer(serializers.ModelSerializer):
             )
         return value
 
+    def validate_password(self, value):
+        """Store link passwords hashed, never in clear text."""
+        return make_password(value) if value else value
+
+
+class PublicShareSerializer(serializers.ModelSerializer):
+    """Read-only view of a share link for anonymous visitors."""
+    file = serializers.SerializerMethodField()
+    folder = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ShareLink
+        fields = [
+            'uuid', 'created_at', 'expires_at', 'max_downloads',
+            'download_count', 'file', 'folder'
+        ]
+
+    def get_file(self, obj):
+        if obj.file_id is None:
+            return None
+        return {
+            'id': obj.file.id,
+            'name': obj.file.name,
+            'size': obj.file.size,
+            'mime_type': obj.file.mime_type,
+        }
+
+    def get_folder(self, obj):
+        if obj.folder_id is None:
+            return None
+        return {'id': obj.folder.id, 'name': obj.folder.name}
 
-class BaseShareSerializer(serializers.ModelSerializer):
+
+class BaseShareSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Base serializer for sharing functionality."""
     user = UserSerializer(read_only=True)
     user_email = serializers.EmailField(write_only=True)
@@ -134,7 +176,7 @@ class FolderShareSerializer(BaseShareSerializer):
         )
 
 
-class FileSerializer(serializers.ModelSerializer):
+class FileSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for files with sharing information."""
     owner = UserSerializer(read_only=True)
     shared_with = FileShareSerializer(
@@ -147,17 +189,44 @@ class FileSerializer(serializers.ModelSerializer):
         read_only=True
     )
     size_formatted = serializers.SerializerMethodField()
+    sha256 = serializers.CharField(source='blob_id', read_only=True)
     
     class Meta:
         model = File
         fields = [
             'id', 'name', 'folder', 'owner', 'file',
-            'size', 'size_formatted', 'mime_type',
+            'size', 'size_formatted', 'mime_type', 'sha256',
             'created_at', 'updated_at', 'shared_with',
             'share_links'
         ]
         read_only_fields = ['owner', 'size', 'mime_type']
 
+    @staticmethod
+    def setup_eager_loading(queryset, selection=None):
+        """Prefetch exactly the relations this serializer will render."""
+        selection = selection or FieldSelection()
+        if selection.includes('owner', nested=True):
+            queryset = queryset.select_related('owner')
+        if selection.includes('shared_with', nested=True):
+            queryset = queryset.prefetch_related(Prefetch(
+                'fileshare_set',
+                queryset=FileShare.objects.select_related('user')
+            ))
+        if selection.includes('share_links', nested=True):
+            queryset = queryset.prefetch_related(Prefetch(
+                'share_links',
+                queryset=ShareLink.objects.select_related('created_by')
+            ))
+        return queryset
+
+    def validate_folder(self, value):
+        resolver = permissions.get_resolver(self.context['request'])
+        if value and not resolver.has(value, SharePermission.EDIT):
+            raise serializers.ValidationError(
+                "You do not have permission to add to this folder."
+            )
+        return value
+
     def get_size_formatted(self, obj):
         """Return human-readable file size."""
         bytes = obj.size
@@ -168,7 +237,7 @@ class FileSerializer(serializers.ModelSerializer):
         return f"{bytes:.2f} TB"
 
 
-class FolderSerializer(serializers.ModelSerializer):
+class FolderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for folders with nested files and sharing information."""
     owner = UserSerializer(read_only=True)
     files = FileSerializer(many=True, read_only=True)
@@ -188,17 +257,76 @@ class FolderSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['owner']
 
+    @staticmethod
+    def setup_eager_loading(queryset, selection=None):
+        """Prefetch exactly the relations this serializer will render."""
+        selection = selection or FieldSelection()
+        if selection.includes('owner', nested=True):
+            queryset = queryset.select_related('owner')
+        if selection.includes('shared_with', nested=True):
+            queryset = queryset.prefetch_related(Prefetch(
+                'foldershare_set',
+                queryset=FolderShare.objects.select_related('user')
+            ))
+        if selection.includes('files', nested=True):
+            queryset = queryset.prefetch_related(Prefetch(
+                'files',
+                queryset=FileSerializer.setup_eager_loading(
+                    File.objects.all(), selection.child('files')
+                )
+            ))
+        return queryset
+
     def get_parent_path(self, obj):
         """Get the full path of parent folders."""
-        path = []
-        current = obj.parent
-        while current:
-            path.insert(0, {
-                'id': current.id,
-                'name': current.name
-            })
-            current = current.parent
-        return path
+        names = self.get_ancestor_names(obj)
+        return [
+            {'id': pk, 'name': names[pk]}
+            for pk in obj.ancestor_ids()
+            if pk in names
+        ]
+
+    def get_ancestor_names(self, obj):
+        """Load ancestor names for the whole page in a single query."""
+        names = self.context.setdefault('folder_names', {})
+        if all(pk in names for pk in obj.ancestor_ids()):
+            return names
+        if isinstance(self.parent, serializers.ListSerializer):
+            folders = self.parent.instance
+        else:
+            folders = [obj]
+        missing = {pk for folder in folders for pk in folder.ancestor_ids()}
+        missing.difference_update(names)
+        names.update(Folder.objects.filter(pk__in=missing).values_list('id', 'name'))
+        return names
+
+    def validate_parent(self, value):
+        """Prevent moving a folder into itself or one of its descendants."""
+        if value and self.instance and value.path.startswith(self.instance.path):
+            raise serializers.ValidationError(
+                "A folder cannot be moved into its own subtree."
+            )
+        resolver = permissions.get_resolver(self.context['request'])
+        if value and not resolver.has(value, SharePermission.EDIT):
+            raise serializers.ValidationError(
+                "You do not have permission to add to this folder."
+            )
+        return value
+
+
+class TrashedFileSerializer(FileSerializer):
+    """A file in the trash."""
+    class Meta(FileSerializer.Meta):
+        fields = FileSerializer.Meta.fields + ['trashed_at']
+
+
+class TrashedFolderSerializer(FolderSerializer):
+    """A folder in the trash; its contents are not listed."""
+    class Meta(FolderSerializer.Meta):
+        fields = [
+            'id', 'name', 'parent', 'owner',
+            'created_at', 'updated_at', 'trashed_at'
+        ]
 
 
 class BulkShareSerializer(serializers.Serializer):
@@ -223,52 +351,148 @@ class BulkShareSerializer(serializers.Serializer):
     def validate_items(self, value):
         """Validate that all items exist and user has permission."""
         request = self.context['request']
-        invalid_items = []
-        
-        for item_id in value:
-            try:
-                if 'files' in self.context:
-                    File.objects.get(
-                        id=item_id,
-                        owner=request.user
-                    )
-                else:
-                    Folder.objects.get(
-                        id=item_id,
-                        owner=request.user
-                    )
-            except (File.DoesNotExist, Folder.DoesNotExist):
-                invalid_items.append(item_id)
-        
+        shareable = sharing.shareable_items(self.context['model'], value, request.user)
+        invalid_items = [item_id for item_id in value if item_id not in shareable]
+
         if invalid_items:
             raise serializers.ValidationError(
                 f"Invalid items: {invalid_items}"
             )
-        return value
+        return list(dict.fromkeys(value))
 
     def validate_user_emails(self, value):
         """Validate that all users exist."""
-        invalid_emails = []
         request_user_email = self.context['request'].user.email
-        
-        for email in value:
-            if email == request_user_email:
-                raise serializers.ValidationError(
-                    f"Cannot share with yourself ({email})"
-                )
-            if not User.objects.filter(email=email).exists():
-                invalid_emails.append(email)
-        
+        if request_user_email in value:
+            raise serializers.ValidationError(
+                f"Cannot share with yourself ({request_user_email})"
+            )
+
+        self.users = dict(
+            User.objects.filter(email__in=value).values_list('email', 'id')
+        )
+        invalid_emails = [email for email in value if email not in self.users]
+
         if invalid_emails:
             raise serializers.ValidationError(
                 f"Users not found: {invalid_emails}"
             )
         return value
 
+    def validate(self, attrs):
+        attrs['user_ids'] = list(dict.fromkeys(
+            self.users[email] for email in attrs['user_emails']
+        ))
+        return attrs
+
     def validate_expires_at(self, value):
         """Validate expiration date."""
         if value and value <= timezone.now():
             raise serializers.ValidationError(
                 "Expiration date must be in the future."
             )
-        return value
\ No newline at end of file
+        return value
+
+
+class FolderCopySerializer(serializers.Serializer):
+    """Destination of a recursive folder copy."""
+    parent = serializers.PrimaryKeyRelatedField(
+        queryset=Folder.objects.all(),
+        required=False,
+        allow_null=True
+    )
+    name = serializers.CharField(max_length=255, required=False)
+
+    def validate_parent(self, value):
+        if value and value.path.startswith(self.context['folder'].path):
+            raise serializers.ValidationError(
+                "A folder cannot be copied into its own subtree."
+            )
+        resolver = permissions.get_resolver(self.context['request'])
+        if value and not resolver.has(value, SharePermission.EDIT):
+            raise serializers.ValidationError(
+                "You do not have permission to add to this folder."
+            )
+        return value
+
+
+class BlobPrecheckSerializer(serializers.Serializer):
+    """Serializer for finishing an upload from already stored content."""
+    sha256 = serializers.RegexField(r'^[0-9a-f]{64}$')
+    size = serializers.IntegerField(min_value=0)
+    name = serializers.CharField(max_length=255)
+    folder = serializers.PrimaryKeyRelatedField(
+        queryset=Folder.objects.all(),
+        required=False,
+        allow_null=True
+    )
+    mime_type = serializers.CharField(max_length=100, required=False)
+
+    def validate_folder(self, value):
+        resolver = permissions.get_resolver(self.context['request'])
+        if value and not resolver.has(value, SharePermission.EDIT):
+            raise serializers.ValidationError(
+                "You do not have permission to upload into this folder."
+            )
+        return value
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """Serializer for resumable chunked upload sessions."""
+    chunk_size = serializers.IntegerField(required=False, min_value=1)
+    total_chunks = serializers.IntegerField(read_only=True)
+    received = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = [
+            'uuid', 'name', 'folder', 'size', 'chunk_size', 'mime_type',
+            'status', 'total_chunks', 'received', 'file',
+            'created_at', 'updated_at', 'expires_at'
+        ]
+        read_only_fields = ['status', 'file', 'expires_at']
+
+    def get_received(self, obj):
+        """Inclusive ranges of chunk indexes already stored on the server."""
+        return uploads.received_ranges(obj)
+
+    def validate_size(self, value):
+        if value < 0:
+            raise serializers.ValidationError("Size cannot be negative.")
+        return value
+
+    def validate_chunk_size(self, value):
+        return min(value, settings.UPLOAD_MAX_CHUNK_SIZE)
+
+    def validate_folder(self, value):
+        resolver = permissions.get_resolver(self.context['request'])
+        if value and not resolver.has(value, SharePermission.EDIT):
+            raise serializers.ValidationError(
+                "You do not have permission to upload into this folder."
+            )
+        return value
+
+    def validate(self, attrs):
+        attrs.setdefault('chunk_size', settings.UPLOAD_CHUNK_SIZE)
+        usage.check(self.context['request'].user, attrs['size'])
+        exists = File.objects.filter(
+            name=attrs['name'],
+            folder=attrs.get('folder'),
+            owner=self.context['request'].user,
+        ).exists()
+        if exists:
+            raise serializers.ValidationError(
+                "A file with this name already exists in the folder."
+            )
+        return attrs
+
+
+class JobSerializer(serializers.ModelSerializer):
+    """Serializer for polling background job progress."""
+    class Meta:
+        model = Job
+        fields = [
+            'uuid', 'kind', 'status', 'progress', 'total', 'result',
+            'error', 'attempts', 'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
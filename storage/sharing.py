@@ -0,0 +1,149 @@
+"""Set-based bulk sharing.
+
+``share_many`` grants one permission on many files or folders to many users
+using a fixed number of statements per batch: one lookup of existing pairs,
+one ``INSERT ... ON CONFLICT DO UPDATE``, one bulk activity insert, one
+bulk change journal insert and one ``updated_at`` touch of the items.
+
+Each batch commits on its own, so the write lock is only held per batch
+and job progress and heartbeats, written between batches, are visible to
+pollers and ``jobs.requeue_stale`` straight away. A requeued job resumes
+after the last committed batch; pairs done by the earlier run are reported
+with ``created`` unknown (``None``).
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from . import activity, conditional, jobs, journal, permissions
+from .models import (
+    ActivityType, File, FileShare, Folder, FolderShare, SharePermission
+)
+
+MODELS = {
+    'file': File,
+    'folder': Folder,
+}
+
+SHARE_MODELS = {
+    'file': FileShare,
+    'folder': FolderShare,
+}
+
+
+def batched(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def share_many(field, item_ids, user_ids, permission, expires_at, actor,
+               activity_data=None, batch_size=500, report=None, start=0):
+    """Upsert a share for every (item, user) pair and return per-pair results.
+
+    ``start`` skips that many items, already shared by an earlier run.
+    """
+    share_model = SHARE_MODELS[field]
+    activity_data = activity_data or {}
+    item_ids = list(item_ids)
+    results = [
+        {'item_id': item_id, 'user_id': user_id, 'status': 'success', 'created': None}
+        for item_id in item_ids[:start]
+        for user_id in user_ids
+    ]
+    shared = start
+
+    for item_batch in batched(item_ids[start:], max(batch_size // max(len(user_ids), 1), 1)):
+        with transaction.atomic():
+            existing = set(
+                share_model.objects.filter(
+                    **{f'{field}_id__in': item_batch},
+                    user_id__in=user_ids
+                ).values_list(f'{field}_id', 'user_id')
+            )
+            shares = [
+                share_model(
+                    **{f'{field}_id': item_id},
+                    user_id=user_id,
+                    permission=permission,
+                    expires_at=expires_at,
+                    is_active=True
+                )
+                for item_id in item_batch
+                for user_id in user_ids
+            ]
+            share_model.objects.bulk_create(
+                shares,
+                update_conflicts=True,
+                unique_fields=[field, 'user'],
+                update_fields=['permission', 'expires_at', 'is_active'],
+            )
+            now = timezone.now()
+            activity.write_events([
+                {
+                    'user_id': actor.pk if actor else None,
+                    'activity_type': ActivityType.SHARE,
+                    'ip_address': activity_data.get('ip_address'),
+                    'user_agent': activity_data.get('user_agent'),
+                    'details': {'shared_with': list(user_ids), 'permission': permission},
+                    'created_at': now,
+                    f'{field}_id': item_id,
+                }
+                for item_id in item_batch
+            ])
+            path_field = 'folder__path' if field == 'file' else 'path'
+            journal.record([
+                journal.share_change(
+                    field, item_id, owner_id, path or '', user_id, permission, expires_at
+                )
+                for item_id, owner_id, path in MODELS[field].objects.filter(
+                    pk__in=item_batch
+                ).values_list('pk', 'owner_id', path_field)
+                for user_id in user_ids
+            ])
+            conditional.touch(MODELS[field], item_batch)
+            results.extend(
+                {
+                    'item_id': item_id,
+                    'user_id': user_id,
+                    'status': 'success',
+                    'created': (item_id, user_id) not in existing,
+                }
+                for item_id in item_batch
+                for user_id in user_ids
+            )
+            # bulk_create skips the signals that normally invalidate cached permissions.
+            for user_id in user_ids:
+                transaction.on_commit(lambda user_id=user_id: permissions.invalidate_user(user_id))
+        shared += len(item_batch)
+        if report:
+            report(shared * len(user_ids), {'items': shared})
+
+    return results
+
+
+@jobs.handler('bulk_share')
+def run_bulk_share(job, report):
+    payload = job.payload
+    return share_many(
+        payload['field'],
+        payload['items'],
+        payload['users'],
+        payload['permission'],
+        payload['expires_at'],
+        job.created_by,
+        payload.get('activity_data'),
+        report=report,
+        start=job.state.get('items', 0),
+    )
+
+
+def shareable_items(model, item_ids, user):
+    """Return the ids in ``item_ids`` that ``user`` may share, in a constant number of queries."""
+    objects = model.objects.filter(pk__in=item_ids)
+    if model is File:
+        objects = objects.select_related('folder')
+    resolver = permissions.PermissionResolver(user)
+    resolve = resolver.files if model is File else resolver.folders
+    return {
+        pk for pk, permission in resolve(list(objects)).items()
+        if permissions.at_least(permission, SharePermission.ADMIN)
+    }
@@ -0,0 +1,194 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import conditional, journal, links, permissions, search, signed, thumbnails, usage
+from .models import Blob, ChangeAction, File, FileShare, Folder, FolderShare, ShareLink
+
+
+def adjust_ref_count(blob_id, delta):
+    if blob_id:
+        Blob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') + delta)
+
+
+@receiver(pre_save, sender=File)
+def remember_previous_file_state(sender, instance, update_fields=None, **kwargs):
+    instance._previous = {
+        'blob_id': instance.blob_id,
+        'name': instance.name,
+        'folder_id': instance.folder_id,
+        'owner_id': instance.owner_id,
+        'size': instance.size,
+        'mime_type': instance.mime_type,
+    }
+    if instance._state.adding:
+        return
+    if update_fields is None or {'blob', 'name', 'folder', 'owner', 'size', 'mime_type'} & set(update_fields):
+        previous = File.all_objects.filter(pk=instance.pk).values(*instance._previous).first()
+        instance._previous.update(previous or {})
+
+
+@receiver(post_save, sender=File)
+def file_saved(sender, instance, created, **kwargs):
+    previous = instance._previous
+    search.index([search.file_row(instance)])
+    if created:
+        adjust_ref_count(instance.blob_id, 1)
+        usage.add(instance.owner_id, instance.mime_type, instance.size, 1)
+        thumbnails.schedule_file(instance)
+        journal.record([journal.file_change(instance, ChangeAction.CREATE, journal.file_path(instance))])
+        return
+    record_file_change(instance, previous)
+    current = (instance.owner_id, instance.size, instance.mime_type)
+    if (previous['owner_id'], previous['size'], previous['mime_type']) != current:
+        usage.add(previous['owner_id'], previous['mime_type'], -previous['size'], -1)
+        usage.add(instance.owner_id, instance.mime_type, instance.size, 1)
+    links.invalidate_targets(file=instance)
+    if previous['blob_id'] != instance.blob_id:
+        adjust_ref_count(previous['blob_id'], -1)
+        adjust_ref_count(instance.blob_id, 1)
+        thumbnails.schedule_file(instance)
+        transaction.on_commit(
+            lambda pk=instance.pk, blob_id=instance.blob_id: signed.content_replaced(pk, blob_id)
+        )
+    if (previous['folder_id'], previous['owner_id']) != (instance.folder_id, instance.owner_id):
+        permissions.invalidate_all()
+
+
+def record_file_change(instance, previous):
+    path = journal.file_path(instance)
+    if previous['folder_id'] != instance.folder_id:
+        previous_path = journal.folder_path(previous['folder_id'])
+    else:
+        previous_path = path
+    if previous['owner_id'] != instance.owner_id:
+        # The previous owner loses the file and the new one gains it.
+        changes = [
+            journal.file_change(
+                instance, ChangeAction.DELETE, previous_path, owner_id=previous['owner_id']
+            ),
+            journal.file_change(instance, ChangeAction.CREATE, path),
+        ]
+    elif (previous['folder_id'], previous['name']) != (instance.folder_id, instance.name):
+        changes = [journal.file_change(instance, ChangeAction.MOVE, path, previous_path)]
+    else:
+        changes = [journal.file_change(instance, ChangeAction.UPDATE, path)]
+    journal.record(changes)
+
+
+def delete_legacy_body(name, storage):
+    # Bodies stored before the blob store belong to a single file.
+    if not File.all_objects.filter(file=name).exists():
+        storage.delete(name)
+
+
+@receiver(post_delete, sender=File)
+def release_blob_reference(sender, instance, **kwargs):
+    adjust_ref_count(instance.blob_id, -1)
+    if instance.blob_id is None and instance.file.name:
+        name, storage = instance.file.name, instance.file.storage
+        transaction.on_commit(lambda: delete_legacy_body(name, storage))
+    usage.add(instance.owner_id, instance.mime_type, -instance.size, -1)
+    search.remove('file', [instance.pk])
+    transaction.on_commit(lambda: signed.revoke(files=[instance.pk]))
+    # Trashing already told sync clients the file is gone.
+    if instance.trashed_at is None:
+        journal.record([journal.file_change(instance, ChangeAction.DELETE, journal.file_path(instance))])
+
+
+@receiver(pre_save, sender=Folder)
+def remember_previous_folder_state(sender, instance, update_fields=None, **kwargs):
+    instance._previous = {
+        'name': instance.name,
+        'parent_id': instance.parent_id,
+        'owner_id': instance.owner_id,
+    }
+    if instance._state.adding:
+        return
+    if update_fields is None or {'name', 'parent', 'owner'} & set(update_fields):
+        previous = Folder.all_objects.filter(pk=instance.pk).values(*instance._previous).first()
+        instance._previous.update(previous or {})
+
+
+@receiver(post_save, sender=Folder)
+def folder_saved(sender, instance, created, **kwargs):
+    previous = instance._previous
+    search.index([search.folder_row(instance)])
+    record_folder_change(instance, previous, created)
+    if created:
+        return
+    links.invalidate_targets(folder=instance)
+    if (previous['parent_id'], previous['owner_id']) != (instance.parent_id, instance.owner_id):
+        permissions.invalidate_all()
+
+
+def record_folder_change(instance, previous, created):
+    # Folder.save() assigns the path of a new folder, and rewrites the path
+    # of a moved one, only after this signal has run.
+    if created:
+        path = previous_path = instance.build_path()[0]
+    elif previous['parent_id'] != instance.parent_id:
+        path, previous_path = instance.build_path()[0], instance.path
+    else:
+        path = previous_path = instance.path
+
+    if created:
+        changes = [journal.folder_change(instance, ChangeAction.CREATE, path)]
+    elif previous['owner_id'] != instance.owner_id:
+        changes = [
+            journal.folder_change(
+                instance, ChangeAction.DELETE, previous_path, owner_id=previous['owner_id']
+            ),
+            journal.folder_change(instance, ChangeAction.CREATE, path),
+        ]
+    elif (previous['parent_id'], previous['name']) != (instance.parent_id, instance.name):
+        changes = [journal.folder_change(instance, ChangeAction.MOVE, path, previous_path)]
+    else:
+        changes = [journal.folder_change(instance, ChangeAction.UPDATE, path)]
+    journal.record(changes)
+
+
+@receiver(post_delete, sender=Folder)
+def folder_deleted(sender, instance, **kwargs):
+    search.remove('folder', [instance.pk])
+    if instance.trashed_at is None:
+        journal.record([journal.folder_change(instance, ChangeAction.DELETE, instance.path)])
+
+
+@receiver(post_save, sender=FileShare)
+@receiver(post_delete, sender=FileShare)
+@receiver(post_save, sender=FolderShare)
+@receiver(post_delete, sender=FolderShare)
+def share_changed(sender, instance, **kwargs):
+    permissions.invalidate_user(instance.user_id)
+    if isinstance(instance, FileShare):
+        conditional.touch(File, [instance.file_id])
+    else:
+        conditional.touch(Folder, [instance.folder_id])
+    if not kwargs.get('created'):
+        # Signed downloads minted under the old share may no longer be allowed.
+        transaction.on_commit(lambda: signed.revoke(
+            files=[getattr(instance, 'file_id', None)], folders=[getattr(instance, 'folder_id', None)]
+        ))
+    journal.record([journal.share_change_for(instance, active='created' in kwargs)])
+
+
+@receiver(post_save, sender=ShareLink)
+@receiver(post_delete, sender=ShareLink)
+def share_link_changed(sender, instance, **kwargs):
+    links.invalidate(instance.uuid)
+    if not kwargs.get('created'):
+        # Signed downloads cannot tell which link minted them, so revoke the whole item.
+        transaction.on_commit(lambda: signed.revoke(files=[instance.file_id], folders=[instance.folder_id]))
+    if instance.file_id:
+        conditional.touch(File, [instance.file_id])
+    if instance.folder_id:
+        conditional.touch(Folder, [instance.folder_id])
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def avatar_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'avatar' in update_fields:
+        thumbnails.schedule_avatar(instance)
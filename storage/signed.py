@@ -0,0 +1,161 @@
+"""Short-lived signed download URLs.
+
+``mint`` turns a file the caller may read into a URL that is valid for
+``SIGNED_DOWNLOAD_TTL`` seconds. The token carries everything needed to
+answer the download (file id, storage path, name, type, size, validators,
+the folder path, expiry and whether ranges are allowed) and is signed with
+HMAC-SHA256 under ``SIGNED_DOWNLOAD_SECRET``. ``views.SignedDownloadView`` checks
+the signature and streams the bytes without a single database query.
+
+Tokens cannot be recalled, so revocation goes through a denylist:
+``revoke(files=..., folders=...)`` rejects every token for those files, or
+for anything under those folders, minted before the call. Entries
+live in the cache and expire after ``SIGNED_DOWNLOAD_TTL``, when every
+token they could reject has expired anyway, so the list only ever holds
+the last few minutes of revocations. Trashing, deleting and changing the
+shares of a file or folder revoke it (see ``storage.signals``). Replacing a
+file's content records its new blob the same way, and tokens minted before
+that carrying any other blob are rejected, so a URL never serves content the
+file no longer has.
+
+With ``SIGNED_DOWNLOAD_MODE = "nginx"`` URLs are minted for nginx's
+``secure_link`` module instead, which then serves files straight from
+``MEDIA_ROOT``::
+
+    location /signed/ {
+        secure_link $arg_md5,$arg_expires;
+        secure_link_md5 "$secure_link_expires$uri <SIGNED_DOWNLOAD_SECRET>";
+        if ($secure_link = "") { return 403; }
+        if ($secure_link = "0") { return 410; }
+        alias /path/to/media/;
+    }
+
+nginx only knows MD5 and never sees the denylist or the range policy, so
+in that mode a URL stays usable until it expires, and URLs with ranges
+disabled cannot be minted (see ``enforces_ranges``).
+
+Otherwise revocations only reach every worker through a shared cache, so
+without ``SHARED_CACHE`` signed downloads are disabled (see ``enabled``).
+"""
+import base64
+import hashlib
+import time
+from datetime import datetime, timezone as dt_timezone
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.urls import reverse
+
+from .models import File
+
+SALT = 'storage.signed-download'
+DENYLIST_KEY = 'signed-download:revoked:{}:{}'
+CONTENT_KEY = 'signed-download:content:{}'
+RANGES = 'bytes'
+NO_RANGES = 'none'
+
+
+def enabled():
+    return settings.SIGNED_DOWNLOAD_MODE == 'nginx' or settings.SHARED_CACHE
+
+
+def enforces_ranges():
+    """Whether minted URLs can refuse ``Range`` requests."""
+    return settings.SIGNED_DOWNLOAD_MODE != 'nginx'
+
+
+def signer():
+    return signing.Signer(key=settings.SIGNED_DOWNLOAD_SECRET, salt=SALT, algorithm='sha256')
+
+
+def mint(request, file, allow_ranges=True, as_attachment=True, ttl=None):
+    """Return ``(url, expires_at)`` for downloading ``file`` without further checks."""
+    now = time.time()
+    expires = int(now + (ttl or settings.SIGNED_DOWNLOAD_TTL))
+    expires_at = datetime.fromtimestamp(expires, dt_timezone.utc)
+    if settings.SIGNED_DOWNLOAD_MODE == 'nginx':
+        if not allow_ranges:
+            raise ValueError('nginx secure_link URLs always allow ranges.')
+        return request.build_absolute_uri(nginx_url(file.file.name, expires)), expires_at
+
+    token = signer().sign_object({
+        'f': file.pk,
+        'p': file.file.name,
+        'n': file.name,
+        'm': file.mime_type,
+        's': file.size,
+        'b': file.blob_id,
+        'u': file.updated_at.timestamp(),
+        'd': file.folder.path if file.folder_id else '',
+        'i': round(now, 3),
+        'x': expires,
+        'r': RANGES if allow_ranges else NO_RANGES,
+        'a': as_attachment,
+    }, compress=True)
+    return request.build_absolute_uri(reverse('signed-download', args=[token])), expires_at
+
+
+def nginx_url(path, expires):
+    uri = f"{settings.SIGNED_DOWNLOAD_NGINX_PREFIX.rstrip('/')}/{path}"
+    # nginx hashes the decoded $uri; only the returned URL is percent-encoded.
+    digest = hashlib.md5(
+        f'{expires}{uri} {settings.SIGNED_DOWNLOAD_SECRET}'.encode(), usedforsecurity=False
+    ).digest()
+    md5 = base64.urlsafe_b64encode(digest).decode().rstrip('=')
+    return f'{quote(uri)}?md5={md5}&expires={expires}'
+
+
+def revoke(files=(), folders=()):
+    """Reject tokens for ``files``, or for anything under ``folders``, minted until now."""
+    now = time.time()
+    entries = {DENYLIST_KEY.format('file', pk): now for pk in files if pk}
+    entries.update({DENYLIST_KEY.format('folder', pk): now for pk in folders if pk})
+    if entries:
+        # Longer than any token minted before now can live.
+        cache.set_many(entries, settings.SIGNED_DOWNLOAD_TTL + 1)
+
+
+def content_replaced(file_id, blob_id):
+    """Reject tokens for ``file_id`` minted until now that carry anything but ``blob_id``."""
+    cache.set(CONTENT_KEY.format(file_id), (blob_id or '', time.time()), settings.SIGNED_DOWNLOAD_TTL + 1)
+
+
+def is_revoked(payload):
+    content_key = CONTENT_KEY.format(payload['f'])
+    keys = [content_key, DENYLIST_KEY.format('file', payload['f'])] + [
+        DENYLIST_KEY.format('folder', folder_id)
+        for folder_id in payload['d'].strip('/').split('/') if folder_id
+    ]
+    found = cache.get_many(keys)
+    blob_id, replaced_at = found.pop(content_key, (None, 0))
+    if replaced_at >= payload['i'] and blob_id != (payload['b'] or ''):
+        return True
+    return any(revoked_at >= payload['i'] for revoked_at in found.values())
+
+
+def verify(token):
+    """The payload of ``token``.
+
+    Raises ``BadSignature`` for a forged token and ``SignatureExpired`` for
+    one that expired or was revoked, or that could have been revoked unseen.
+    """
+    payload = signer().unsign_object(token)
+    if payload['x'] < time.time() or not enabled() or is_revoked(payload):
+        raise signing.SignatureExpired('Signed download is no longer valid.')
+    return payload
+
+
+def expires_in(payload):
+    return max(int(payload['x'] - time.time()), 0)
+
+
+def payload_file(payload):
+    """An unsaved ``File`` carrying what ``downloads.serve_file`` reads."""
+    file = File(
+        id=payload['f'], name=payload['n'], mime_type=payload['m'], size=payload['s'],
+        blob_id=payload['b'], updated_at=datetime.fromtimestamp(payload['u'], dt_timezone.utc),
+    )
+    file.file.name = payload['p']
+    return file
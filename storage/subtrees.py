@@ -0,0 +1,164 @@
+"""Recursive folder delete, move and copy as background jobs.
+
+Doing these inside a request cascades over the whole subtree in one
+transaction, holding the write lock for as long as that takes. The handlers
+here work through the subtree ``JOB_BATCH_SIZE`` rows per transaction,
+reporting progress and a checkpoint as they go. Every step is safe to
+repeat, so a job restarted after its worker died resumes where it stopped.
+
+Deleting goes through the ``File`` and ``Folder`` signals like any other
+delete (blob references, usage, search, journal) and then reclaims blobs
+nobody references any more; ``purge_trash`` deletes the same way. Copies
+share blobs with their sources; a file that predates the blob store has its
+body copied into it.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import blobs, jobs
+from .models import Blob, File, Folder
+
+
+def delete_batches(files, folders, batch_size):
+    """Hard-delete ``files``, then ``folders``, one batch per transaction.
+
+    Yields ``(kind, count, blob_ids)`` after each batch, ``blob_ids`` being
+    the blobs the batch released.
+    """
+    # Files first, so deleting the folders never cascades to them.
+    while True:
+        batch = list(files.order_by().values_list('pk', 'blob_id')[:batch_size])
+        if not batch:
+            break
+        with transaction.atomic():
+            File.all_objects.filter(pk__in=[pk for pk, _ in batch]).delete()
+        yield 'files', len(batch), {blob_id for _, blob_id in batch if blob_id}
+
+    # Deepest first, so every folder in a batch is already empty.
+    while True:
+        batch = list(folders.order_by('-depth').values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            break
+        with transaction.atomic():
+            Folder.all_objects.filter(pk__in=batch).delete()
+        yield 'folders', len(batch), set()
+
+
+def reclaim(blob_ids):
+    """Delete the bodies of ``blob_ids`` nobody references any more; return how many went."""
+    cutoff = timezone.now() - settings.BLOB_GC_GRACE_PERIOD
+    return sum(
+        blobs.collect(blob, cutoff)
+        for blob in Blob.objects.filter(pk__in=blob_ids, ref_count__lte=0)
+    )
+
+
+@jobs.handler('delete_folder')
+def run_delete_folder(job, report):
+    root = Folder.all_objects.filter(pk=job.payload['folder']).first()
+    if root is None:
+        # Deleted by an earlier run of this job.
+        return {'files': job.state.get('files', 0), 'folders': job.state.get('folders', 0)}
+
+    files = File.all_objects.filter(folder__path__startswith=root.path)
+    folders = Folder.all_objects.filter(path__startswith=root.path)
+    state = {'files': 0, 'folders': 0, **job.state}
+    if not job.state:
+        report(0, state, total=files.count() + folders.count())
+
+    released = set()
+    for kind, count, blob_ids in delete_batches(files, folders, settings.JOB_BATCH_SIZE):
+        state[kind] += count
+        released |= blob_ids
+        report(state['files'] + state['folders'], state)
+    return {'files': state['files'], 'folders': state['folders'], 'blobs_reclaimed': reclaim(released)}
+
+
+@jobs.handler('move_folder')
+def run_move_folder(job, report):
+    folder = Folder.objects.filter(pk=job.payload['folder']).first()
+    if folder is None:
+        raise ValueError('The folder no longer exists.')
+    parent_id = job.payload['parent']
+    if folder.parent_id != parent_id:
+        folder.parent = Folder.objects.filter(pk=parent_id).first() if parent_id else None
+        if parent_id and folder.parent is None:
+            raise ValueError('The destination folder no longer exists.')
+        # Folder.save() rewrites the paths of the whole subtree in one UPDATE.
+        folder.save(update_fields=['parent', 'updated_at'])
+    report(1, total=1)
+    return {'folder': folder.pk, 'parent': parent_id}
+
+
+@jobs.handler('copy_folder')
+def run_copy_folder(job, report):
+    payload = job.payload
+    owner = job.created_by
+    source = Folder.objects.filter(pk=payload['folder']).first()
+    if source is None or owner is None:
+        raise ValueError('The folder no longer exists.')
+
+    batch_size = settings.JOB_BATCH_SIZE
+    subtree = Folder.objects.filter(path__startswith=source.path)
+    copy, _ = Folder.objects.get_or_create(
+        name=payload['name'], parent_id=payload['parent'], owner=owner,
+        defaults={'description': source.description}
+    )
+    state = {'after': '', 'folders': 0, 'files': 0, **job.state}
+    if not job.state:
+        report(0, state, total=subtree.count() + File.objects.filter(folder__path__startswith=source.path).count())
+
+    copies = {source.pk: copy.pk}
+
+    def copy_of(folder_id):
+        # Only needed when resuming: copies made by an earlier run are found by name.
+        if folder_id not in copies:
+            original = Folder.objects.only('name', 'parent_id').get(pk=folder_id)
+            copies[folder_id] = Folder.objects.get(
+                name=original.name, parent_id=copy_of(original.parent_id), owner=owner
+            ).pk
+        return copies[folder_id]
+
+    while True:
+        # Paths sort every folder after its parent.
+        batch = list(subtree.filter(path__gt=state['after']).order_by('path')[:batch_size])
+        if not batch:
+            break
+        with transaction.atomic():
+            for folder in batch:
+                if folder.pk not in copies:
+                    copies[folder.pk] = Folder.objects.get_or_create(
+                        name=folder.name, parent_id=copy_of(folder.parent_id), owner=owner,
+                        defaults={'description': folder.description}
+                    )[0].pk
+        state['folders'] += len(batch)
+        state['files'] += copy_files([folder.pk for folder in batch], copies, owner, batch_size)
+        state['after'] = batch[-1].path
+        report(state['folders'] + state['files'], state)
+
+    return {'folder': copy.pk, 'folders': state['folders'], 'files': state['files']}
+
+
+def copy_files(folder_ids, copies, owner, batch_size):
+    """Copy the files of ``folder_ids`` into their copies, skipping names already there."""
+    copied = 0
+    last_pk = 0
+    files = File.objects.filter(folder_id__in=folder_ids).select_related('blob').order_by('pk')
+    while True:
+        batch = list(files.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return copied
+        last_pk = batch[-1].pk
+        existing = set(File.objects.filter(
+            folder_id__in={copies[file.folder_id] for file in batch}, owner=owner
+        ).values_list('folder_id', 'name'))
+        with transaction.atomic():
+            for file in batch:
+                folder_id = copies[file.folder_id]
+                if (folder_id, file.name) in existing:
+                    continue
+                blob = file.blob or blobs.ingest_upload(file.file)
+                duplicate = File(name=file.name, folder_id=folder_id, owner=owner, mime_type=file.mime_type)
+                blobs.attach(duplicate, blob).save()
+                copied += 1
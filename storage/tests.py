@@ -1,3 +1,1334 @@
-from django.test import TestCase
+import base64
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import zipfile
+from datetime import datetime, time, timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.checks import run_checks
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from PIL import Image
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from backend.routers import PIN_COOKIE, ReplicaMiddleware, ReplicaRouter
+from . import activity, blobs, checks, expiry, instrumentation, jobs, links, sharing, signed, thumbnails, trash, uploads
+from .models import (
+    ActivityLog, ActivityRollup, ActivityType, Blob, File, FileShare, Folder, FolderShare, ShareLink,
+    StorageUsage, UploadSession, UploadStatus,
+)
+
+
+class ListingQueryCountTests(TestCase):
+    """Listing cost must not grow with the number of folders, files or shares."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            'owner@example.com', 'Owner', 'owner', is_active=True
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.created = 0
+
+    def populate(self, folders, files_per_folder, shares_per_item):
+        users = [
+            User.objects.create_user(
+                f'user{self.created}-{i}@example.com', 'User', f'user{self.created}-{i}',
+                is_active=True
+            )
+            for i in range(shares_per_item)
+        ]
+        parent = None
+        for i in range(folders):
+            folder = Folder.objects.create(
+                name=f'folder-{self.created}-{i}', owner=self.owner, parent=parent
+            )
+            parent = folder
+            for user in users:
+                FolderShare.objects.create(folder=folder, user=user)
+            for j in range(files_per_folder):
+                file = File.objects.create(
+                    name=f'file-{j}', folder=folder, owner=self.owner,
+                    file=f'files/{j}', size=j, mime_type='text/plain'
+                )
+                ShareLink.objects.create(file=file, created_by=self.owner)
+                for user in users:
+                    FileShare.objects.create(file=file, user=user)
+        self.created += 1
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()['results']
+
+    def test_folder_listing_query_count_is_flat(self):
+        self.populate(folders=2, files_per_folder=1, shares_per_item=1)
+        small, _ = self.count_queries('/api/folders/')
+        self.populate(folders=8, files_per_folder=5, shares_per_item=3)
+        large, data = self.count_queries('/api/folders/')
+
+        self.assertEqual(len(data), 10)
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, 10)
+
+    def test_file_listing_query_count_is_flat(self):
+        self.populate(folders=1, files_per_folder=2, shares_per_item=1)
+        small, _ = self.count_queries('/api/files/')
+        self.populate(folders=4, files_per_folder=6, shares_per_item=4)
+        large, data = self.count_queries('/api/files/')
+
+        self.assertEqual(len(data), 26)
+        self.assertEqual(small, large)
+
+    def test_sparse_fieldsets_skip_nested_share_data(self):
+        self.populate(folders=3, files_per_folder=2, shares_per_item=2)
+        full, _ = self.count_queries('/api/folders/')
+        sparse, data = self.count_queries('/api/folders/?fields=id,name,files.id,files.name')
+        expanded, expanded_data = self.count_queries('/api/folders/?expand=files')
+
+        self.assertLess(sparse, full)
+        self.assertLess(expanded, full)
+        self.assertEqual(set(data[0]), {'id', 'name', 'files'})
+        self.assertEqual(set(data[0]['files'][0]), {'id', 'name'})
+        self.assertNotIn('shared_with', expanded_data[0])
+        self.assertNotIn('shared_with', expanded_data[0]['files'][0])
+
+    def test_keyset_pages_cover_every_row_once(self):
+        self.populate(folders=1, files_per_folder=25, shares_per_item=0)
+        File.objects.update(updated_at=File.objects.first().updated_at)  # all ties on updated_at
+
+        seen, url, pages = [], '/api/files/?page_size=7', 0
+        while url:
+            response = self.client.get(url).json()
+            seen += [item['id'] for item in response['results']]
+            url, pages = response['next'], pages + 1
+        self.assertEqual(pages, 4)
+        self.assertEqual(sorted(seen), sorted(File.objects.values_list('id', flat=True)))
+        self.assertEqual(len(seen), len(set(seen)))
+
+        second_page = self.client.get('/api/files/?page_size=7').json()['next']
+        previous = self.client.get(self.client.get(second_page).json()['previous']).json()
+        self.assertEqual([item['id'] for item in previous['results']], seen[:7])
+
+    def test_tampered_cursors_are_not_found(self):
+        self.populate(folders=1, files_per_folder=3, shares_per_item=0)
+        for cursor in (
+            {'v': 'yesterday', 'k': 1},
+            {'v': 5, 'k': 1},
+            {'v': '2024-01-01T00:00:00+00:00', 'k': 'one'},
+            {'v': '2024-01-01T00:00:00+00:00', 'k': [1]},
+            {'v': None, 'k': 1},
+            ['2024-01-01T00:00:00+00:00', 1],
+        ):
+            encoded = base64.b64encode(json.dumps(cursor).encode('utf-8')).decode('ascii')
+            response = self.client.get('/api/files/', {'cursor': encoded})
+            self.assertEqual(response.status_code, 404, cursor)
+
+    def test_unchanged_listing_is_not_modified(self):
+        self.populate(folders=3, files_per_folder=4, shares_per_item=2)
+        etag = self.client.get('/api/folders/')['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/folders/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertLessEqual(len(queries), 3)
+
+        File.objects.filter(folder__isnull=False).first().delete()
+        response = self.client.get('/api/folders/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_trashing_one_file_and_restoring_another_changes_the_etag(self):
+        first, second, newest = [
+            File.objects.create(
+                name=f'file-{i}', owner=self.owner, file=f'files/{i}', size=i, mime_type='text/plain'
+            )
+            for i in range(3)
+        ]
+        self.assertEqual(self.client.delete(f'/api/files/{first.pk}/').status_code, 204)
+        etag = self.client.get('/api/files/')['ETag']
+
+        self.assertEqual(self.client.post(f'/api/trash/files/{first.pk}/restore/').status_code, 200)
+        self.assertEqual(self.client.delete(f'/api/files/{second.pk}/').status_code, 204)
+        response = self.client.get('/api/files/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(item['id'] for item in response.json()['results']), [first.pk, newest.pk])
+
+    def test_trashing_a_folder_hides_and_restores_its_subtree(self):
+        self.populate(folders=3, files_per_folder=2, shares_per_item=1)
+        root = Folder.objects.get(parent__isnull=True)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.delete(f'/api/folders/{root.pk}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertLessEqual(len(queries), 15)
+        self.assertEqual(Folder.objects.count(), 0)
+        self.assertEqual(File.objects.count(), 0)
+        trashed = self.client.get('/api/trash/folders/').json()['results']
+        self.assertEqual([item['id'] for item in trashed], [root.pk])
+
+        response = self.client.post(f'/api/trash/folders/{root.pk}/restore/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Folder.objects.count(), 3)
+        self.assertEqual(File.objects.count(), 6)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class DownloadTests(TestCase):
+    """Downloads honour single byte ranges, If-Range and unsatisfiable ranges."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner@example.com', 'Owner', 'owner', is_active=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.file = self.store(b'0123456789')
+
+    def store(self, data, name='notes.txt'):
+        file = File(name=name, owner=self.owner, mime_type='text/plain')
+        blobs.attach(file, blobs.ingest_upload(ContentFile(data, name=name))).save()
+        return file
+
+    def get(self, file=None, **headers):
+        response = self.client.get(f'/api/files/{(file or self.file).pk}/download/', **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_ranges_send_the_requested_bytes(self):
+        response, body = self.get()
+        self.assertEqual((response.status_code, body), (200, b'0123456789'))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        for header, content_range, expected in (
+            ('bytes=2-5', 'bytes 2-5/10', b'2345'),
+            ('bytes=7-', 'bytes 7-9/10', b'789'),
+            ('bytes=-3', 'bytes 7-9/10', b'789'),
+            ('bytes=5-100', 'bytes 5-9/10', b'56789'),
+            ('bytes=-100', 'bytes 0-9/10', b'0123456789'),
+        ):
+            response, body = self.get(HTTP_RANGE=header)
+            self.assertEqual((response.status_code, body), (206, expected), header)
+            self.assertEqual(response['Content-Range'], content_range, header)
+            self.assertEqual(response['Content-Length'], str(len(expected)), header)
+
+        # Malformed and multi-range headers are ignored.
+        for header in ('bytes=0-1,3-4', 'items=0-1', 'bytes=-'):
+            response, body = self.get(HTTP_RANGE=header)
+            self.assertEqual((response.status_code, body), (200, b'0123456789'), header)
+
+    def test_unsatisfiable_ranges_are_416(self):
+        for header in ('bytes=10-', 'bytes=5-2', 'bytes=-0'):
+            response, _ = self.get(HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 416, header)
+            self.assertEqual(response['Content-Range'], 'bytes */10', header)
+
+        empty = self.store(b'', name='empty.txt')
+        for header in ('bytes=-5', 'bytes=0-'):
+            response, _ = self.get(empty, HTTP_RANGE=header)
+            self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */0'), header)
+        response, body = self.get(empty)
+        self.assertEqual((response.status_code, body), (200, b''))
+
+    def test_stale_if_range_sends_the_whole_file(self):
+        etag = self.get()[0]['ETag']
+        last_modified = self.file.updated_at
+        for validator, status_code in (
+            (etag, 206),
+            ('"stale"', 200),
+            (http_date(last_modified.timestamp() + 60), 206),
+            (http_date(last_modified.timestamp() - 60), 200),
+        ):
+            response, body = self.get(HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE=validator)
+            self.assertEqual(response.status_code, status_code, validator)
+            self.assertEqual(body, b'2345' if status_code == 206 else b'0123456789', validator)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), SHARED_CACHE=True)
+class SignedDownloadTests(TestCase):
+    """Signed URLs download without database queries until they are revoked."""
+
+    def test_signed_download_skips_the_database(self):
+        owner = User.objects.create_user('owner@example.com', 'Owner', 'owner', is_active=True)
+        client = APIClient()
+        client.force_authenticate(owner)
+        file = File(name='notes.txt', owner=owner, mime_type='text/plain')
+        blobs.attach(file, blobs.ingest_upload(ContentFile(b'0123456789', name='notes.txt'))).save()
+        url = client.get(f'/api/files/{file.pk}/signed_url/').json()['url']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get(url, HTTP_RANGE='bytes=2-5')
+            body = b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, b'2345')
+        self.assertEqual(len(queries), 0)
+
+        self.assertEqual(APIClient().get(url.rstrip('/') + 'x/').status_code, 403)
+        # Revocations would not reach other workers through a per-process cache.
+        with self.settings(SHARED_CACHE=False):
+            self.assertEqual(client.get(f'/api/files/{file.pk}/signed_url/').status_code, 501)
+            self.assertEqual(APIClient().get(url).status_code, 410)
+        client.delete(f'/api/files/{file.pk}/')
+        self.assertEqual(APIClient().get(url).status_code, 410)
+
+    def test_replacing_the_content_rejects_older_urls(self):
+        owner = User.objects.create_user('owner@example.com', 'Owner', 'owner', is_active=True)
+        client = APIClient()
+        client.force_authenticate(owner)
+        file = File(name='notes.txt', owner=owner, mime_type='text/plain')
+        blobs.attach(file, blobs.ingest_upload(ContentFile(b'old', name='notes.txt'))).save()
+        old_url = client.get(f'/api/files/{file.pk}/signed_url/').json()['url']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.patch(
+                f'/api/files/{file.pk}/', {'file': ContentFile(b'new', name='notes.txt')}, format='multipart'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(APIClient().get(old_url).status_code, 410)
+
+        new_url = client.get(f'/api/files/{file.pk}/signed_url/').json()['url']
+        self.assertEqual(b''.join(APIClient().get(new_url).streaming_content), b'new')
+
+    @override_settings(SIGNED_DOWNLOAD_SECRET='secret', SIGNED_DOWNLOAD_NGINX_PREFIX='/signed/')
+    def test_nginx_urls_sign_the_decoded_uri(self):
+        url = signed.nginx_url('files/a b/ü.txt', 1700000000)
+        path, query = url.split('?')
+        self.assertEqual(path, '/signed/files/a%20b/%C3%BC.txt')
+        # What secure_link_md5 "$secure_link_expires$uri secret" computes for that request.
+        digest = hashlib.md5('1700000000/signed/files/a b/ü.txt secret'.encode()).digest()
+        md5 = base64.urlsafe_b64encode(digest).decode().rstrip('=')
+        self.assertEqual(query, f'md5={md5}&expires=1700000000')
+
+    @override_settings(STORAGE_DOWNLOAD_MODE='x-accel-redirect')
+    def test_offloaded_downloads_keep_the_range_policy(self):
+        owner = User.objects.create_user('owner@example.com', 'Owner', 'owner', is_active=True)
+        client = APIClient()
+        client.force_authenticate(owner)
+        file = File(name='notes.txt', owner=owner, mime_type='text/plain')
+        blobs.attach(file, blobs.ingest_upload(ContentFile(b'0123456789', name='notes.txt'))).save()
+
+        response = APIClient().get(client.get(f'/api/files/{file.pk}/signed_url/').json()['url'])
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected/{file.file.name}')
+
+        # nginx would answer Range itself, so these are streamed here.
+        url = client.get(f'/api/files/{file.pk}/signed_url/', {'ranges': 'false'}).json()['url']
+        response = APIClient().get(url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertEqual(response['Accept-Ranges'], 'none')
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+        with self.settings(SIGNED_DOWNLOAD_MODE='nginx'):
+            response = client.get(f'/api/files/{file.pk}/signed_url/', {'ranges': 'false'})
+            self.assertEqual(response.status_code, 400)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class BlobStoreTests(TestCase):
+    """Identical bodies are stored once and only collected when unreferenced."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner@example.com', 'Owner', 'owner', is_active=True)
+
+    def store(self, data, owner=None, name='notes.txt'):
+        file = File(name=name, owner=owner or self.owner, mime_type='text/plain')
+        blobs.attach(file, blobs.ingest_upload(ContentFile(data, name=name))).save()
+        return file
+
+    def age(self, blob):
+        Blob.objects.filter(pk=blob.pk).update(updated_at=timezone.now() - timedelta(days=30))
+        return timezone.now() - settings.BLOB_GC_GRACE_PERIOD
+
+    def test_precheck_only_reuses_the_callers_own_content(self):
+        data = b'private contents'
+        self.store(data)
+        query = {'sha256': hashlib.sha256(data).hexdigest(), 'size': len(data), 'name': 'copy.txt'}
+
+        other = User.objects.create_user('other@example.com', 'Other', 'other', is_active=True)
+        client = APIClient()
+        client.force_authenticate(other)
+        self.assertEqual(client.post('/api/files/precheck/', query).json(), {'exists': False})
+        self.assertFalse(File.objects.filter(owner=other).exists())
+
+        client.force_authenticate(self.owner)
+        response = client.post('/api/files/precheck/', query)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+    def test_unreferenced_blobs_are_collected_unless_claimed(self):
+        first, second = self.store(b'shared'), self.store(b'shared', name='again.txt')
+        blob = Blob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        first.delete()
+        self.assertFalse(blobs.collect(blob, self.age(blob)))
+        second.delete()
+
+        # A writer publishing the same body keeps the blob alive.
+        cutoff = self.age(blob)
+        with blobs.BlobWriter() as writer:
+            writer.write(b'shared')
+            writer.commit()
+        self.assertFalse(blobs.collect(blob, cutoff))
+        self.assertTrue(os.path.exists(blob.file.path))
+
+        self.assertTrue(blobs.collect(blob, self.age(blob)))
+        self.assertFalse(os.path.exists(blob.file.path))
+        # Published again after collection, the body is stored again.
+        self.store(b'shared')
+        self.assertTrue(os.path.exists(Blob.objects.get().file.path))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), JOB_BACKEND='inline')
+class ThumbnailTests(TestCase):
+    """Images are rendered once; ones that cannot be are reported, not retried."""
+
+    def upload(self, data, mime_type='image/png'):
+        owner = User.objects.create_user('owner@example.com', 'Owner', 'owner', is_active=True)
+        self.client = APIClient()
+        self.client.force_authenticate(owner)
+        file = File(name='picture.png', owner=owner, mime_type=mime_type)
+        with self.captureOnCommitCallbacks(execute=True):
+            blobs.attach(file, blobs.ingest_upload(ContentFile(data, name='picture.png'))).save()
+        return file
+
+    def test_rendered_thumbnail_is_served(self):
+        image = BytesIO()
+        Image.new('RGB', (600, 400), 'teal').save(image, 'PNG')
+        file = self.upload(image.getvalue())
+
+        response = self.client.get(f'/api/files/{file.pk}/thumbnail/?size=128&type=jpeg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+    def test_unreadable_image_is_not_rendered_again(self):
+        file = self.upload(b'not really a png')
+        self.assertTrue(thumbnails.failed(file.file.storage, thumbnails.file_source(file)))
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.get(f'/api/files/{file.pk}/thumbnail/')
+        self.assertEqual(response.status_code, 415)
+        self.assertEqual(callbacks, [])
+
+
+class SearchTests(TestCase):
+    """Search tolerates typos but only ever returns what the caller can see."""
+
+    def test_misspelled_words_find_accessible_files_only(self):
+        owner = User.objects.create_user('owner@example.com', 'Owner', 'owner', is_active=True)
+        other = User.objects.create_user('other@example.com', 'Other', 'other', is_active=True)
+        mine = File.objects.create(
+            name='quarterly-invoice.pdf', owner=owner, file='files/1', size=1, mime_type='application/pdf'
+        )
+        File.objects.create(name='holiday photos', owner=owner, file='files/2', size=1, mime_type='image/jpeg')
+        File.objects.create(name='invoice secret', owner=other, file='files/3', size=1, mime_type='text/plain')
+        client = APIClient()
+        client.force_authenticate(owner)
+
+        for query in ('invoice', 'invoce', 'quartrely invoic'):
+            results = client.get('/api/search/', {'q': query}).json()['results']
+            self.assertEqual([(result['type'], result['id']) for result in results], [('file', mine.pk)], query)
+
+
+class ShareLinkDownloadCountTests(TransactionTestCase):
+    """Concurrent downloads of a limited link must never exceed ``max_downloads``."""
+
+    def test_concurrent_claims_do_not_overshoot(self):
+        owner = User.objects.create_user('owner@example.com', 'Owner', 'owner', is_active=True)
+        file = File.objects.create(
+            name='popular', owner=owner, file='files/popular', size=1, mime_type='text/plain'
+        )
+        link = ShareLink.objects.create(file=file, created_by=owner, max_downloads=25)
+        claimed = []
+        barrier = threading.Barrier(8)
+
+        def download():
+            try:
+                barrier.wait()
+                for _ in range(10):
+                    if links.claim_download(link):
+                        claimed.append(1)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=download) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        link.refresh_from_db()
+        self.assertEqual(len(claimed), 25)
+        self.assertEqual(link.download_count, 25)
+        self.assertFalse(link.is_valid())
+        self.assertFalse(links.claim_download(link))
+
+    def test_cached_link_is_refreshed_when_used_up(self):
+        owner = User.objects.create_user('owner@example.com', 'Owner', 'owner', is_active=True)
+        file = File.objects.create(
+            name='once', owner=owner, file='files/once', size=1, mime_type='text/plain'
+        )
+        link = ShareLink.objects.create(file=file, created_by=owner, max_downloads=1)
+
+        cached = links.get_link(link.uuid)
+        self.assertTrue(links.claim_download(cached))
+        self.assertFalse(links.claim_download(links.get_link(link.uuid)))
+        self.assertFalse(links.get_link(link.uuid).is_valid())
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_ranged_downloads_count_unless_they_resume_a_claim(self):
+        owner = User.objects.create_user('owner@example.com', 'Owner', 'owner', is_active=True)
+        file = File(name='notes.txt', owner=owner, mime_type='text/plain')
+        blobs.attach(file, blobs.ingest_upload(ContentFile(b'0123456789', name='notes.txt'))).save()
+        link = ShareLink.objects.create(file=file, created_by=owner, max_downloads=1)
+        url = f'/api/share/{link.uuid}/download/'
+        client = APIClient()
+
+        response = client.get(url, HTTP_RANGE='bytes=1-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'123456789')
+        claim = response['Download-Claim']
+
+        for headers in ({'HTTP_RANGE': 'bytes=1-'}, {'HTTP_RANGE': 'bytes=-999999999'}, {}):
+            self.assertEqual(client.get(url, **headers).status_code, 410)
+        self.assertEqual(client.get(url, {'claim': 'forged'}, HTTP_RANGE='bytes=1-').status_code, 410)
+        self.assertEqual(client.get(url, {'claim': claim}).status_code, 410)
+        # A claim only continues a download; asking for the whole file again is a new one.
+        for headers in (
+            {'HTTP_RANGE': 'bytes=0-'},
+            {'HTTP_RANGE': 'bytes=-999999999'},
+            {'HTTP_RANGE': 'bytes=2-', 'HTTP_IF_RANGE': '"stale"'},
+        ):
+            self.assertEqual(client.get(url, {'claim': claim}, **headers).status_code, 410)
+
+        response = client.get(url, {'claim': claim}, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+        link.refresh_from_db()
+        self.assertEqual(link.download_count, 1)
+
+        ShareLink.objects.filter(pk=link.pk).update(max_downloads=2)
+        links.invalidate(link.uuid)
+        response = client.get(url, {'claim': claim}, HTTP_RANGE='bytes=0-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        link.refresh_from_db()
+        self.assertEqual(link.download_count, 2)
+
+
+class BulkShareJobTests(TransactionTestCase):
+    """Bulk shares commit per batch, so job progress is visible while they run."""
+
+    def test_batches_commit_before_progress_is_reported(self):
+        owner = User.objects.create_user('owner@example.com', 'Owner', 'owner', is_active=True)
+        users = [
+            User.objects.create_user(f'user{i}@example.com', 'User', f'user{i}', is_active=True).pk
+            for i in range(2)
+        ]
+        files = [
+            File.objects.create(name=f'file-{i}', owner=owner, file=f'files/{i}', size=1, mime_type='text/plain').pk
+            for i in range(5)
+        ]
+        reports = []
+
+        def report(progress, state=None, total=None):
+            reports.append((progress, state, connection.in_atomic_block, FileShare.objects.count()))
+
+        sharing.share_many('file', files, users, 'VIEW', None, owner, batch_size=4, report=report)
+        self.assertEqual(reports, [
+            (4, {'items': 2}, False, 4),
+            (8, {'items': 4}, False, 8),
+            (10, {'items': 5}, False, 10),
+        ])
+
+        # A requeued job picks up after its last checkpoint.
+        FileShare.objects.all().delete()
+        results = sharing.share_many('file', files, users, 'VIEW', None, owner, batch_size=4, start=4)
+        self.assertEqual(FileShare.objects.count(), 2)
+        self.assertEqual([result['created'] for result in results], [None] * 8 + [True] * 2)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), ACTIVITY_LOG_MODE='sync')
+class UploadSessionTests(TestCase):
+    """Chunked uploads resume from what is on disk and commit once complete."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner@example.com', 'Owner', 'owner', is_active=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def start(self, size, name='notes.txt', chunk_size=4):
+        return self.client.post('/api/uploads/', {'name': name, 'size': size, 'chunk_size': chunk_size})
+
+    def put(self, session, index, data):
+        return self.client.put(
+            f'/api/uploads/{session}/chunks/{index}/', data, content_type='application/octet-stream'
+        )
+
+    def test_chunks_resume_and_commit_into_one_file(self):
+        session = self.start(10).json()['uuid']
+        self.assertEqual(self.put(session, 0, b'0123').status_code, 200)
+        self.assertEqual(self.put(session, 2, b'89').status_code, 200)
+        self.assertEqual(self.put(session, 1, b'toolong').status_code, 400)
+        self.assertEqual(self.put(session, 3, b'').status_code, 400)
+
+        # A client coming back asks what is already there and sends the rest.
+        self.assertEqual(self.client.get(f'/api/uploads/{session}/').json()['received'], [[0, 0], [2, 2]])
+        response = self.client.post(f'/api/uploads/{session}/commit/')
+        self.assertEqual((response.status_code, response.json()['missing']), (400, [1]))
+
+        self.assertEqual(self.put(session, 1, b'4567').status_code, 200)
+        response = self.client.post(f'/api/uploads/{session}/commit/')
+        self.assertEqual(response.status_code, 201)
+        file = File.objects.get(pk=response.json()['id'])
+        with file.file.open('rb') as body:
+            self.assertEqual(body.read(), b'0123456789')
+        self.assertEqual((file.size, file.mime_type), (10, 'text/plain'))
+
+        # A committed session takes no more chunks and cannot commit twice.
+        self.assertEqual(self.put(session, 0, b'0123').status_code, 403)
+        self.assertEqual(self.client.post(f'/api/uploads/{session}/commit/').status_code, 403)
+
+    def upload(self, data, name='notes.txt'):
+        session = self.start(len(data), name=name).json()['uuid']
+        for index in range(0, len(data), 4):
+            self.put(session, index // 4, data[index:index + 4])
+        return session
+
+    def test_commit_takes_the_session_before_assembling(self):
+        session = self.upload(b'0123456789')
+
+        def committed_meanwhile(upload):
+            # Another request commits the session between the checks and the commit.
+            UploadSession.objects.filter(pk=upload.pk).update(status=UploadStatus.COMMITTED)
+            return []
+
+        with mock.patch.object(uploads, 'missing_chunks', committed_meanwhile):
+            response = self.client.post(f'/api/uploads/{session}/commit/')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(File.objects.exists())
+
+    def test_commit_rechecks_the_quota(self):
+        session = self.upload(b'0123456789')
+        StorageUsage.objects.create(user=self.owner, quota=5)
+
+        response = self.client.post(f'/api/uploads/{session}/commit/')
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(File.objects.exists())
+        self.assertEqual(UploadSession.objects.get(uuid=session).status, UploadStatus.ACTIVE)
+
+
+class FolderPathTests(TestCase):
+    """Folder paths follow every move, so subtree queries never walk the tree."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner@example.com', 'Owner', 'owner', is_active=True)
+        self.source = Folder.objects.create(name='source', owner=self.owner)
+        self.moved = Folder.objects.create(name='moved', owner=self.owner, parent=self.source)
+        self.leaf = Folder.objects.create(name='leaf', owner=self.owner, parent=self.moved)
+        self.target = Folder.objects.create(name='target', owner=self.owner)
+
+    def test_moving_a_folder_rewrites_its_subtree(self):
+        self.assertEqual((self.leaf.path, self.leaf.depth), (f'/{self.source.pk}/{self.moved.pk}/{self.leaf.pk}/', 2))
+
+        self.moved.parent = self.target
+        self.moved.save()
+        self.leaf.refresh_from_db()
+        self.assertEqual((self.leaf.path, self.leaf.depth), (f'/{self.target.pk}/{self.moved.pk}/{self.leaf.pk}/', 2))
+        self.assertEqual([folder.pk for folder in self.leaf.ancestors()], [self.target.pk, self.moved.pk])
+        self.assertEqual(list(self.source.descendants()), [])
+        self.assertEqual({folder.pk for folder in self.target.descendants()}, {self.moved.pk, self.leaf.pk})
+
+        # Moving to the top shortens the paths and depths below it.
+        self.moved.parent = None
+        self.moved.save()
+        self.leaf.refresh_from_db()
+        self.assertEqual((self.leaf.path, self.leaf.depth), (f'/{self.moved.pk}/{self.leaf.pk}/', 1))
+
+    def test_a_folder_cannot_move_into_its_own_subtree(self):
+        self.source.parent = self.leaf
+        with self.assertRaises(ValueError):
+            self.source.save()
+        self.leaf.refresh_from_db()
+        self.assertEqual(self.leaf.path, f'/{self.source.pk}/{self.moved.pk}/{self.leaf.pk}/')
+
+    def test_rebuild_restores_drifted_paths(self):
+        Folder.objects.update(path='', depth=0)
+        call_command('rebuild_folder_paths', stdout=StringIO())
+        self.leaf.refresh_from_db()
+        self.assertEqual((self.leaf.path, self.leaf.depth), (f'/{self.source.pk}/{self.moved.pk}/{self.leaf.pk}/', 2))
+
+
+@override_settings(ACTIVITY_LOG_MODE='sync')
+class PermissionTests(TestCase):
+    """A folder share reaches its whole subtree, and only while it is under it."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner@example.com', 'Owner', 'owner', is_active=True)
+        self.viewer = User.objects.create_user('viewer@example.com', 'Viewer', 'viewer', is_active=True)
+        self.shared = Folder.objects.create(name='shared', owner=self.owner)
+        self.child = Folder.objects.create(name='child', owner=self.owner, parent=self.shared)
+        self.private = Folder.objects.create(name='private', owner=self.owner)
+        self.file = File.objects.create(
+            name='report.txt', folder=self.child, owner=self.owner, file='files/1', size=1, mime_type='text/plain'
+        )
+        self.hidden = File.objects.create(
+            name='hidden.txt', folder=self.private, owner=self.owner, file='files/2', size=1, mime_type='text/plain'
+        )
+        FolderShare.objects.create(folder=self.shared, user=self.viewer, permission='VIEW')
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def effective(self):
+        return self.client.get('/api/permissions/', {
+            'files': f'{self.file.pk},{self.hidden.pk}',
+            'folders': f'{self.child.pk},{self.private.pk}',
+        }).json()
+
+    def test_folder_shares_are_inherited_by_the_subtree(self):
+        self.assertEqual(self.effective(), {
+            'files': {str(self.file.pk): 'VIEW'},
+            'folders': {str(self.child.pk): 'VIEW'},
+        })
+        self.assertEqual(self.client.get(f'/api/files/{self.file.pk}/').status_code, 200)
+        self.assertEqual(self.client.get(f'/api/files/{self.hidden.pk}/').status_code, 404)
+        self.assertEqual(self.client.patch(f'/api/files/{self.file.pk}/', {'name': 'renamed.txt'}).status_code, 403)
+        self.assertEqual(self.client.delete(f'/api/folders/{self.child.pk}/').status_code, 403)
+
+        # The strongest of the inherited and the direct share applies.
+        FileShare.objects.create(file=self.file, user=self.viewer, permission='EDIT')
+        self.assertEqual(self.effective()['files'], {str(self.file.pk): 'EDIT'})
+        self.assertEqual(self.client.patch(f'/api/files/{self.file.pk}/', {'name': 'renamed.txt'}).status_code, 200)
+
+    def test_moving_out_of_a_shared_folder_drops_inherited_access(self):
+        self.child.parent = self.private
+        self.child.save()
+        self.assertEqual(self.effective(), {'files': {}, 'folders': {}})
+        self.assertEqual(self.client.get(f'/api/files/{self.file.pk}/').status_code, 404)
+
+        self.child.parent = self.shared
+        self.child.save()
+        self.assertEqual(self.client.get(f'/api/files/{self.file.pk}/').status_code, 200)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), ACTIVITY_LOG_MODE='sync')
+class QuotaTests(TestCase):
+    """Usage counters follow file writes, and no path to storing bytes skips the quota."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner@example.com', 'Owner', 'owner', is_active=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def start(self, size, name):
+        return self.client.post('/api/uploads/', {'name': name, 'size': size, 'chunk_size': 4})
+
+    def test_counters_follow_creates_and_deletes(self):
+        image = File.objects.create(name='a.png', owner=self.owner, file='files/1', size=5, mime_type='image/png')
+        File.objects.create(name='b.txt', owner=self.owner, file='files/2', size=3, mime_type='text/plain')
+        image.delete()
+        usage = self.client.get('/api/usage/').json()
+        self.assertEqual((usage['bytes_used'], usage['file_count'], usage['quota']), (3, 1, None))
+        self.assertEqual(usage['by_type'], {
+            'document': {'bytes_used': 3, 'file_count': 1},
+            'image': {'bytes_used': 0, 'file_count': 0},
+        })
+
+    def test_uploads_cannot_overrun_the_quota(self):
+        StorageUsage.objects.create(user=self.owner, quota=16)
+        first = self.start(10, 'first.txt').json()['uuid']
+        # Bytes promised to an open session are as good as used.
+        self.assertEqual(self.start(10, 'second.txt').status_code, 413)
+        self.assertEqual(self.start(6, 'second.txt').status_code, 201)
+
+        for index, data in enumerate((b'0123', b'4567', b'89')):
+            self.client.put(f'/api/uploads/{first}/chunks/{index}/', data, content_type='application/octet-stream')
+        self.assertEqual(self.client.post(f'/api/uploads/{first}/commit/').status_code, 201)
+        usage = self.client.get('/api/usage/').json()
+        self.assertEqual((usage['bytes_used'], usage['available']), (10, 0))
+
+        folder = Folder.objects.create(name='docs', owner=self.owner)
+        upload = ContentFile(b'x', name='extra.txt')
+        response = self.client.post('/api/files/', {'name': 'extra.txt', 'folder': folder.pk, 'file': upload})
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(File.objects.filter(name='extra.txt').exists())
+
+
+class ChangesJournalTests(TestCase):
+    """Sync clients see their own changes and what is shared with them, once."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner@example.com', 'Owner', 'owner', is_active=True)
+        self.viewer = User.objects.create_user('viewer@example.com', 'Viewer', 'viewer', is_active=True)
+        self.client = APIClient()
+
+    def changes(self, user, cursor):
+        self.client.force_authenticate(user)
+        response = self.client.get('/api/changes/', {'cursor': cursor}).json()
+        return response['cursor'], [(change['kind'], change['id'], change['action']) for change in response['changes']]
+
+    def test_changes_follow_ownership_and_shares(self):
+        self.client.force_authenticate(self.owner)
+        start = self.client.get('/api/changes/').json()['cursor']
+        folder = Folder.objects.create(name='docs', owner=self.owner)
+        file = File.objects.create(
+            name='a.txt', folder=folder, owner=self.owner, file='files/1', size=1, mime_type='text/plain'
+        )
+        file.name = 'b.txt'
+        file.save()
+
+        # Created and renamed in the same batch is one create.
+        cursor, changes = self.changes(self.owner, start)
+        self.assertEqual(changes, [('folder', folder.pk, 'CREATE'), ('file', file.pk, 'CREATE')])
+        self.assertEqual(self.changes(self.owner, cursor), (cursor, []))
+        self.assertEqual(self.changes(self.viewer, start)[1], [])
+
+        FolderShare.objects.create(folder=folder, user=self.viewer, permission='VIEW')
+        file.size = 2
+        file.save()
+        _, changes = self.changes(self.viewer, cursor)
+        self.assertEqual(changes, [('folder', folder.pk, 'SHARE'), ('file', file.pk, 'UPDATE')])
+
+    def test_moves_carry_the_old_and_new_place(self):
+        source = Folder.objects.create(name='source', owner=self.owner)
+        target = Folder.objects.create(name='target', owner=self.owner)
+        moved = Folder.objects.create(name='moved', owner=self.owner, parent=source)
+        FolderShare.objects.create(folder=source, user=self.viewer, permission='VIEW')
+        self.client.force_authenticate(self.viewer)
+        cursor = self.client.get('/api/changes/').json()['cursor']
+
+        moved.parent = target
+        moved.save()
+        # The viewer saw it leave the shared folder, so they are told.
+        changes = self.client.get('/api/changes/', {'cursor': cursor}).json()['changes']
+        self.assertEqual(
+            [(change['kind'], change['id'], change['action'], change['parent']) for change in changes],
+            [('folder', moved.pk, 'MOVE', target.pk)],
+        )
+
+    def test_malformed_cursors_are_rejected(self):
+        self.client.force_authenticate(self.owner)
+        self.assertEqual(self.client.get('/api/changes/', {'cursor': 'abc'}).status_code, 400)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), JOB_BACKEND='inline')
+class FolderJobTests(TestCase):
+    """Subtree moves, copies and deletes run as jobs the caller can poll."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner@example.com', 'Owner', 'owner', is_active=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.source = Folder.objects.create(name='source', owner=self.owner)
+        self.inner = Folder.objects.create(name='inner', owner=self.owner, parent=self.source)
+        for i, folder in enumerate((self.source, self.inner)):
+            file = File(name=f'file-{i}', folder=folder, owner=self.owner, mime_type='text/plain')
+            blobs.attach(file, blobs.ingest_upload(ContentFile(b'body %d' % i, name=file.name))).save()
+        self.target = Folder.objects.create(name='target', owner=self.owner)
+
+    def submit(self, method, url, data=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(url, data)
+        self.assertEqual(response.status_code, 202)
+        return self.client.get(f'/api/jobs/{response.json()["uuid"]}/').json()
+
+    def test_move_runs_as_a_job(self):
+        job = self.submit('patch', f'/api/folders/{self.inner.pk}/', {'parent': self.target.pk})
+        self.assertEqual((job['status'], job['progress'], job['total']), ('SUCCEEDED', 1, 1))
+        self.inner.refresh_from_db()
+        self.assertEqual(self.inner.path, f'/{self.target.pk}/{self.inner.pk}/')
+
+        response = self.client.patch(f'/api/folders/{self.target.pk}/', {'parent': self.inner.pk})
+        self.assertEqual(response.status_code, 400)
+        # Had the request raced another move, the job would refuse it.
+        job = jobs.submit('move_folder', self.owner, {'folder': self.target.pk, 'parent': self.inner.pk}, total=1)
+        with self.assertLogs('storage.jobs', 'ERROR'):
+            jobs.run(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'FAILED')
+        self.target.refresh_from_db()
+        self.assertEqual((self.target.parent_id, self.target.path), (None, f'/{self.target.pk}/'))
+
+    def test_copy_and_delete_cover_the_whole_subtree(self):
+        job = self.submit('post', f'/api/folders/{self.source.pk}/copy/', {'parent': self.target.pk})
+        copy = Folder.objects.get(name='source', parent=self.target)
+        self.assertEqual((job['status'], job['result']), ('SUCCEEDED', {'folder': copy.pk, 'folders': 2, 'files': 2}))
+        self.assertEqual(
+            sorted(File.objects.filter(folder__path__startswith=copy.path).values_list('name', flat=True)),
+            ['file-0', 'file-1'],
+        )
+
+        self.assertEqual(self.client.delete(f'/api/folders/{self.source.pk}/').status_code, 204)
+        job = self.submit('delete', f'/api/trash/folders/{self.source.pk}/')
+        self.assertEqual((job['status'], job['progress'], job['total']), ('SUCCEEDED', 4, 4))
+        self.assertFalse(Folder.all_objects.filter(pk__in=[self.source.pk, self.inner.pk]).exists())
+        # The copies still hold the bodies, so no blob is reclaimed.
+        self.assertEqual(job['result'], {'files': 2, 'folders': 2, 'blobs_reclaimed': 0})
+        self.assertEqual(File.all_objects.count(), 2)
+        self.assertEqual(list(Blob.objects.values_list('ref_count', flat=True)), [1, 1])
+
+
+class ExpirySweepTests(TestCase):
+    """Expired shares and links are switched off, journaled and stop granting access."""
+
+    def test_sweep_deactivates_only_what_has_expired(self):
+        owner = User.objects.create_user('owner@example.com', 'Owner', 'owner', is_active=True)
+        viewer = User.objects.create_user('viewer@example.com', 'Viewer', 'viewer', is_active=True)
+        folder = Folder.objects.create(name='docs', owner=owner)
+        file = File.objects.create(
+            name='a.txt', folder=folder, owner=owner, file='files/1', size=1, mime_type='text/plain'
+        )
+        now = timezone.now()
+        expired_share = FolderShare.objects.create(folder=folder, user=viewer, expires_at=now - timedelta(hours=1))
+        current_share = FileShare.objects.create(file=file, user=viewer, expires_at=now + timedelta(hours=1))
+        expired_link = ShareLink.objects.create(file=file, created_by=owner, expires_at=now - timedelta(hours=1))
+        current_link = ShareLink.objects.create(folder=folder, created_by=owner)
+        client = APIClient()
+        client.force_authenticate(viewer)
+        cursor = client.get('/api/changes/').json()['cursor']
+
+        self.assertEqual(expiry.sweep(batch_size=1), {'file_shares': 0, 'folder_shares': 1, 'links': 1})
+        self.assertEqual(expiry.sweep(), {'file_shares': 0, 'folder_shares': 0, 'links': 0})
+        for obj, active in (
+            (expired_share, False), (current_share, True), (expired_link, False), (current_link, True),
+        ):
+            obj.refresh_from_db()
+            self.assertEqual(obj.is_active, active, obj)
+
+        changes = client.get('/api/changes/', {'cursor': cursor}).json()['changes']
+        self.assertEqual([(change['kind'], change['id'], change['action']) for change in changes], [
+            ('folder', folder.pk, 'UNSHARE'),
+        ])
+        self.assertEqual(client.get(f'/api/folders/{folder.pk}/').status_code, 404)
+        self.assertEqual(client.get(f'/api/files/{file.pk}/').status_code, 200)
+        self.assertEqual(APIClient().get(f'/api/share/{expired_link.uuid}/').status_code, 410)
+
+
+class TrashAdminTests(TestCase):
+    """Trashed files and folders stay visible in the admin and can be restored from it."""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin@example.com', 'Admin', 'admin', password='pw')
+        self.client.force_login(self.admin)
+        self.folder = Folder.objects.create(name='docs', owner=self.admin)
+        self.kept = File.objects.create(
+            name='kept.txt', folder=self.folder, owner=self.admin, file='files/1', size=1, mime_type='text/plain'
+        )
+        self.trashed = File.objects.create(
+            name='trashed.txt', folder=self.folder, owner=self.admin, file='files/2', size=1, mime_type='text/plain'
+        )
+        trash.trash_file(self.trashed)
+
+    def changelist(self, **params):
+        response = self.client.get('/admin/storage/file/', params)
+        self.assertEqual(response.status_code, 200)
+        return {file.pk for file in response.context['cl'].result_list}
+
+    def test_changelist_lists_and_filters_trashed_rows(self):
+        self.assertEqual(self.changelist(), {self.kept.pk, self.trashed.pk})
+        self.assertEqual(self.changelist(trashed='yes'), {self.trashed.pk})
+        self.assertEqual(self.changelist(trashed='no'), {self.kept.pk})
+        self.assertEqual(self.client.get(f'/admin/storage/file/{self.trashed.pk}/change/').status_code, 200)
+
+    def test_restore_action(self):
+        trash.trash_folder(self.folder)
+        response = self.client.post('/admin/storage/file/', {
+            'action': 'restore_selected', '_selected_action': [self.trashed.pk],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertIsNotNone(File.all_objects.get(pk=self.trashed.pk).trashed_at)
+
+        for url, pk in (('/admin/storage/folder/', self.folder.pk), ('/admin/storage/file/', self.trashed.pk)):
+            self.client.post(url, {'action': 'restore_selected', '_selected_action': [pk]})
+        self.assertQuerySetEqual(File.objects.order_by('name'), [self.kept, self.trashed])
+        self.assertTrue(Folder.objects.filter(pk=self.folder.pk).exists())
+
+
+@override_settings(ACTIVITY_LOG_MODE='sync')
+class BenchSuiteTests(TestCase):
+    """The bench suite runs against a dataset, authenticating with real bearer tokens."""
+
+    def run_suite(self, scenarios):
+        out = StringIO()
+        call_command('bench_suite', scenarios=scenarios, iterations=2, warmup=1, stdout=out)
+        return json.loads(out.getvalue())['scenarios']
+
+    def test_upload_without_any_folders(self):
+        for i in range(2):
+            User.objects.create_user(f'load{i}@example.com', 'Load', f'load-{i}', is_active=True)
+        self.assertEqual(set(self.run_suite('upload,list_files')), {'upload', 'list_files'})
+        self.assertFalse(Folder.objects.exists())
+
+    def test_upload_into_a_folder_of_another_user(self):
+        users = [
+            User.objects.create_user(f'load{i}@example.com', 'Load', f'load-{i}', is_active=True)
+            for i in range(2)
+        ]
+        Folder.objects.create(name='docs', owner=users[1])
+        self.assertIn('upload', self.run_suite('upload'))
+        self.assertFalse(File.objects.exists())
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+    """Running without a shared cache is reported, naming what it turns off."""
+
+    @override_settings(SHARED_CACHE=True)
+    def test_silent_with_a_shared_cache(self):
+        self.assertEqual(checks.shared_cache(None), [])
+
+    @override_settings(SHARED_CACHE=False, SIGNED_DOWNLOAD_MODE='django', DATABASE_REPLICAS=[])
+    def test_warns_without_a_shared_cache(self):
+        [warning] = run_checks(tags=['caches'])
+        self.assertEqual(warning.id, 'storage.W001')
+        self.assertIn('cached permission checks', warning.msg)
+        self.assertIn('signed download URLs', warning.msg)
+        self.assertNotIn('replica', warning.msg)
+
+    @override_settings(SHARED_CACHE=False, SIGNED_DOWNLOAD_MODE='nginx', DATABASE_REPLICAS=['replica_0'])
+    def test_names_only_what_is_disabled(self):
+        [warning] = checks.shared_cache(None)
+        self.assertNotIn('signed download URLs', warning.msg)
+        self.assertIn('replica reads', warning.msg)
+
+
+class ActivitySinkTests(TransactionTestCase):
+    """The buffered sink writes queued events in batches and drops them by its overflow policy."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner@example.com', 'Owner', 'owner', is_active=True)
+
+    def sink(self, **options):
+        sink = activity.ActivitySink(**options)
+        # Without its writer thread, events stay queued until flush().
+        patcher = mock.patch.object(sink, 'ensure_thread')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return sink
+
+    def event(self, n):
+        return {
+            'user_id': self.user.pk, 'file_id': None, 'folder_id': None,
+            'activity_type': ActivityType.VIEW, 'ip_address': None, 'user_agent': None,
+            'details': {'n': n}, 'created_at': timezone.now(),
+        }
+
+    def written(self):
+        return [row.details['n'] for row in ActivityLog.objects.order_by('pk')]
+
+    def test_flush_writes_queued_events_and_rollups(self):
+        sink = self.sink(batch_size=2)
+        for n in range(5):
+            self.assertTrue(sink.enqueue(self.event(n)))
+        self.assertEqual(self.written(), [])
+
+        sink.flush()
+        self.assertEqual(self.written(), [0, 1, 2, 3, 4])
+        self.assertEqual(ActivityRollup.objects.get(user_id=self.user.pk).count, 5)
+        self.assertEqual(sink.stats(), {'queued': 5, 'flushed': 5, 'dropped': 0, 'failed': 0, 'pending': 0})
+
+    def test_overflow_policies(self):
+        for overflow, accepted, written in (
+            (activity.DROP_NEWEST, [True, True, False], [0, 1]),
+            (activity.DROP_OLDEST, [True, True, True], [1, 2]),
+            (activity.BLOCK, [True, True, False], [0, 1]),
+        ):
+            with self.subTest(overflow):
+                ActivityLog.objects.all().delete()
+                sink = self.sink(max_queue=2, overflow=overflow, block_timeout=0.01)
+                self.assertEqual([sink.enqueue(self.event(n)) for n in range(3)], accepted)
+                sink.flush()
+                self.assertEqual(self.written(), written)
+                self.assertEqual(sink.stats()['dropped'], 1)
+
+    def test_block_waits_for_the_writer(self):
+        sink = self.sink(max_queue=1, overflow=activity.BLOCK, block_timeout=5)
+        sink.enqueue(self.event(0))
+        # A writer taking the queued event lets the blocked producer in.
+        threading.Timer(0.05, sink.take_batch).start()
+        self.assertTrue(sink.enqueue(self.event(1)))
+        sink.flush()
+        self.assertEqual(self.written(), [1])
+
+    def test_close_flushes_from_the_writer_thread(self):
+        sink = activity.ActivitySink(batch_size=100, flush_interval=60)
+        for n in range(3):
+            sink.enqueue(self.event(n))
+        sink.close()
+        self.assertEqual(self.written(), [0, 1, 2])
+        self.assertEqual(sink.stats()['pending'], 0)
+
+
+class ActivityRetentionTests(TestCase):
+    """Rollups add up across writes and rebuilds, and pruning archives whole days."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner@example.com', 'Owner', 'owner', is_active=True)
+        self.today = timezone.localdate()
+
+    def record(self, days_ago, activity_type=ActivityType.VIEW, count=1, hour=12):
+        created_at = timezone.make_aware(datetime.combine(self.today - timedelta(days=days_ago), time(hour)))
+        activity.write_events([
+            {'user_id': self.user.pk, 'activity_type': activity_type, 'details': {'n': n}, 'created_at': created_at}
+            for n in range(count)
+        ])
+
+    def totals(self):
+        return {
+            (rollup.day, rollup.activity_type): rollup.count
+            for rollup in ActivityRollup.objects.filter(user_id=self.user.pk)
+        }
+
+    def test_writes_upsert_rollups(self):
+        self.record(0, count=2)
+        self.record(0)
+        self.record(0, ActivityType.DOWNLOAD)
+        self.record(1)
+        self.assertEqual(self.totals(), {
+            (self.today, 'VIEW'): 3,
+            (self.today, 'DOWNLOAD'): 1,
+            (self.today - timedelta(days=1), 'VIEW'): 1,
+        })
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get('/api/activity/stats/', {'days': 1}).json(), [
+            {'day': self.today.isoformat(), 'activity_type': 'DOWNLOAD', 'count': 1},
+            {'day': self.today.isoformat(), 'activity_type': 'VIEW', 'count': 3},
+        ])
+
+    def test_rebuild_matches_the_incremental_totals(self):
+        self.record(0, count=2)
+        self.record(3, ActivityType.UPLOAD)
+        expected = self.totals()
+        # Rollups that undercount the raw rows are recomputed from them.
+        ActivityRollup.objects.update(count=0)
+        call_command('rebuild_activity_rollups', stdout=StringIO())
+        self.assertEqual(self.totals(), expected)
+
+    def test_prune_archives_whole_days_and_keeps_rollups(self):
+        self.record(10, count=2, hour=1)
+        self.record(10, hour=23)
+        self.record(9)
+        self.record(0)
+        rollups = self.totals()
+        archive = tempfile.mkdtemp()
+
+        call_command('prune_activity', days=9, archive_dir=archive, batch_size=2, stdout=StringIO())
+        self.assertEqual(
+            sorted(log.created_at.date() for log in ActivityLog.objects.all()),
+            [self.today - timedelta(days=9), self.today],
+        )
+        self.assertEqual(self.totals(), rollups)
+
+        pruned_day = self.today - timedelta(days=10)
+        with gzip.open(os.path.join(archive, f'activity-{pruned_day:%Y-%m}.jsonl.gz'), 'rt') as lines:
+            rows = [json.loads(line) for line in lines]
+        self.assertEqual(len(rows), 3)
+        self.assertEqual({row['user_id'] for row in rows}, {self.user.pk})
+        self.assertEqual({row['created_at'][:10] for row in rows}, {pruned_day.isoformat()})
+
+        # Rebuilding after the prune leaves the pruned day's totals alone.
+        call_command('rebuild_activity_rollups', stdout=StringIO())
+        self.assertEqual(self.totals(), rollups)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), ACTIVITY_LOG_MODE='sync')
+class FolderArchiveTests(TestCase):
+    """Folder downloads stream a ZIP of the subtree that zipfile reads back intact."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner@example.com', 'Owner', 'owner', is_active=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.root = Folder.objects.create(name='docs', owner=self.owner)
+        self.sub = Folder.objects.create(name='a/b', owner=self.owner, parent=self.root)
+        Folder.objects.create(name='empty', owner=self.owner, parent=self.root)
+        self.text = b'hello world ' * 1000
+        self.store('notes.txt', self.root, self.text, 'text/plain')
+        self.store('Notes.txt', self.root, b'other', 'text/plain')
+        self.store('photo.jpg', self.sub, b'\xff\xd8' + os.urandom(3000), 'image/jpeg')
+
+    def store(self, name, folder, data, mime_type):
+        file = File(name=name, folder=folder, owner=self.owner, mime_type=mime_type)
+        blobs.attach(file, blobs.ingest_upload(ContentFile(data, name=name))).save()
+        return file
+
+    def download(self):
+        response = self.client.get(f'/api/folders/{self.root.pk}/download/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        return b''.join(response.streaming_content)
+
+    def test_archive_round_trips(self):
+        with zipfile.ZipFile(BytesIO(self.download())) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(sorted(archive.namelist()), [
+                'Notes.txt', 'a_b/', 'a_b/photo.jpg', 'empty/', 'notes (2).txt',
+            ])
+            self.assertEqual(archive.read('notes (2).txt'), self.text)
+            self.assertEqual(archive.read('Notes.txt'), b'other')
+            self.assertEqual(archive.getinfo('notes (2).txt').compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(archive.getinfo('a_b/photo.jpg').compress_type, zipfile.ZIP_STORED)
+            self.assertTrue(archive.getinfo('empty/').is_dir())
+
+        log = ActivityLog.objects.get(folder=self.root)
+        self.assertEqual(log.details, {
+            'format': 'zip', 'file_count': 3, 'total_size': len(self.text) + 5 + 3002, 'completed': True,
+        })
+
+    def test_zip64_records_past_the_classic_limits(self):
+        # Lowered limits stand in for 4 GB entries and 65535 entry archives.
+        with mock.patch.object(zipfile, 'ZIP64_LIMIT', 1024), mock.patch.object(zipfile, 'ZIP_FILECOUNT_LIMIT', 2):
+            data = self.download()
+        self.assertIn(b'PK\x06\x06', data)
+        with zipfile.ZipFile(BytesIO(data)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(len(archive.namelist()), 5)
+            self.assertEqual(archive.read('notes (2).txt'), self.text)
+
+
+@override_settings(INSTRUMENTATION_ENABLED=True, ACTIVITY_LOG_MODE='sync')
+class InstrumentationTests(TestCase):
+    """Instrumented requests are summarized per endpoint at /api/metrics/."""
+
+    def setUp(self):
+        instrumentation.get_samples().clear()
+        self.owner = User.objects.create_user('owner@example.com', 'Owner', 'owner', is_active=True)
+        self.staff = User.objects.create_user('staff@example.com', 'Staff', 'staff', is_active=True, is_staff=True)
+        folder = Folder.objects.create(name='docs', owner=self.owner)
+        for n in range(3):
+            File.objects.create(
+                name=f'{n}.txt', folder=folder, owner=self.owner, file=f'files/{n}', size=1, mime_type='text/plain'
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def metrics(self):
+        self.client.force_authenticate(self.staff)
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode().splitlines()
+
+    def test_requests_are_sampled_and_summarized(self):
+        self.client.get('/api/files/')
+        self.client.get('/api/files/')
+        self.client.get('/api/files/0/')
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+        samples = instrumentation.snapshot()
+        self.assertEqual(
+            [(sample['endpoint'], sample['status']) for sample in samples],
+            [('file-list', 200), ('file-list', 200), ('file-detail', 404), ('metrics', 403)],
+        )
+        self.assertGreater(samples[0]['queries'], 0)
+        self.assertGreater(samples[0]['serialize'], 0)
+        self.assertEqual(samples[0]['size'], len(self.client.get('/api/files/').content))
+
+        lines = self.metrics()
+        self.assertIn('# TYPE bhandar_request_duration_seconds summary', lines)
+        self.assertIn('bhandar_db_queries_count{method="GET",endpoint="file-list"} 3', lines)
+        self.assertIn(f'bhandar_db_queries{{method="GET",endpoint="file-list",quantile="0.5"}} {samples[0]["queries"]}', lines)
+        self.assertIn('bhandar_responses{method="GET",endpoint="file-list",status="200"} 3', lines)
+        self.assertIn('bhandar_responses{method="GET",endpoint="file-detail",status="404"} 1', lines)
+
+    def test_render_metrics_quantiles(self):
+        samples = [
+            {key: float(n) for _, key, _ in instrumentation.METRICS} | {
+                'method': 'GET', 'endpoint': 'file-list', 'status': 200,
+            }
+            for n in range(1, 11)
+        ]
+        lines = instrumentation.render_metrics(samples).splitlines()
+        for line in (
+            'bhandar_response_bytes{method="GET",endpoint="file-list",quantile="0.5"} 6',
+            'bhandar_response_bytes{method="GET",endpoint="file-list",quantile="0.9"} 10',
+            'bhandar_response_bytes{method="GET",endpoint="file-list",quantile="0.99"} 10',
+            'bhandar_response_bytes_sum{method="GET",endpoint="file-list"} 55',
+            'bhandar_response_bytes_count{method="GET",endpoint="file-list"} 10',
+            'bhandar_responses{method="GET",endpoint="file-list",status="200"} 10',
+        ):
+            self.assertIn(line, lines)
+
+    def test_slow_sampled_requests_dump_profiles(self):
+        directory = tempfile.mkdtemp()
+        with self.settings(
+            INSTRUMENTATION_PROFILE_SAMPLE_RATE=1.0, INSTRUMENTATION_SLOW_REQUEST_MS=0,
+            INSTRUMENTATION_PROFILE_DIR=directory,
+        ):
+            self.client.get('/api/files/')
+        [name] = os.listdir(directory)
+        self.assertIn('-GET-file-list-', name)
+        self.assertTrue(name.endswith('ms.prof'))
+
+    @override_settings(INSTRUMENTATION_ENABLED=False)
+    def test_disabled(self):
+        self.client.get('/api/files/')
+        self.assertEqual(instrumentation.snapshot(), [])
+        self.client.force_authenticate(self.staff)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 404)
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'])
+class ReplicaRoutingTests(SimpleTestCase):
+    """Safe requests read from replicas until the client writes."""
+
+    def route(self, request, write=False):
+        router = ReplicaRouter()
+        seen = []
+
+        def view(request):
+            seen.append(router.db_for_read(File))
+            if write:
+                router.db_for_write(File)
+            seen.append(router.db_for_read(File))
+            return HttpResponse()
+
+        response = ReplicaMiddleware(view)(request)
+        return seen, PIN_COOKIE in response.cookies
+
+    def test_reads_follow_writes_to_the_primary(self):
+        factory = RequestFactory()
+        self.assertEqual(self.route(factory.get('/')), (['replica_0', 'replica_0'], False))
+        self.assertEqual(self.route(factory.get('/'), write=True), (['replica_0', 'default'], True))
+        self.assertEqual(self.route(factory.post('/'), write=True), (['default', 'default'], True))
+
+        pinned = factory.get('/')
+        pinned.COOKIES[PIN_COOKIE] = '1'
+        self.assertEqual(self.route(pinned), (['default', 'default'], False))
+        # Outside a request, e.g. in jobs and management commands.
+        self.assertEqual(ReplicaRouter().db_for_read(File), 'default')
+
+    @override_settings(SHARED_CACHE=True)
+    def test_writes_pin_the_user_without_cookies(self):
+        cache.clear()
+        factory = RequestFactory()
+        writer, other = User(pk=1, email='writer@example.com'), User(pk=2, email='other@example.com')
+
+        def as_user(request, user):
+            # What DRF leaves on the request once it has authenticated a bearer token.
+            request.user = user
+            return request
+
+        self.assertEqual(self.route(as_user(factory.post('/'), writer), write=True), (['default', 'default'], True))
+        self.assertEqual(self.route(as_user(factory.get('/'), writer)), (['default', 'default'], False))
+        self.assertEqual(self.route(as_user(factory.get('/'), other)), (['replica_0', 'replica_0'], False))
+        self.assertEqual(self.route(factory.get('/')), (['replica_0', 'replica_0'], False))
+
+        # Other workers would not see the pin in a per-process cache.
+        with override_settings(SHARED_CACHE=False):
+            self.assertEqual(self.route(as_user(factory.get('/'), other)), (['default', 'default'], False))
+            self.assertEqual(self.route(factory.get('/')), (['replica_0', 'replica_0'], False))
@@ -0,0 +1,234 @@
+"""Image thumbnails for files and avatars.
+
+When an image ``File`` or a user avatar is saved, ``schedule_file`` /
+``schedule_avatar`` queue a render on a small pool of worker threads
+(``THUMBNAIL_WORKERS``; ``JOB_BACKEND = "inline"`` renders right after
+commit instead). Every size in ``THUMBNAIL_SIZES`` is written in every format
+in ``THUMBNAIL_FORMATS`` next to the originals, under a name derived from the
+source content, e.g. ``thumbnails/<sha256>/256.webp``. Identical uploads
+share thumbnails and the name doubles as a strong ETag.
+
+Large images are decoded at reduced scale where the codec allows it
+(``Image.draft`` for JPEG) and shrunk with ``reducing_gap``, largest size
+first, each smaller size being derived from the previous one, so memory is
+bounded by the largest thumbnail rather than the original.
+
+A source is queued at most once at a time, however often its thumbnail is
+polled, and concurrent renders replace each file atomically. An image that
+cannot be rendered (unreadable, or over ``THUMBNAIL_MAX_PIXELS``) gets a
+``thumbnails/<sha256>/failed`` marker instead and is not retried, except by
+``backfill_thumbnails --force``.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from .models import File
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+IMAGE_TYPES = {
+    'image/jpeg', 'image/png', 'image/gif', 'image/webp',
+    'image/bmp', 'image/x-ms-bmp', 'image/tiff',
+}
+PIL_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+CONTENT_TYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+QUEUED_KEY = 'thumbnail:queued:{}'
+# Long enough for any render; a render that died is queued again after it.
+QUEUED_TIMEOUT = 10 * 60
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.THUMBNAIL_WORKERS,
+            thread_name_prefix='storage-thumbnail'
+        )
+    return _executor
+
+
+def is_image(mime_type):
+    return (mime_type or '').lower() in IMAGE_TYPES
+
+
+def file_source(file):
+    """Key identifying the content of ``file``; the blob hash when there is one."""
+    if file.blob_id:
+        return file.blob_id
+    return hashlib.sha256(f'file:{file.file.name}:{file.size}'.encode()).hexdigest()
+
+
+def avatar_source(user):
+    return hashlib.sha256(f'avatar:{user.avatar.name}'.encode()).hexdigest()
+
+
+def pick_size(requested):
+    """Smallest configured size covering ``requested``, else the largest."""
+    sizes = sorted(settings.THUMBNAIL_SIZES)
+    for size in sizes:
+        if size >= requested:
+            return size
+    return sizes[-1]
+
+
+def pick_format(requested):
+    formats = settings.THUMBNAIL_FORMATS
+    return requested if requested in formats else formats[0]
+
+
+def thumbnail_name(source, size, fmt):
+    return f'thumbnails/{source}/{size}.{fmt}'
+
+
+def failed_name(source):
+    return f'thumbnails/{source}/failed'
+
+
+def failed(storage, source):
+    return storage.exists(failed_name(source))
+
+
+def write(storage, name, data):
+    """Replace ``name`` atomically, so concurrent renders never see or leave half a file."""
+    path = storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as out:
+        out.write(data)
+    os.replace(tmp_path, path)
+
+
+def etag(source, size, fmt):
+    return f'"{source}-{size}.{fmt}"'
+
+
+def missing(storage, source):
+    return [
+        (size, fmt)
+        for size in settings.THUMBNAIL_SIZES
+        for fmt in settings.THUMBNAIL_FORMATS
+        if not storage.exists(thumbnail_name(source, size, fmt))
+    ]
+
+
+def encode(image, fmt):
+    if fmt == 'jpeg' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    output = BytesIO()
+    image.save(output, PIL_FORMATS[fmt], quality=settings.THUMBNAIL_QUALITY)
+    return output.getvalue()
+
+
+def render(fieldfile, source, force=False):
+    """Write every missing thumbnail of ``fieldfile``; return how many were written."""
+    storage = fieldfile.storage
+    if force:
+        storage.delete(failed_name(source))
+    elif failed(storage, source):
+        return 0
+    wanted = missing(storage, source) if not force else [
+        (size, fmt) for size in settings.THUMBNAIL_SIZES for fmt in settings.THUMBNAIL_FORMATS
+    ]
+    if not wanted:
+        return 0
+    try:
+        rendered = render_sizes(fieldfile, wanted)
+    except (OSError, Image.DecompressionBombError) as e:
+        logger.info('Not rendering thumbnails for %s: %s', fieldfile.name, e)
+        write(storage, failed_name(source), str(e).encode())
+        return 0
+    for (size, fmt), data in rendered.items():
+        write(storage, thumbnail_name(source, size, fmt), data)
+    return len(rendered)
+
+
+def render_sizes(fieldfile, wanted):
+    """Encode the ``wanted`` (size, format) pairs of ``fieldfile``'s image."""
+    sizes = sorted({size for size, _ in wanted}, reverse=True)
+    with fieldfile.open('rb') as original, Image.open(original) as image:
+        if image.width * image.height > settings.THUMBNAIL_MAX_PIXELS:
+            raise Image.DecompressionBombError(
+                f'{image.width}x{image.height} is over THUMBNAIL_MAX_PIXELS'
+            )
+        # JPEG decodes straight to 1/2, 1/4 or 1/8 scale; a no-op for other formats.
+        image.draft('RGB', (sizes[0], sizes[0]))
+        current = ImageOps.exif_transpose(image)
+        if current.mode not in ('RGB', 'RGBA'):
+            current = current.convert('RGBA' if 'transparency' in current.info else 'RGB')
+
+        rendered = {}
+        for size in sizes:
+            current = current.copy()
+            current.thumbnail((size, size), reducing_gap=2.0)
+            for fmt in settings.THUMBNAIL_FORMATS:
+                if (size, fmt) in wanted:
+                    rendered[size, fmt] = encode(current, fmt)
+    return rendered
+
+
+def delete(storage, source):
+    for size in settings.THUMBNAIL_SIZES:
+        for fmt in settings.THUMBNAIL_FORMATS:
+            storage.delete(thumbnail_name(source, size, fmt))
+    storage.delete(failed_name(source))
+
+
+def render_file(file_id, force=False):
+    file = File.objects.filter(pk=file_id).first()
+    if file is None or not is_image(file.mime_type):
+        return 0
+    return render(file.file, file_source(file), force)
+
+
+def render_avatar(user_id, force=False):
+    user = User.objects.filter(pk=user_id).first()
+    if user is None or not user.avatar:
+        return 0
+    return render(user.avatar, avatar_source(user), force)
+
+
+def run_in_thread(func, pk, source):
+    close_old_connections()
+    try:
+        func(pk)
+    except Exception:
+        logger.exception('Rendering thumbnails with %s(%s) failed', func.__name__, pk)
+    finally:
+        cache.delete(QUEUED_KEY.format(source))
+        close_old_connections()
+
+
+def schedule(func, pk, source):
+    def submit():
+        if not cache.add(QUEUED_KEY.format(source), True, QUEUED_TIMEOUT):
+            return
+        if settings.JOB_BACKEND == 'inline':
+            run_in_thread(func, pk, source)
+        else:
+            get_executor().submit(run_in_thread, func, pk, source)
+
+    transaction.on_commit(submit)
+
+
+def schedule_file(file):
+    if is_image(file.mime_type):
+        schedule(render_file, file.pk, file_source(file))
+
+
+def schedule_avatar(user):
+    if user.avatar:
+        schedule(render_avatar, user.pk, avatar_source(user))
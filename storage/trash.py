@@ -0,0 +1,107 @@
+"""Trash.
+
+Deleting a file or folder through the API moves it to the trash: it gets a
+``trashed_at`` time and disappears from every queryset, because
+``File.objects`` and ``Folder.objects`` only return live rows
+(``all_objects`` returns everything). Trashing a folder stamps its whole
+live subtree with the same time, one indexed ``UPDATE`` per table whatever
+its size. Restoring clears the stamp from rows carrying that time, so items
+that were trashed on their own before stay in the trash.
+
+Trashed items keep their blobs, shares and links and still count towards
+the owner's quota. ``purge_trash`` deletes them for good, in batches, once
+they have been in the trash for ``TRASH_RETENTION_DAYS``.
+
+Trashing and restoring also touch ``updated_at`` on every row they change:
+listing validators (see ``storage.conditional``) only see counts and the
+newest ``updated_at``, which trashing one item and restoring another would
+otherwise leave as they were.
+
+Only the trashed or restored item itself is written to the change journal;
+sync clients drop or list its contents along with it.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from . import journal, links, permissions, signed
+from .models import ChangeAction, File, Folder
+
+
+class RestoreConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Cannot restore this item.'
+    default_code = 'restore_conflict'
+
+
+def trash_file(file):
+    with transaction.atomic():
+        now = timezone.now()
+        File.objects.filter(pk=file.pk).update(trashed_at=now, updated_at=now)
+        journal.record([journal.file_change(file, ChangeAction.DELETE, journal.file_path(file))])
+    links.invalidate_targets(file=file)
+    signed.revoke(files=[file.pk])
+
+
+def trash_folder(folder):
+    now = timezone.now()
+    with transaction.atomic():
+        Folder.objects.filter(path__startswith=folder.path).update(trashed_at=now, updated_at=now)
+        File.objects.filter(folder__path__startswith=folder.path).update(trashed_at=now, updated_at=now)
+        journal.record([journal.folder_change(folder, ChangeAction.DELETE, folder.path)])
+    # Cached permissions and links for the whole subtree are now wrong.
+    permissions.invalidate_all()
+    signed.revoke(folders=[folder.pk])
+
+
+def restore_file(file):
+    if file.folder_id is not None and file.folder.trashed_at is not None:
+        raise RestoreConflict('The folder this file was in is in the trash; restore it first.')
+    try:
+        with transaction.atomic():
+            now = timezone.now()
+            File.all_objects.filter(pk=file.pk).update(trashed_at=None, updated_at=now)
+            file.trashed_at, file.updated_at = None, now
+            journal.record([journal.file_change(file, ChangeAction.CREATE, journal.file_path(file))])
+    except IntegrityError:
+        raise RestoreConflict('A file with this name already exists.')
+    links.invalidate_targets(file=file)
+
+
+def restore_folder(folder):
+    if folder.parent_id is not None and folder.parent.trashed_at is not None:
+        raise RestoreConflict('The parent folder is in the trash; restore it first.')
+    try:
+        with transaction.atomic():
+            now = timezone.now()
+            Folder.all_objects.filter(
+                path__startswith=folder.path, trashed_at=folder.trashed_at
+            ).update(trashed_at=None, updated_at=now)
+            File.all_objects.filter(
+                folder__path__startswith=folder.path, trashed_at=folder.trashed_at
+            ).update(trashed_at=None, updated_at=now)
+            folder.trashed_at, folder.updated_at = None, now
+            journal.record([journal.folder_change(folder, ChangeAction.CREATE, folder.path)])
+    except IntegrityError:
+        raise RestoreConflict('A folder with this name already exists.')
+    permissions.invalidate_all()
+
+
+def trashed_files(user):
+    """Files ``user`` owns that were trashed on their own, not with their folder."""
+    return File.all_objects.filter(owner=user, trashed_at__isnull=False).filter(
+        Q(folder__isnull=True) |
+        Q(folder__trashed_at__isnull=True) |
+        ~Q(folder__trashed_at=F('trashed_at'))
+    )
+
+
+def trashed_folders(user):
+    """Folders ``user`` owns that were trashed on their own, not with their parent."""
+    return Folder.all_objects.filter(owner=user, trashed_at__isnull=False).filter(
+        Q(parent__isnull=True) |
+        Q(parent__trashed_at__isnull=True) |
+        ~Q(parent__trashed_at=F('trashed_at'))
+    )
@@ -0,0 +1,127 @@
+"""Chunked, resumable upload sessions.
+
+Chunks are streamed from the request body straight into
+``MEDIA_ROOT/uploads/<session uuid>/`` and only concatenated into a blob on
+commit, so memory per upload is bounded by ``COPY_BUFFER_SIZE`` no matter
+how large the file is.
+"""
+import mimetypes
+import os
+import shutil
+import uuid
+
+from django.conf import settings
+
+from . import blobs
+
+COPY_BUFFER_SIZE = 64 * 1024
+PART_SUFFIX = '.part'
+
+
+class ChunkError(Exception):
+    pass
+
+
+def uploads_root():
+    return os.path.join(settings.MEDIA_ROOT, 'uploads')
+
+
+def session_dir(session):
+    return os.path.join(uploads_root(), str(session.uuid))
+
+
+def chunk_path(session, index):
+    return os.path.join(session_dir(session), f'{index:08d}{PART_SUFFIX}')
+
+
+def write_chunk(session, index, stream):
+    """Stream one chunk to disk, replacing any previous copy atomically."""
+    if not 0 <= index < session.total_chunks:
+        raise ChunkError(f'Chunk index must be between 0 and {session.total_chunks - 1}.')
+
+    expected = session.chunk_length(index)
+    os.makedirs(session_dir(session), exist_ok=True)
+    target = chunk_path(session, index)
+    tmp = f'{target}.{uuid.uuid4().hex}.tmp'
+    written = 0
+    try:
+        with open(tmp, 'wb') as out:
+            while stream is not None:
+                # Ask for one byte more than we need so oversized chunks are caught.
+                block = stream.read(min(COPY_BUFFER_SIZE, expected - written + 1))
+                if not block:
+                    break
+                written += len(block)
+                if written > expected:
+                    raise ChunkError(f'Chunk {index} must be exactly {expected} bytes.')
+                out.write(block)
+        if written != expected:
+            raise ChunkError(f'Chunk {index} must be exactly {expected} bytes, got {written}.')
+        os.replace(tmp, target)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return written
+
+
+def received_chunks(session):
+    """Return the sorted indexes of the chunks that are fully on disk."""
+    try:
+        names = os.listdir(session_dir(session))
+    except FileNotFoundError:
+        return []
+    return sorted(
+        int(name[:-len(PART_SUFFIX)])
+        for name in names
+        if name.endswith(PART_SUFFIX)
+    )
+
+
+def received_ranges(session):
+    """Collapse received chunk indexes into inclusive ``[start, end]`` ranges."""
+    ranges = []
+    for index in received_chunks(session):
+        if ranges and ranges[-1][1] == index - 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+    return ranges
+
+
+def missing_chunks(session):
+    received = set(received_chunks(session))
+    return [
+        index for index in range(session.total_chunks)
+        if index not in received
+        or os.path.getsize(chunk_path(session, index)) != session.chunk_length(index)
+    ]
+
+
+def guess_mime_type(session):
+    if session.mime_type:
+        return session.mime_type
+    mime_type, _ = mimetypes.guess_type(session.name)
+    return mime_type or 'application/octet-stream'
+
+
+def assemble(session, instance):
+    """Concatenate the chunks into a blob and point ``instance`` at it.
+
+    The chunks are read once, in order, and hashed on the way into the blob
+    store; if the content is already stored the new copy is dropped.
+    """
+    with blobs.BlobWriter() as writer:
+        for index in range(session.total_chunks):
+            with open(chunk_path(session, index), 'rb') as part:
+                while block := part.read(COPY_BUFFER_SIZE):
+                    writer.write(block)
+        blob = writer.commit()
+
+    blobs.attach(instance, blob)
+    instance.mime_type = guess_mime_type(session)
+    return instance
+
+
+def discard(session):
+    shutil.rmtree(session_dir(session), ignore_errors=True)
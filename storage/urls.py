@@ -1,7 +1,26 @@
 from django.urls import path
+from rest_framework.routers import DefaultRouter
 from . import views
 
+router = DefaultRouter()
+router.register('files', views.FileViewSet, basename='file')
+router.register('folders', views.FolderViewSet, basename='folder')
+router.register('uploads', views.UploadSessionViewSet, basename='upload')
+router.register('activity', views.ActivityLogViewSet, basename='activity')
+router.register('jobs', views.JobViewSet, basename='job')
+router.register('trash/files', views.TrashedFileViewSet, basename='trashed-file')
+router.register('trash/folders', views.TrashedFolderViewSet, basename='trashed-folder')
+
 urlpatterns = [
-    path('share//', views.PublicShareView.as_view(), name='public-share'),
-    path('share//download/', views.PublicDownloadView.as_view(), name='public-download'),
-]
\ No newline at end of file
+    path('share/<uuid:uuid>/', views.PublicShareView.as_view(), name='public-share'),
+    path('share/<uuid:uuid>/download/', views.PublicDownloadView.as_view(), name='public-download'),
+    path('share/<uuid:uuid>/signed-url/', views.PublicSignedUrlView.as_view(), name='public-signed-url'),
+    path('dl/<str:token>/', views.SignedDownloadView.as_view(), name='signed-download'),
+    path('avatars/<int:user_id>/thumbnail/', views.AvatarThumbnailView.as_view(), name='avatar-thumbnail'),
+    path('search/', views.SearchView.as_view(), name='search'),
+    path('changes/', views.ChangesView.as_view(), name='changes'),
+    path('usage/', views.UsageView.as_view(), name='usage'),
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
+    path('activity/stats/', views.ActivityStatsView.as_view(), name='activity-stats'),
+    path('permissions/', views.EffectivePermissionsView.as_view(), name='effective-permissions'),
+] + router.urls
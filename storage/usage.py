@@ -0,0 +1,137 @@
+"""Per-user storage usage and quotas.
+
+``StorageUsage`` holds each user's byte and file totals, and
+``StorageUsageByType`` the same split by MIME class. Both are adjusted by
+``add`` from the ``File`` signals on create, delete, content replacement
+and owner changes, so reading usage never scans files. ``reconcile_usage``
+rebuilds them from the ``File`` table if they ever drift.
+
+``check`` raises ``QuotaExceeded`` when storing ``size`` more bytes would
+take a user past their quota. Bytes promised to active upload sessions count
+as used, so parallel sessions cannot jointly overrun it.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .models import StorageUsage, StorageUsageByType, UploadSession, UploadStatus
+
+MIME_CLASSES = (
+    ('image', ('image/',)),
+    ('video', ('video/',)),
+    ('audio', ('audio/',)),
+    ('archive', (
+        'application/zip', 'application/gzip', 'application/x-gzip', 'application/x-tar',
+        'application/x-bzip2', 'application/x-xz', 'application/x-7z-compressed',
+        'application/x-rar-compressed', 'application/vnd.rar', 'application/zstd',
+    )),
+    ('document', (
+        'text/', 'application/pdf', 'application/msword', 'application/rtf',
+        'application/vnd.openxmlformats-officedocument.', 'application/vnd.oasis.opendocument.',
+        'application/vnd.ms-', 'application/json', 'application/xml',
+    )),
+)
+OTHER = 'other'
+
+
+class QuotaExceeded(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Storage quota exceeded.'
+    default_code = 'quota_exceeded'
+
+
+def mime_class(mime_type):
+    mime_type = (mime_type or '').lower()
+    for name, prefixes in MIME_CLASSES:
+        if mime_type.startswith(prefixes):
+            return name
+    return OTHER
+
+
+def increment(model, lookup, bytes_delta, count_delta, **extra):
+    changes = {
+        'bytes_used': F('bytes_used') + bytes_delta,
+        'file_count': F('file_count') + count_delta,
+        **extra,
+    }
+    if not model.objects.filter(**lookup).update(**changes):
+        model.objects.bulk_create([model(**lookup)], ignore_conflicts=True)
+        model.objects.filter(**lookup).update(**changes)
+
+
+def add(user_id, mime_type, bytes_delta, count_delta):
+    """Apply a change in stored bytes/files to ``user_id``'s counters."""
+    if not user_id or not (bytes_delta or count_delta):
+        return
+    with transaction.atomic():
+        increment(
+            StorageUsage, {'user_id': user_id}, bytes_delta, count_delta,
+            updated_at=timezone.now()
+        )
+        increment(
+            StorageUsageByType, {'user_id': user_id, 'mime_class': mime_class(mime_type)},
+            bytes_delta, count_delta
+        )
+
+
+def get_usage(user):
+    return StorageUsage.objects.filter(user=user).first() or StorageUsage(user=user)
+
+
+def quota_for(usage):
+    if usage.quota is not None:
+        return usage.quota
+    return settings.STORAGE_DEFAULT_QUOTA or None
+
+
+def reserved(user):
+    """Bytes promised to upload sessions that have not been committed yet."""
+    return UploadSession.objects.filter(
+        owner=user, status=UploadStatus.ACTIVE, expires_at__gt=timezone.now()
+    ).aggregate(total=Sum('size', default=0))['total']
+
+
+def available(user, usage=None):
+    """Bytes ``user`` may still store, or None without a quota."""
+    usage = usage or get_usage(user)
+    quota = quota_for(usage)
+    if quota is None:
+        return None
+    return max(quota - usage.bytes_used - reserved(user), 0)
+
+
+def check(user, size):
+    if size <= 0:
+        return
+    remaining = available(user)
+    if remaining is not None and size > remaining:
+        raise QuotaExceeded(
+            f'Storing {size} bytes would exceed your quota; {remaining} bytes are available.'
+        )
+
+
+def check_request(request, user=None, already_stored=0):
+    """Reject a request by its Content-Length before the body is read."""
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return
+    # Allow for multipart boundaries and the other form fields.
+    check(user or request.user, length - settings.STORAGE_QUOTA_REQUEST_SLACK - already_stored)
+
+
+def summary(user):
+    usage = get_usage(user)
+    return {
+        'bytes_used': usage.bytes_used,
+        'file_count': usage.file_count,
+        'quota': quota_for(usage),
+        'available': available(user, usage),
+        'by_type': {
+            row.mime_class: {'bytes_used': row.bytes_used, 'file_count': row.file_count}
+            for row in StorageUsageByType.objects.filter(user=user).order_by('mime_class')
+        },
+    }
@@ -1,63 +1,315 @@
-from django.db.models import Q
-from rest_framework import viewsets, status
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+)
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.http import content_disposition_header, parse_etags
+from django.views import View
+from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
-from .models import ActivityType, ShareLink, Folder
-from .serializers import ShareLinkSerializer, FolderSerializer
+from rest_framework.permissions import SAFE_METHODS, AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.views import APIView
+from .models import (
+    ActivityLog, ActivityRollup, ActivityType, Folder, File,
+    Job, SharePermission, UploadSession, UploadStatus
+)
+from .serializers import (
+    ShareLinkSerializer, FolderSerializer, FolderShareSerializer,
+    FileSerializer, FileShareSerializer, PublicShareSerializer, UploadSessionSerializer,
+    BlobPrecheckSerializer, BulkShareSerializer, JobSerializer, ActivityLogSerializer,
+    FolderCopySerializer, TrashedFileSerializer, TrashedFolderSerializer
+)
+from . import (
+    activity, archives, blobs, conditional, downloads, instrumentation, jobs, journal, links, permissions,
+    search, sharing, signed, thumbnails, trash, uploads, usage
+)
+from .fieldsets import FieldSelection
+
+User = get_user_model()
+
+def folder_archive_response(request, folder, resolver):
+    """Stream ``folder`` as a ZIP and log one DOWNLOAD for the whole archive."""
+    def on_close(archive, completed):
+        activity.record(
+            request,
+            ActivityType.DOWNLOAD,
+            folder=folder,
+            details={
+                'format': 'zip',
+                'file_count': archive.file_count,
+                'total_size': archive.total_size,
+                'completed': completed,
+            }
+        )
+
+    response = StreamingHttpResponse(
+        archives.stream_folder(folder, resolver, on_close),
+        content_type='application/zip'
+    )
+    response['Content-Disposition'] = content_disposition_header(True, f'{folder.name}.zip')
+    return response
+
+
+def thumbnail_response(request, fieldfile, source):
+    """Serve a rendered thumbnail, or 202 while it is still being rendered."""
+    try:
+        size = thumbnails.pick_size(int(request.query_params.get('size', 256)))
+    except ValueError:
+        size = thumbnails.pick_size(256)
+    # Not ``format``: DRF reserves that for content negotiation.
+    fmt = thumbnails.pick_format(request.query_params.get('type', ''))
+    etag = thumbnails.etag(source, size, fmt)
+
+    # The name is derived from the content, so a matching tag is never stale.
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        name = thumbnails.thumbnail_name(source, size, fmt)
+        if not fieldfile.storage.exists(name):
+            return None
+        response = FileResponse(fieldfile.storage.open(name), content_type=thumbnails.CONTENT_TYPES[fmt])
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    response['Vary'] = 'Authorization'
+    return response
+
+
+def signed_downloads_disabled():
+    # Revocations need a cache every worker sees; see storage.signed.
+    return Response({'error': 'signed downloads are not enabled'}, status=status.HTTP_501_NOT_IMPLEMENTED)
+
+
+def thumbnail_failed():
+    return Response(
+        {'error': 'no thumbnail can be rendered for this image'},
+        status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+    )
+
+
+def thumbnail_pending():
+    response = Response({'status': 'pending'}, status=status.HTTP_202_ACCEPTED)
+    response['Retry-After'] = '1'
+    return response
+
 
 class SharePermissionMixin:
     def check_object_permissions(self, request, obj):
         super().check_object_permissions(request, obj)
-        if request.method in ['PUT', 'PATCH', 'DELETE']:
-            if obj.owner != request.user:
-                share = obj.shared_users.through.objects.filter(
-                    user=request.user,
-                    **{f'{obj._meta.model_name.lower()}': obj}
-                ).first()
-                if not share or share.permission not in ['EDIT', 'ADMIN']:
-                    self.permission_denied(request)
+        if request.method in SAFE_METHODS:
+            required = SharePermission.VIEW
+        else:
+            required = SharePermission.EDIT
+        self.require_permission(obj, required)
+
+    def require_permission(self, obj, required):
+        if not permissions.get_resolver(self.request).has(obj, required):
+            self.permission_denied(self.request)
+
+class ConditionalMixin:
+    """Answer ``If-None-Match`` on list and retrieve before serializing anything."""
+    eager_loading = True
+
+    def related_querysets(self, queryset):
+        """Nested rows rendered along with ``queryset``; their changes change the ETag."""
+        return []
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        etag = conditional.listing_etag(request, queryset, *self.related_querysets(queryset))
+        response = conditional.not_modified(request, etag)
+        if response is not None:
+            return response
+        return conditional.set_headers(super().list(request, *args, **kwargs), etag)
+
+    def retrieve(self, request, *args, **kwargs):
+        # Relations are only prefetched once the response is known to be needed.
+        self.eager_loading = False
+        try:
+            instance = self.get_object()
+        finally:
+            self.eager_loading = True
+        queryset = type(instance).objects.filter(pk=instance.pk)
+        etag = conditional.object_etag(request, instance, *self.related_querysets(queryset))
+        response = conditional.not_modified(request, etag, instance.updated_at)
+        if response is not None:
+            return response
+        response = super().retrieve(request, *args, **kwargs)
+        return conditional.set_headers(response, etag, instance.updated_at)
+
 
 class BulkShareMixin:
+    @action(detail=True, methods=['get'])
+    def shares(self, request, pk=None):
+        """Users this item is shared with, newest share first."""
+        item = self.get_object()
+        field = self.share_model_field
+        shares = sharing.SHARE_MODELS[field].objects.filter(**{field: item}).select_related('user')
+        self.cursor_fields = ('created_at', 'id')
+        page = self.paginate_queryset(shares)
+        serializer_class = FileShareSerializer if field == 'file' else FolderShareSerializer
+        return self.get_paginated_response(
+            serializer_class(page, many=True, context=self.get_serializer_context()).data
+        )
+
     @action(detail=False, methods=['post'])
     def bulk_share(self, request):
-        items = request.data.get('items', [])
-        users = request.data.get('users', [])
-        permission = request.data.get('permission', 'VIEW')
-        expires_at = request.data.get('expires_at')
-
-        share_results = []
-        for item_id in items:
-            item = self.queryset.get(id=item_id)
-            for user_id in users:
-                try:
-                    share = item.shared_users.through.objects.create(
-                        **{self.share_model_field: item},
-                        user_id=user_id,
-                        permission=permission,
-                        expires_at=expires_at
-                    )
-                    share_results.append({
-                        'item_id': item_id,
-                        'user_id': user_id,
-                        'status': 'success'
-                    })
-                except Exception as e:
-                    share_results.append({
-                        'item_id': item_id,
-                        'user_id': user_id,
-                        'status': 'error',
-                        'message': str(e)
-                    })
+        serializer = BulkShareSerializer(
+            data=request.data,
+            context={'request': request, 'model': self.share_model}
+        )
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        field = self.share_model_field
+        pairs = len(data['items']) * len(data['user_ids'])
+
+        if request.data.get('background') or pairs > settings.BULK_SHARE_SYNC_LIMIT:
+            job = jobs.submit('bulk_share', request.user, {
+                'field': field,
+                'items': data['items'],
+                'users': data['user_ids'],
+                'permission': data['permission'],
+                'expires_at': data['expires_at'].isoformat() if data.get('expires_at') else None,
+                'activity_data': request.activity_data,
+            }, total=pairs)
+            return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
 
+        share_results = sharing.share_many(
+            field,
+            data['items'],
+            data['user_ids'],
+            data['permission'],
+            data.get('expires_at'),
+            request.user,
+            request.activity_data,
+        )
         return Response(share_results)
 
-class FileViewSet(BulkShareMixin, SharePermissionMixin, viewsets.ModelViewSet):
+class FileViewSet(ConditionalMixin, BulkShareMixin, SharePermissionMixin, viewsets.ModelViewSet):
+    permission_classes = [IsAuthenticated]
+    serializer_class = FileSerializer
+    share_model = File
     share_model_field = 'file'
 
+    def get_queryset(self):
+        files = permissions.accessible_files(self.request.user).select_related('folder')
+        if not self.eager_loading:
+            return files
+        return FileSerializer.setup_eager_loading(files, FieldSelection.from_request(self.request))
+
+    def create(self, request, *args, **kwargs):
+        # Before request.data is touched, so an oversized body is never parsed.
+        usage.check_request(request)
+        return super().create(request, *args, **kwargs)
+
+    def update(self, request, *args, **kwargs):
+        file = self.get_object()
+        usage.check_request(request, file.owner, file.size)
+        return super().update(request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        upload = serializer.validated_data['file']
+        usage.check(self.request.user, upload.size)
+        blob = blobs.ingest_upload(upload, blobs.upload_digest(self.request, 'file'))
+        serializer.save(
+            owner=self.request.user,
+            blob=blob,
+            file=blob.file.name,
+            size=blob.size,
+            mime_type=upload.content_type or 'application/octet-stream'
+        )
+
+    def perform_update(self, serializer):
+        upload = serializer.validated_data.get('file')
+        if upload is None:
+            serializer.save()
+            return
+        usage.check(serializer.instance.owner, upload.size - serializer.instance.size)
+        blob = blobs.ingest_upload(upload, blobs.upload_digest(self.request, 'file'))
+        serializer.save(
+            blob=blob,
+            file=blob.file.name,
+            size=blob.size,
+            mime_type=upload.content_type or 'application/octet-stream'
+        )
+
+    @action(detail=False, methods=['post'])
+    def precheck(self, request):
+        """Create a file from content the caller already stored, without uploading it."""
+        serializer = BlobPrecheckSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        blob = blobs.existing(data['sha256'], data['size'], owner=request.user)
+        if blob is None:
+            return Response({'exists': False})
+        usage.check(request.user, blob.size)
+
+        file = File(name=data['name'], folder=data.get('folder'), owner=request.user)
+        blobs.attach(file, blob)
+        file.mime_type = data.get('mime_type') or 'application/octet-stream'
+        try:
+            file.save()
+        except IntegrityError:
+            return Response(
+                {'error': 'a file with this name already exists'},
+                status=status.HTTP_409_CONFLICT
+            )
+        return Response(
+            {'exists': True, 'file': FileSerializer(file, context={'request': request}).data},
+            status=status.HTTP_201_CREATED
+        )
+
+    def perform_destroy(self, instance):
+        trash.trash_file(instance)
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        return downloads.serve_file(request, self.get_object())
+
+    @action(detail=True, methods=['get'])
+    def signed_url(self, request, pk=None):
+        """A short-lived URL that downloads the file without authentication."""
+        if not signed.enabled():
+            return signed_downloads_disabled()
+        allow_ranges = request.query_params.get('ranges') != 'false'
+        if not allow_ranges and not signed.enforces_ranges():
+            return Response(
+                {'error': 'signed URLs served by nginx always allow ranges'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        url, expires_at = signed.mint(
+            request, self.get_object(),
+            allow_ranges=allow_ranges,
+            as_attachment=request.query_params.get('inline') != 'true',
+        )
+        return Response({'url': url, 'expires_at': expires_at})
+
+    @action(detail=True, methods=['get'])
+    def thumbnail(self, request, pk=None):
+        file = self.get_object()
+        if not thumbnails.is_image(file.mime_type):
+            return Response({'error': 'file is not an image'}, status=status.HTTP_404_NOT_FOUND)
+        source = thumbnails.file_source(file)
+        response = thumbnail_response(request, file.file, source)
+        if response is None:
+            if thumbnails.failed(file.file.storage, source):
+                return thumbnail_failed()
+            thumbnails.schedule_file(file)
+            return thumbnail_pending()
+        return response
+
     @action(detail=True, methods=['post'])
     def create_share_link(self, request, pk=None):
         file = self.get_object()
+        self.require_permission(file, SharePermission.ADMIN)
         serializer = ShareLinkSerializer(data=request.data)
         
         if serializer.is_valid():
@@ -66,12 +318,10 @@ class FileViewSet(BulkShareMixin, SharePermissionMixin, viewsets.ModelViewSet):
                 created_by=request.user
             )
             
-            ActivityLog.objects.create(
-                user=request.user,
+            activity.record(
+                request,
+                ActivityType.SHARE,
                 file=file,
-                activity_type=ActivityType.SHARE,
-                ip_address=request.activity_data['ip_address'],
-                user_agent=request.activity_data['user_agent'],
                 details={'share_link_id': share_link.id}
             )
             
@@ -81,6 +331,7 @@ class FileViewSet(BulkShareMixin, SharePermissionMixin, viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def revoke_share(self, request, pk=None):
         file = self.get_object()
+        self.require_permission(file, SharePermission.ADMIN)
         user_id = request.data.get('user_id')
         
         share = file.fileshare_set.filter(user_id=user_id).first()
@@ -88,34 +339,577 @@ class FileViewSet(BulkShareMixin, SharePermissionMixin, viewsets.ModelViewSet):
             share.is_active = False
             share.save()
             
-            ActivityLog.objects.create(
-                user=request.user,
+            activity.record(
+                request,
+                ActivityType.UNSHARE,
                 file=file,
-                activity_type=ActivityType.UNSHARE,
-                ip_address=request.activity_data['ip_address'],
-                user_agent=request.activity_data['user_agent'],
                 details={'revoked_user_id': user_id}
             )
             
             return Response({'status': 'share revoked'})
         return Response({'error': 'share not found'}, status=404)
     
-class FolderViewSet(SharePermissionMixin, viewsets.ModelViewSet):
+class FolderViewSet(ConditionalMixin, BulkShareMixin, SharePermissionMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     serializer_class = FolderSerializer
+    share_model = Folder
+    share_model_field = 'folder'
 
     def get_queryset(self):
-        return Folder.objects.filter(
-            Q(owner=self.request.user) |
-            Q(shared_users=self.request.user)
-        ).distinct()
+        folders = permissions.accessible_folders(self.request.user)
+        if not self.eager_loading:
+            return folders
+        return FolderSerializer.setup_eager_loading(folders, FieldSelection.from_request(self.request))
+
+    def related_querysets(self, queryset):
+        if not FieldSelection.from_request(self.request).includes('files', nested=True):
+            return []
+        return [File.objects.filter(folder__in=queryset.values('pk'))]
+
+    def perform_create(self, serializer):
+        serializer.save(owner=self.request.user)
+
+    def update(self, request, *args, **kwargs):
+        """Apply field changes now; a new parent is applied by a ``move_folder`` job."""
+        partial = kwargs.pop('partial', False)
+        folder = self.get_object()
+        serializer = self.get_serializer(folder, data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        parent = serializer.validated_data.pop('parent', folder.parent)
+        if parent != folder.parent and Folder.objects.filter(
+            name=serializer.validated_data.get('name', folder.name), parent=parent, owner=folder.owner
+        ).exists():
+            return Response(
+                {'error': 'a folder with this name already exists'},
+                status=status.HTTP_409_CONFLICT
+            )
+        self.perform_update(serializer)
+        if parent == folder.parent:
+            return Response(serializer.data)
+        job = jobs.submit('move_folder', request.user, {
+            'folder': folder.pk,
+            'parent': parent.pk if parent else None,
+        }, total=1)
+        return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    def perform_destroy(self, instance):
+        trash.trash_folder(instance)
+
+    @action(detail=True, methods=['post'])
+    def copy(self, request, pk=None):
+        """Copy the folder and everything in it with a ``copy_folder`` job."""
+        folder = self.get_object()
+        serializer = FolderCopySerializer(
+            data=request.data, context={'request': request, 'folder': folder}
+        )
+        serializer.is_valid(raise_exception=True)
+        parent = serializer.validated_data.get('parent')
+        name = serializer.validated_data.get('name') or folder.name
+        if Folder.objects.filter(name=name, parent=parent, owner=request.user).exists():
+            return Response(
+                {'error': 'a folder with this name already exists'},
+                status=status.HTTP_409_CONFLICT
+            )
+        usage.check(request.user, folder.subtree_stats()['total_size'])
+        job = jobs.submit('copy_folder', request.user, {
+            'folder': folder.pk,
+            'parent': parent.pk if parent else None,
+            'name': name,
+        })
+        return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['get'])
+    def breadcrumbs(self, request, pk=None):
+        folder = self.get_object()
+        return Response(list(folder.ancestors().values('id', 'name')))
+
+    @action(detail=True, methods=['get'])
+    def descendants(self, request, pk=None):
+        folder = self.get_object()
+        return Response(list(
+            folder.descendants().order_by('path').values('id', 'name', 'parent', 'depth')
+        ))
+
+    @action(detail=True, methods=['get'])
+    def size(self, request, pk=None):
+        folder = self.get_object()
+        return Response({
+            'folder_count': folder.descendants().count(),
+            **folder.subtree_stats()
+        })
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        folder = self.get_object()
+        return folder_archive_response(request, folder, permissions.get_resolver(request))
 
     @action(detail=True, methods=['post'])
     def share(self, request, pk=None):
         folder = self.get_object()
-        serializer = FolderShareSerializer(data=request.data)
+        self.require_permission(folder, SharePermission.ADMIN)
+        serializer = FolderShareSerializer(data=request.data, context={'request': request})
         
         if serializer.is_valid():
             serializer.save(folder=folder)
             return Response(serializer.data)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class UploadSessionViewSet(mixins.CreateModelMixin,
+                           mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin,
+                           viewsets.GenericViewSet):
+    """Resumable uploads: create a session, PUT chunks, then commit."""
+    permission_classes = [IsAuthenticated]
+    serializer_class = UploadSessionSerializer
+    lookup_field = 'uuid'
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(owner=self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.save(
+            owner=self.request.user,
+            expires_at=timezone.now() + settings.UPLOAD_SESSION_TTL
+        )
+
+    def perform_destroy(self, instance):
+        uploads.discard(instance)
+        instance.delete()
+
+    def get_active_session(self):
+        session = self.get_object()
+        if session.status != UploadStatus.ACTIVE or session.is_expired():
+            self.permission_denied(self.request, message='Upload session is no longer active.')
+        return session
+
+    @action(detail=True, methods=['put'], url_path=r'chunks/(?P<index>\d+)')
+    def chunk(self, request, uuid=None, index=None):
+        session = self.get_active_session()
+        # Read the raw body stream; touching request.data would buffer the chunk.
+        try:
+            written = uploads.write_chunk(session, int(index), request.stream)
+        except uploads.ChunkError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        UploadSession.objects.filter(pk=session.pk).update(
+            updated_at=timezone.now(),
+            expires_at=timezone.now() + settings.UPLOAD_SESSION_TTL
+        )
+        return Response({'index': int(index), 'size': written})
+
+    @action(detail=True, methods=['post'])
+    def commit(self, request, uuid=None):
+        session = self.get_active_session()
+        missing = uploads.missing_chunks(session)
+        if missing:
+            return Response(
+                {'error': 'upload incomplete', 'missing': missing},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        file = File(name=session.name, folder=session.folder, owner=request.user)
+        try:
+            with transaction.atomic():
+                # Taking the session first makes a concurrent commit of it fail
+                # here instead of creating a second file.
+                if not UploadSession.objects.filter(
+                    pk=session.pk, status=UploadStatus.ACTIVE
+                ).update(status=UploadStatus.COMMITTED, updated_at=timezone.now()):
+                    return Response(
+                        {'error': 'upload is already being committed'},
+                        status=status.HTTP_409_CONFLICT
+                    )
+                # No longer reserved, the session's bytes are checked like any other write.
+                usage.check(request.user, session.size)
+                uploads.assemble(session, file)
+                file.save()
+                session.status = UploadStatus.COMMITTED
+                session.file = file
+                session.save()
+        except IntegrityError:
+            # The unreferenced blob is left for gc_blobs to reclaim.
+            return Response(
+                {'error': 'a file with this name already exists'},
+                status=status.HTTP_409_CONFLICT
+            )
+        uploads.discard(session)
+
+        activity.record(
+            request,
+            ActivityType.UPLOAD,
+            file=file,
+            details={'upload_session': str(session.uuid), 'size': file.size}
+        )
+        return Response(
+            FileSerializer(file, context={'request': request}).data,
+            status=status.HTTP_201_CREATED
+        )
+
+
+class TrashedFileViewSet(mixins.ListModelMixin,
+                         mixins.RetrieveModelMixin,
+                         mixins.DestroyModelMixin,
+                         viewsets.GenericViewSet):
+    """Files the caller has trashed: restore them, or delete them for good."""
+    permission_classes = [IsAuthenticated]
+    serializer_class = TrashedFileSerializer
+    cursor_fields = ('trashed_at', 'id')
+
+    def get_queryset(self):
+        return TrashedFileSerializer.setup_eager_loading(
+            trash.trashed_files(self.request.user).select_related('folder'),
+            FieldSelection.from_request(self.request)
+        )
+
+    @action(detail=True, methods=['post'])
+    def restore(self, request, pk=None):
+        file = self.get_object()
+        trash.restore_file(file)
+        return Response(FileSerializer(file, context=self.get_serializer_context()).data)
+
+
+class TrashedFolderViewSet(mixins.ListModelMixin,
+                           mixins.RetrieveModelMixin,
+                           viewsets.GenericViewSet):
+    """Folders the caller has trashed: restore them, or delete them for good."""
+    permission_classes = [IsAuthenticated]
+    serializer_class = TrashedFolderSerializer
+    cursor_fields = ('trashed_at', 'id')
+
+    def get_queryset(self):
+        return TrashedFolderSerializer.setup_eager_loading(
+            trash.trashed_folders(self.request.user),
+            FieldSelection.from_request(self.request)
+        )
+
+    def destroy(self, request, pk=None):
+        """Delete the folder and everything in it with a ``delete_folder`` job."""
+        folder = self.get_object()
+        job = jobs.submit('delete_folder', request.user, {'folder': folder.pk})
+        return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['post'])
+    def restore(self, request, pk=None):
+        folder = self.get_object()
+        trash.restore_folder(folder)
+        return Response(FolderSerializer(folder, context=self.get_serializer_context()).data)
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Poll the progress of background jobs started by the caller."""
+    permission_classes = [IsAuthenticated]
+    serializer_class = JobSerializer
+    lookup_field = 'uuid'
+    cursor_fields = ('created_at', 'id')
+
+    def get_queryset(self):
+        return Job.objects.filter(created_by=self.request.user).order_by('-created_at')
+
+
+class ActivityLogViewSet(viewsets.ReadOnlyModelViewSet):
+    """The caller's own activity, or all activity on a file they can view (``?file=``)."""
+    permission_classes = [IsAuthenticated]
+    serializer_class = ActivityLogSerializer
+    cursor_fields = ('created_at', 'id')
+
+    def get_queryset(self):
+        logs = ActivityLog.objects.select_related('user')
+        file_id = self.request.query_params.get('file')
+        if file_id is None:
+            return logs.filter(user=self.request.user)
+        file = get_object_or_404(File, pk=file_id)
+        if not permissions.get_resolver(self.request).has(file, SharePermission.VIEW):
+            self.permission_denied(self.request)
+        return logs.filter(file=file)
+
+
+class PublicShareView(APIView):
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def get_link(self, request, uuid, resuming=False):
+        link = links.get_link(uuid)
+        # A link dies with its creator's right to share the resource.
+        target = link.file or link.folder
+        creator = permissions.get_resolver(request, link.created_by)
+        # A download claimed before the link was used up may still be resumed.
+        if not link.is_valid(check_downloads=not resuming) or target.trashed_at or not creator.has(target, SharePermission.ADMIN):
+            return None, Response({'error': 'share link is no longer valid'}, status=status.HTTP_410_GONE)
+        if not link.check_password(request.query_params.get('password', '')):
+            return None, Response({'error': 'password required'}, status=status.HTTP_403_FORBIDDEN)
+        return link, None
+
+    def get(self, request, uuid):
+        link, error = self.get_link(request, uuid)
+        if error:
+            return error
+        target = link.file or link.folder
+        etag = conditional.make_etag(
+            link.uuid, link.expires_at, link.max_downloads, link.download_count,
+            target.pk, target.updated_at, request.headers.get('Accept', '')
+        )
+        # Password-protected metadata must not be kept by shared caches.
+        public = not link.password
+        response = conditional.not_modified(request, etag)
+        if response is None:
+            response = Response(PublicShareSerializer(link).data)
+        return conditional.set_headers(response, etag, public=public)
+
+
+class PublicDownloadView(PublicShareView):
+    def get(self, request, uuid):
+        claim = request.query_params.get('claim')
+        resuming = bool(claim) and 'Range' in request.headers
+        link, error = self.get_link(request, uuid, resuming=resuming)
+        if error:
+            return error
+        file = link.file
+        if file is None and 'file' not in request.query_params:
+            folder = link.folder
+            if 'folder' in request.query_params:
+                folder = get_object_or_404(Folder, pk=request.query_params['folder'])
+                if not permissions.link_covers(link, folder):
+                    return Response({'error': 'folder is not part of this share'}, status=status.HTTP_404_NOT_FOUND)
+            if not links.claim_download(link):
+                return Response({'error': 'share link is no longer valid'}, status=status.HTTP_410_GONE)
+            return folder_archive_response(
+                request, folder, permissions.get_resolver(request, link.created_by)
+            )
+        file, error = self.get_file(request, link)
+        if error:
+            return error
+
+        # Only ranged requests continuing a claimed download past its first byte
+        # do not use up the link; asking for the start again is a new download.
+        if resuming and downloads.range_start(request, file) > 0 and links.continues_claim(claim, link, file):
+            return downloads.serve_file(request, file)
+        if not links.claim_download(link):
+            return Response({'error': 'share link is no longer valid'}, status=status.HTTP_410_GONE)
+        response = downloads.serve_file(request, file)
+        response['Download-Claim'] = links.claim_token(link, file)
+        return response
+
+    def get_file(self, request, link):
+        """The linked file, or the ``?file=`` inside a linked folder."""
+        if link.file is not None:
+            return link.file, None
+        file = get_object_or_404(
+            File.objects.select_related('folder'),
+            pk=request.query_params.get('file') or 0
+        )
+        if not permissions.link_covers(link, file):
+            return None, Response({'error': 'file is not part of this share'}, status=status.HTTP_404_NOT_FOUND)
+        return file, None
+
+
+class PublicSignedUrlView(PublicDownloadView):
+    """Trade one download of a share link for a signed URL, e.g. to hand to a player."""
+
+    def get(self, request, uuid):
+        link, error = self.get_link(request, uuid)
+        if error:
+            return error
+        file, error = self.get_file(request, link)
+        if error:
+            return error
+        if not signed.enabled():
+            return signed_downloads_disabled()
+        # The download itself never reaches us, so it counts now.
+        if not links.claim_download(link):
+            return Response({'error': 'share link is no longer valid'}, status=status.HTTP_410_GONE)
+        url, expires_at = signed.mint(request, file)
+        return Response({'url': url, 'expires_at': expires_at})
+
+
+class SignedDownloadView(View):
+    """Serve a signed download URL from its token alone, without touching the database."""
+
+    def get(self, request, token):
+        try:
+            payload = signed.verify(token)
+        except signing.SignatureExpired:
+            return JsonResponse({'error': 'download link has expired'}, status=status.HTTP_410_GONE)
+        except signing.BadSignature:
+            return JsonResponse({'error': 'invalid download link'}, status=status.HTTP_403_FORBIDDEN)
+        response = downloads.serve_file(
+            request, signed.payload_file(payload),
+            as_attachment=payload['a'], allow_ranges=payload['r'] == signed.RANGES
+        )
+        response['Cache-Control'] = f'private, max-age={signed.expires_in(payload)}'
+        return response
+
+
+class EffectivePermissionsView(APIView):
+    """Effective permissions of the caller on a batch of files and folders."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        resolver = permissions.get_resolver(request)
+        result = {}
+        for kind, model, resolve in (
+            ('files', File, resolver.files),
+            ('folders', Folder, resolver.folders),
+        ):
+            ids = [pk for pk in request.query_params.get(kind, '').split(',') if pk.isdigit()]
+            objects = model.objects.filter(pk__in=ids)
+            if model is File:
+                objects = objects.select_related('folder')
+            result[kind] = {
+                str(pk): permission
+                for pk, permission in resolve(list(objects)).items()
+                if permission
+            }
+        return Response(result)
+
+
+
+class ActivityStatsView(APIView):
+    """Daily activity counts, read from the pre-aggregated rollups."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        days = request.query_params.get('days', '')
+        days = min(int(days), 366) if days.isdigit() and int(days) > 0 else 30
+        since = timezone.localdate() - timedelta(days=days - 1)
+        rollups = ActivityRollup.objects.filter(day__gte=since)
+
+        resolver = permissions.get_resolver(request)
+        if 'file' in request.query_params:
+            file = get_object_or_404(File, pk=request.query_params['file'])
+            if not resolver.has(file, SharePermission.VIEW):
+                self.permission_denied(request)
+            rollups = rollups.filter(file_id=file.pk)
+        elif 'folder' in request.query_params:
+            folder = get_object_or_404(Folder, pk=request.query_params['folder'])
+            if not resolver.has(folder, SharePermission.VIEW):
+                self.permission_denied(request)
+            rollups = rollups.filter(folder_id=folder.pk)
+        else:
+            rollups = rollups.filter(user_id=request.user.pk)
+
+        return Response(list(
+            rollups.values('day', 'activity_type')
+            .annotate(count=Sum('count'))
+            .order_by('day', 'activity_type')
+        ))
+
+
+class AvatarThumbnailView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, user_id):
+        user = get_object_or_404(User, pk=user_id)
+        if not user.avatar:
+            return Response({'error': 'user has no avatar'}, status=status.HTTP_404_NOT_FOUND)
+        source = thumbnails.avatar_source(user)
+        response = thumbnail_response(request, user.avatar, source)
+        if response is None:
+            if thumbnails.failed(user.avatar.storage, source):
+                return thumbnail_failed()
+            thumbnails.schedule_avatar(user)
+            return thumbnail_pending()
+        return response
+
+
+class UsageView(APIView):
+    """Storage used by the caller, read from the usage counters."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        user = request.user
+        if request.user.is_staff and 'user' in request.query_params:
+            user = get_object_or_404(User, pk=request.query_params['user'])
+        return Response(usage.summary(user))
+
+
+class MetricsView(APIView):
+    """Request profiles buffered by this process, in the Prometheus text format."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        if not settings.INSTRUMENTATION_ENABLED:
+            raise Http404('Instrumentation is disabled.')
+        return HttpResponse(
+            instrumentation.render_metrics(instrumentation.snapshot()),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
+
+
+class SearchView(APIView):
+    """Ranked search over the files and folders the caller can see."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        kinds = [kind for kind in search.KINDS if request.query_params.get('type') in (None, '', kind)]
+        page = request.query_params.get('page', '')
+        page = int(page) if page.isdigit() and int(page) > 0 else 1
+        page_size = request.query_params.get('page_size', '')
+        page_size = min(int(page_size), settings.SEARCH_MAX_PAGE_SIZE) if page_size.isdigit() and int(page_size) > 0 else 20
+
+        total, hits = search.search(
+            request.user, query, kinds, limit=page_size, offset=(page - 1) * page_size
+        )
+        files = File.objects.in_bulk([pk for kind, pk, _ in hits if kind == 'file'])
+        folders = Folder.objects.in_bulk([pk for kind, pk, _ in hits if kind == 'folder'])
+
+        results = []
+        for kind, pk, score in hits:
+            if kind == 'file' and pk in files:
+                file = files[pk]
+                results.append({
+                    'type': 'file', 'id': pk, 'name': file.name, 'folder': file.folder_id,
+                    'mime_type': file.mime_type, 'size': file.size,
+                    'updated_at': file.updated_at, 'score': score,
+                })
+            elif kind == 'folder' and pk in folders:
+                folder = folders[pk]
+                results.append({
+                    'type': 'folder', 'id': pk, 'name': folder.name, 'parent': folder.parent_id,
+                    'description': folder.description, 'updated_at': folder.updated_at, 'score': score,
+                })
+
+        return Response({
+            'count': total,
+            'page': page,
+            'next': page + 1 if page * page_size < total else None,
+            'results': results,
+        })
+
+
+class ChangesView(APIView):
+    """Changes the caller can see since ``?cursor=``, for sync clients.
+
+    Without a cursor this only returns the current one, to be taken right
+    before a full listing. Each batch keeps the last entry per object, so a
+    client should apply updates to objects it does not know as creates.
+    ``?wait=<seconds>`` holds the request open until something changes.
+    A 410 ``resync_required`` means the cursor has been compacted away.
+    """
+    permission_classes = [IsAuthenticated]
+    default_limit = 500
+    max_limit = 1000
+
+    def get(self, request):
+        cursor = request.query_params.get('cursor', '')
+        if not cursor:
+            return Response({'cursor': journal.ceiling(), 'has_more': False, 'changes': []})
+        if not cursor.isdigit():
+            return Response({'error': 'invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+        cursor = int(cursor)
+        limit = request.query_params.get('limit', '')
+        limit = min(int(limit), self.max_limit) if limit.isdigit() and int(limit) > 0 else self.default_limit
+        wait = request.query_params.get('wait', '')
+        wait = min(int(wait), settings.CHANGES_MAX_WAIT) if wait.isdigit() else 0
+
+        try:
+            next_cursor, has_more, changes = journal.changes_since(request.user, cursor, limit)
+        except journal.ResyncRequired:
+            return Response(
+                {'error': 'cursor has expired, resync required', 'resync_required': True},
+                status=status.HTTP_410_GONE
+            )
+        if not changes and wait and journal.wait_for_changes(request.user, next_cursor, wait):
+            next_cursor, has_more, changes = journal.changes_since(request.user, next_cursor, limit)
+        return Response({'cursor': next_cursor, 'has_more': has_more, 'changes': changes})